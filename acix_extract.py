@@ -7,34 +7,682 @@ Require: see mtools.yml for conda environment configuration
 1.0.4: bugfix on Maja R2 conflicting with resampled Reference product. Strategy here is to resample Maja R2 at (900, 900)
 pixels with nearest neighbor.
 
+1.0.5: --band accepts a comma separated list of band ids or 'all', each matching pair of products being read once for
+all bands. Bugfix on stacked vectors, which stacked the cumulated location vectors at each match, and on keepall
+vectors, which were appended to the negative ones.
+
+1.0.6: --jobs to extract sites in parallel, and --checkpoint/--resume to record the samples of each processed match and
+skip them when a run is restarted. Any failure on a match is logged and skips that match only.
+
+1.0.7: R2 bands are compared through broadcast views instead of upsampled copies of maja band and QA, and
+--resample downsample compares maja R2 with the 2x2 mean of the reference where its 4 pixels are valid.
+
+1.0.8: --output apu records APU statistics per bin of --samples instead of samples, merged across matches and sites.
+
+1.0.9: --output histogram records a joint histogram of ref against maja of --hist-step bins instead of samples.
+
+1.0.10: --recursive to search products in sub-directories of nested site layouts.
+
+1.0.11: collections and reference products are recorded in a persistent catalog (--catalog FILE, --rebuild-catalog), so
+that they are found out again only if they changed.
+
+1.0.12: products are matched by a join on dates instead of a search per product, --tolerance to match products up to
+a number of days apart.
+
+1.0.13: lines of the list may give several processor collections after the reference one (--processors to label them),
+each reference band and its QA being read once per match for all processors.
+
+1.0.14: location files are written with --stack too, stacked files being built from them in list order, so that --jobs
+workers send back counts only.
+
 """
 
 __author__ = "jerome.colin'at'cesbio.cnes.fr"
 __license__ = "MIT"
-__version__ = "1.0.4"
+__version__ = "1.0.14"
 
 import sys
+import os
 import argparse
+import concurrent.futures
+import json
 import numpy as np
 from matplotlib import pylab as pl
 import common.utilities as utl
 import common.Product as prd
 import common.Collection as clc
 import common.Comparison as cmp
+import common.Store as stc
+import common.Apu as apu
+import common.Catalog as ctl
+
+
+# file name prefixes of samples, per location and stacked
+LOCAL_NAMES = {"valid": "_valid_", "negative": "_sr_lt_0_", "keepall": "_keep_all_"}
+STACKED_NAMES = {"valid": "Stacked_valid_", "negative": "Stacked_sr_lt_0_", "keepall": "Stacked_sr_keep_all_"}
+# file suffix of the manifest of a site in a checkpoint directory, written by the process extracting the site only
+MANIFEST_SUFFIX = "_manifest.jsonl"
+# file suffixes of outputs recording statistics instead of samples
+STATS_SUFFIXES = {"apu": apu.SUFFIX, "histogram": apu.HIST_SUFFIX}
+
+
+def parse_bands(band_arg, band_count):
+    """
+    Parse the --band argument
+    :param band_arg: "all", a band id or a comma separated list of band ids
+    :param band_count: number of bands in the band definition
+    :return: a list of band ids, or None if band_arg is not valid
+    """
+    if band_arg == "all":
+        return list(range(band_count))
+
+    try:
+        band_ids = [int(b) for b in band_arg.split(',')]
+    except ValueError:
+        return None
+
+    for b in band_ids:
+        if b < 0 or b >= band_count:
+            return None
+
+    return band_ids
+
+
+def new_stats(args, logger):
+    """
+    Empty statistics of --output apu or histogram
+    :param args: parsed arguments
+    :param logger: logger instance
+    :return: Apu_stats or Joint_histogram
+    """
+    if args.output == "histogram":
+        return apu.Joint_histogram(logger, step=args.hist_step, lo=args.hist_range[0], hi=args.hist_range[1])
+    return apu.Apu_stats(logger, samples=args.samples)
+
+
+def get_processors(paths_list, processors_arg, logger):
+    """
+    Labels of the processor collections of the list file, each line being a reference collection followed by one
+    collection per processor
+    :param paths_list: lines of the list file
+    :param processors_arg: the --processors argument, a comma separated list of labels, or None
+    :param logger: logger instance
+    :return: a list of labels, [None] for a single unlabelled processor
+    """
+    columns = set([len(p.split(',')) for p in paths_list])
+    if len(columns) != 1 or min(columns) < 2:
+        logger.error("All lines of the list must have a reference collection and the same number of processor "
+                     "collections")
+        sys.exit(3)
+    count = columns.pop() - 1
+
+    if processors_arg is not None:
+        processors = processors_arg.split(',')
+        if len(processors) != count or len(set(processors)) < count:
+            logger.error("--processors %s doesn't give %i distinct labels" % (processors_arg, count))
+            sys.exit(3)
+        return processors
+
+    if count == 1:
+        return [None]
+    return ["p%i" % (k + 1) for k in range(count)]
+
+
+def get_output_prefix(processor):
+    """
+    :param processor: processor label, see get_processors
+    :return: prefix of output files, the directory of the processor if it is labelled
+    """
+    if processor is None:
+        return ""
+    return os.path.join(processor, "")
+
+
+def get_local_keys(keys, args):
+    """
+    Sample keys kept per location, whatever the output: "valid" samples are not kept with --keepall, unless locations
+    are stacked
+    :param keys: sample keys
+    :param args: parsed arguments
+    :return: a list of sample keys
+    """
+    return [key for key in keys if key != "valid" or not args.keepall or args.stack]
+
+
+def load_stats(args, logger, fname):
+    """
+    Read statistics of --output apu or histogram
+    :param args: parsed arguments
+    :param logger: logger instance
+    :param fname: file written by save
+    :return: Apu_stats or Joint_histogram
+    """
+    if args.output == "histogram":
+        return apu.Joint_histogram(logger, fname=fname)
+    return apu.Apu_stats(logger, fname=fname)
+
+
+def save_samples(fname, samples):
+    """
+    Save a pair of (ref, maja) vectors as float32 in a compressed npz file
+    :param fname: file name, without extension
+    :param samples: (ref, maja) vectors or Vector_accumulator
+    """
+    if isinstance(samples[0], utl.Vector_accumulator):
+        samples = (samples[0].to_array(), samples[1].to_array())
+    np.savez_compressed(fname, [samples[0].astype('float32'), samples[1].astype('float32')])
+
+
+def load_samples(fname):
+    """
+    Read a pair of (ref, maja) vectors saved by save_samples
+    :param fname: file name, without extension
+    :return: (ref, maja) vectors
+    """
+    with np.load(fname + ".npz") as data:
+        samples = data["arr_0"]
+    return samples[0], samples[1]
+
+
+def filter_samples(b_ref, m_ref_qa, b_maja, m_maja_qa, negative=False, keepall=False):
+    """
+    Select the pairs of reference and maja surface reflectances to keep
+    :param b_ref: reference band
+    :param m_ref_qa: reference QA (valid=1)
+    :param b_maja: maja band, same shape as b_ref
+    :param m_maja_qa: maja validity mask (valid=1 or True)
+    :param negative: also select cloudfree pairs with sr < 0
+    :param keepall: also select all cloudfree pairs
+    :return: a dict of (ref, maja) vectors, with key "valid" and optionally "negative" and "keepall"
+    """
+    samples = {}
+
+    # default filter : any cloudfree flaged both by ref and maja and sr >= 0
+    is_valid = np.where(
+        (b_ref > 0)
+        & (b_maja > 0)
+        & (m_ref_qa == 1)
+        & (m_maja_qa == 1)
+    )
+    samples["valid"] = (b_ref[is_valid], b_maja[is_valid])
+
+    if negative:
+        # keep only sr < 0 (either ref or maja) though flaged cloudfree
+        is_cloudfree_but_negative = np.where(
+            (m_maja_qa == 1)
+            & (m_ref_qa == 1)
+            & ((b_maja < 0) | (b_ref < 0))
+        )
+        samples["negative"] = (b_ref[is_cloudfree_but_negative], b_maja[is_cloudfree_but_negative])
+
+    if keepall:
+        # keep all rs values, negative included, by-pass default is_valid
+        is_cloudfree_keep_all = np.where(
+            (m_maja_qa == 1)
+            & (m_ref_qa == 1)
+        )
+        samples["keepall"] = (b_ref[is_cloudfree_keep_all], b_maja[is_cloudfree_keep_all])
+
+    return samples
+
+
+def scale_samples(samples, ref_scalef, maja_scalef):
+    """
+    Apply scale factors to samples selected on raw integer bands
+    :param samples: see filter_samples
+    :return: see filter_samples
+    """
+    return {key: (samples[key][0] / ref_scalef, samples[key][1] / maja_scalef) for key in samples}
+
+
+def resample_r2(b_ref, m_ref_qa, b_maja, m_maja_qa, resample):
+    """
+    Bring a reference band at full resolution and a maja band at R2 to a common grid, without copying them
+    :param b_ref: reference band
+    :param m_ref_qa: reference QA (valid=1)
+    :param b_maja: maja R2 band, half the size of b_ref
+    :param m_maja_qa: maja R2 validity mask
+    :param resample: "upsample" to compare each reference pixel with the maja pixel it falls in, through broadcast
+    views (same samples as a nearest neighbor upsampling of maja), or "downsample" to compare each maja pixel with the
+    mean of its 2x2 reference pixels, valid only if all 4 of them are valid
+    :return: b_ref, m_ref_qa, b_maja, m_maja_qa of the same shape, ordered as b_ref if upsampled
+    """
+    rows, cols = np.shape(b_maja)
+    if np.shape(b_ref) != (2 * rows, 2 * cols):
+        raise TypeError("Reference band of shape %s is not twice the maja band of shape %s" %
+                        (str(np.shape(b_ref)), str(np.shape(b_maja))))
+
+    # (row, 2, col, 2) views, the second and last axes running over the 2x2 reference pixels of a maja pixel
+    b_ref = np.reshape(b_ref, (rows, 2, cols, 2))
+    m_ref_qa = np.reshape(m_ref_qa, (rows, 2, cols, 2))
+
+    if resample == "downsample":
+        return b_ref.mean(axis=(1, 3)), (m_ref_qa == 1).all(axis=(1, 3)), b_maja, m_maja_qa
+
+    return (b_ref, m_ref_qa, np.broadcast_to(b_maja[:, np.newaxis, :, np.newaxis], (rows, 2, cols, 2)),
+            np.broadcast_to(m_maja_qa[:, np.newaxis, :, np.newaxis], (rows, 2, cols, 2)))
+
+
+def read_ref(p_ref, band_def):
+    """
+    Read a reference band in full, as raw integers, and its QA
+    :param p_ref: Product_hdf_acix instance
+    :param band_def: a band definition of bdef_acix
+    :return: band, its scale factor, QA (valid=1)
+    """
+    b_ref, ref_scalef = p_ref.get_band(p_ref.find_band(band_def[0]), scalef=p_ref.sre_scalef, defer_scaling=True)
+    return b_ref, ref_scalef, p_ref.get_validity_mask()
+
+
+def filter_match(p_ref, p_maja, band_def, negative, keepall, logger, resample="upsample", ref=None):
+    """
+    Read a band of a matching pair of products in full and select samples. Bands are kept as raw integers while
+    filtering, and only the selected samples are scaled
+    :param p_ref: Product_hdf_acix instance
+    :param p_maja: Product_dir_maja instance
+    :param band_def: a band definition of bdef_acix
+    :param resample: for R2 bands, see resample_r2
+    :param ref: reference band as returned by read_ref, read from p_ref if None
+    :return: see filter_samples
+    """
+    if ref is None:
+        ref = read_ref(p_ref, band_def)
+    b_ref, ref_scalef, m_ref_qa = ref
+    b_maja, maja_scalef = p_maja.get_band(p_maja.find_band(band_def[1]), scalef=p_maja.sre_scalef,
+                                          defer_scaling=True)
+    m_maja_qa = p_maja.get_validity_mask(band_def[2])
+
+    # Issue 32:
+    if band_def[2] == "R2":
+        b_ref, m_ref_qa, b_maja, m_maja_qa = resample_r2(b_ref, m_ref_qa, b_maja, m_maja_qa, resample)
+        if resample == "downsample":
+            logger.info("Downscaling %s and its QA to %s with 2x2 mean" % (band_def[0], band_def[2]))
+        else:
+            logger.info("Upscaling %s and its QA from %s to full resolution with nearest neighbor" %
+                        (band_def[1], band_def[2]))
+
+    return scale_samples(filter_samples(b_ref, m_ref_qa, b_maja, m_maja_qa, negative, keepall), ref_scalef,
+                         maja_scalef)
+
+
+def filter_match_blockwise(p_ref, p_majas, band_def, block_rows, negative, keepall):
+    """
+    Stream a R1 band of matching products by full-width blocks of rows and select samples, so that only one block of
+    each band and mask is in memory at once, the reference being read once for all maja products. Samples come in the
+    same order as with filter_match. A maja product failing is dropped from the next blocks, the others going on
+    :param p_ref: Product_hdf_acix instance
+    :param p_majas: list of Product_dir_maja instances
+    :param band_def: a band definition of bdef_acix, at R1
+    :param block_rows: number of rows of a block
+    :return: a list of samples (see filter_samples, None if failed) and a list of exceptions (None if succeeded), one
+    item per maja product
+    """
+    ref_blocks = p_ref.iter_blocks([p_ref.find_band(band_def[0]), p_ref.find_band("refqa")],
+                                   block_shape=(block_rows, None))
+
+    maja_blocks = [None for p_maja in p_majas]
+    errors = [None for p_maja in p_majas]
+    for m, p_maja in enumerate(p_majas):
+        try:
+            maja_blocks[m] = p_maja.iter_blocks([p_maja.find_band(band_def[1]),
+                                                 p_maja.find_band("CLM_" + band_def[2]),
+                                                 p_maja.find_band("EDG_" + band_def[2])],
+                                                block_shape=(block_rows, None))
+        except (Exception, SystemExit) as err:
+            errors[m] = err
+
+    block_samples = [[] for p_maja in p_majas]
+    for ref_window, (b_ref, m_ref_qa) in ref_blocks:
+        for m, p_maja in enumerate(p_majas):
+            if errors[m] is not None:
+                continue
+            try:
+                maja_block = next(maja_blocks[m], None)
+                if maja_block is None:
+                    raise TypeError("Maja band %s has less blocks than reference band %s" % (band_def[1],
+                                                                                             band_def[0]))
+                maja_window, (b_maja, clm, edg) = maja_block
+                if ref_window != maja_window:
+                    raise TypeError("Reference block %s doesn't match maja block %s" % (str(ref_window),
+                                                                                       str(maja_window)))
+                block_samples[m].append(filter_samples(b_ref, m_ref_qa, b_maja, p_maja.get_mask_bool(clm, edg),
+                                                       negative, keepall))
+            except (Exception, SystemExit) as err:
+                errors[m] = err
+
+    for m in range(len(p_majas)):
+        if errors[m] is not None:
+            continue
+        try:
+            if next(maja_blocks[m], None) is not None:
+                raise TypeError("Maja band %s has more blocks than reference band %s" % (band_def[1], band_def[0]))
+        except (Exception, SystemExit) as err:
+            errors[m] = err
+
+    samples = [None for p_maja in p_majas]
+    for m in range(len(p_majas)):
+        if errors[m] is not None:
+            continue
+        # an empty reference has no block, and gets empty samples as with filter_match
+        blocks = block_samples[m] or [filter_samples(*[np.zeros(0)] * 4, negative=negative, keepall=keepall)]
+        samples[m] = scale_samples({key: (np.concatenate([s[key][0] for s in blocks]),
+                                          np.concatenate([s[key][1] for s in blocks])) for key in blocks[0]},
+                                   p_ref.sre_scalef, p_majas[m].sre_scalef)
+    return samples, errors
+
+
+def log_skipped(logger, band_def, timestamp, processor, err):
+    """
+    Log a comparison skipped because of an error
+    :param band_def: a band definition of bdef_acix
+    :param timestamp: timestamp of the match
+    :param processor: processor label, see get_processors, None for all processors
+    :param err: exception
+    """
+    if processor is not None:
+        timestamp = "%s of %s" % (timestamp, processor)
+
+    if isinstance(err, TypeError):
+        logger.warning("Had to skip comparison of %s for %s because of unexpected product dimension (see previous "
+                       "error)" % (band_def[0], timestamp))
+    else:
+        # eg. a corrupt product, the match being retried with --resume
+        logger.error("Had to skip comparison of %s for %s because of %s" % (band_def[0], timestamp, repr(err)))
+
+
+def read_manifest(fname):
+    """
+    Read the manifest of a site, later records overriding earlier ones
+    :param fname: manifest file name, see write_shard
+    :return: a dict of manifest records by (site, timestamp, band, processor label or None)
+    """
+    manifest = {}
+    if not os.path.isfile(fname):
+        return manifest
+
+    with open(fname, 'r') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # last line of an interrupted run
+                continue
+            manifest[(record["site"], record["timestamp"], record["band"], record.get("processor"))] = record
+
+    return manifest
+
+
+def write_shard(checkpoint, site, match, band_samples, keys, processor=None, **options):
+    """
+    Save the samples of one match as float32 in a shard of the checkpoint directory, then record each band of it in
+    the manifest of the site (one json record per line)
+    :param checkpoint: checkpoint directory
+    :param site: location name
+    :param match: [timestamp, reference product, maja product] of a match of Comparison.matching_products
+    :param band_samples: a dict of samples (see filter_samples) by band name
+    :param keys: sample keys
+    :param processor: processor label, see get_processors
+    :param options: extraction options recorded with each band, eg. resample
+    """
+    if processor is None:
+        shard = "%s_%s_%s.npz" % (site, match[0], "_".join(band_samples))
+    else:
+        shard = "%s_%s_%s_%s.npz" % (site, processor, match[0], "_".join(band_samples))
+    arrays = {}
+    for band in band_samples:
+        for key in keys:
+            arrays["%s_%s_ref" % (band, key)] = band_samples[band][key][0].astype('float32')
+            arrays["%s_%s_maja" % (band, key)] = band_samples[band][key][1].astype('float32')
+
+    # a shard is complete once renamed
+    with open(os.path.join(checkpoint, shard + ".tmp"), 'wb') as f:
+        np.savez_compressed(f, **arrays)
+    os.replace(os.path.join(checkpoint, shard + ".tmp"), os.path.join(checkpoint, shard))
+
+    with open(os.path.join(checkpoint, site + MANIFEST_SUFFIX), 'a') as f:
+        for band in band_samples:
+            record = {"site": site, "timestamp": match[0], "band": band, "ref": match[1], "maja": match[2],
+                      "keys": keys, "samples": len(band_samples[band]["valid"][0]), "shard": shard}
+            if processor is not None:
+                record["processor"] = processor
+            record.update(options)
+            f.write(json.dumps(record) + "\n")
+
+
+def is_completed(checkpoint, record, match, keys, band_def, resample):
+    """
+    Check that a manifest record is a completed extraction of a band of a match with the current options
+    :param checkpoint: checkpoint directory
+    :param record: manifest record, or None
+    :param match: [timestamp, reference product, maja product]
+    :param keys: sample keys
+    :param band_def: a band definition of bdef_acix
+    :param resample: resample mode, see resample_r2
+    :return: True if the samples of the band can be read from the shard of the record
+    """
+    return record is not None and record["ref"] == match[1] and record["maja"] == match[2] \
+        and set(keys) <= set(record["keys"]) \
+        and (band_def[2] != "R2" or record.get("resample", "upsample") == resample) \
+        and os.path.isfile(os.path.join(checkpoint, record["shard"]))
+
+
+def read_shard(checkpoint, record, keys):
+    """
+    Read the samples of a band from a shard
+    :param checkpoint: checkpoint directory
+    :param record: manifest record
+    :param keys: sample keys
+    :return: see filter_samples
+    """
+    with np.load(os.path.join(checkpoint, record["shard"])) as shard:
+        return {key: (shard["%s_%s_ref" % (record["band"], key)], shard["%s_%s_maja" % (record["band"], key)])
+                for key in keys}
+
+
+def extract_site(task):
+    """
+    Extract samples of some bands for all matching products of a site, and save them unless they are to be stacked.
+    Products of all processors are matched together, so that each reference band is read once for all of them. Also
+    the process pool worker of --jobs
+    :param task: (list file line, dict of band definitions per band id, sample keys, parsed arguments, logger, dict of
+    manifest records of completed matches, Catalog or None, processor labels)
+    :return: location name, matches and valid samples counts per processor as dicts per band id, number of matches
+    """
+    p, band_defs, keys, args, logger, manifest, catalog, processors = task
+    paths = p.split(',')
+    location_name = paths[0].split('/')[-1]
+    outputs = [get_output_prefix(processor) + location_name for processor in processors]
+    local_keys = get_local_keys(keys, args)
+
+    # vector containers for location specific data, per processor and band, or sample stores written as matches come,
+    # or APU statistics or joint histograms
+    if args.output == "store":
+        v_local = [{b: {key: stc.Sample_store(output + LOCAL_NAMES[key] + band_defs[b][0] + ".store", logger,
+                                              mode="w") for key in local_keys} for b in band_defs}
+                   for output in outputs]
+    elif args.output in STATS_SUFFIXES:
+        v_local = [{b: {key: new_stats(args, logger) for key in local_keys} for b in band_defs} for output in outputs]
+    else:
+        v_local = [{b: {key: (utl.Vector_accumulator(), utl.Vector_accumulator()) for key in local_keys}
+                    for b in band_defs} for output in outputs]
+    local_match_count = [{b: 0 for b in band_defs} for output in outputs]
+    len_check = [{b: 0 for b in band_defs} for output in outputs]
+    match_count = 0
+
+    # a catalog may be shared by all sites of the process
+    if catalog is not None:
+        catalog_counts = (catalog.hits, catalog.misses)
+
+    collections = [clc.Collection(path, logger, recursive=args.recursive, catalog=catalog) for path in paths]
+    compare = cmp.Comparison_multi(collections, logger, tolerance=args.tolerance)
+
+    for match in compare:
+        match_samples = [{} for processor in processors]
+        todo = [[] for processor in processors]
+        for k, processor in enumerate(processors):
+            for b in band_defs:
+                record = manifest.get((location_name, match[0], band_defs[b][0], processor))
+                if is_completed(args.checkpoint, record, [match[0], match[1], match[2 + k]], keys, band_defs[b],
+                                args.resample):
+                    match_samples[k][b] = read_shard(args.checkpoint, record, keys)
+                else:
+                    todo[k].append(b)
+
+        resumed = sum([len(band_defs) - len(bands) for bands in todo])
+        if resumed > 0:
+            logger.info("Resuming %s from %i completed band(s)" % (match[0], resumed))
+
+        if sum([len(bands) for bands in todo]) > 0:
+            logger.info("One-by-one for %s between %s and %s" % (match[0], match[1], " and ".join(match[2:])))
+            # Each product is opened once for all bands, its validity masks being computed once per resolution
+            p_majas = [None for processor in processors]
+            try:
+                p_ref = prd.Product_hdf_acix(match[1], logger, catalog=catalog)
+            except (Exception, SystemExit) as err:
+                logger.error("Had to skip %s because products could not be opened: %s" % (match[0], repr(err)))
+                todo = [[] for processor in processors]
+
+            for k in range(len(processors)):
+                if len(todo[k]) == 0:
+                    continue
+                try:
+                    p_majas[k] = prd.Product_dir_maja(match[2 + k], logger, catalog=catalog)
+                except (Exception, SystemExit) as err:
+                    logger.error("Had to skip %s because products could not be opened: %s" % (match[0], repr(err)))
+                    todo[k] = []
+
+            new_samples = [{} for processor in processors]
+            for b in band_defs:
+                targets = [k for k in range(len(processors)) if b in todo[k]]
+                if len(targets) == 0:
+                    continue
+
+                # the reference band and its QA are read once for all processors, each processor failing on its own
+                try:
+                    if args.blocks > 0 and band_defs[b][2] == "R1":
+                        samples, errors = filter_match_blockwise(p_ref, [p_majas[k] for k in targets], band_defs[b],
+                                                                 args.blocks, args.negative, args.keepall)
+                    else:
+                        ref = read_ref(p_ref, band_defs[b])
+                except (Exception, SystemExit) as err:
+                    log_skipped(logger, band_defs[b], match[0], None, err)
+                    continue
+
+                for t, k in enumerate(targets):
+                    if args.blocks > 0 and band_defs[b][2] == "R1":
+                        if errors[t] is None:
+                            new_samples[k][b] = samples[t]
+                        else:
+                            log_skipped(logger, band_defs[b], match[0], processors[k], errors[t])
+                        continue
+
+                    try:
+                        new_samples[k][b] = filter_match(p_ref, p_majas[k], band_defs[b], args.negative, args.keepall,
+                                                         logger, resample=args.resample, ref=ref)
+                    except (Exception, SystemExit) as err:
+                        log_skipped(logger, band_defs[b], match[0], processors[k], err)
+
+            for k, processor in enumerate(processors):
+                if args.checkpoint is not None and len(new_samples[k]) > 0:
+                    write_shard(args.checkpoint, location_name, [match[0], match[1], match[2 + k]],
+                                {band_defs[b][0]: new_samples[k][b] for b in new_samples[k]}, keys,
+                                processor=processor, resample=args.resample)
+                match_samples[k].update(new_samples[k])
+
+        if sum([len(samples) for samples in match_samples]) > 0:
+            match_count += 1
+
+        # stack local values for all timestamp matches, in band order whether they were resumed or not
+        for k in range(len(processors)):
+            for b in band_defs:
+                if b not in match_samples[k]:
+                    continue
+
+                for key in local_keys:
+                    if args.output == "store":
+                        v_local[k][b][key].append(match_samples[k][b][key][0], match_samples[k][b][key][1],
+                                                  site=location_name, timestamp=match[0])
+                    elif args.output in STATS_SUFFIXES:
+                        # float32 as saved in npz files, stores and shards, so that statistics do not depend on the
+                        # output or on the match being resumed
+                        v_local[k][b][key].add(match_samples[k][b][key][0].astype('float32'),
+                                               match_samples[k][b][key][1].astype('float32'))
+                    else:
+                        v_local[k][b][key][0].append(match_samples[k][b][key][0])
+                        v_local[k][b][key][1].append(match_samples[k][b][key][1])
+
+                local_match_count[k][b] += 1
+                len_check[k][b] += len(match_samples[k][b]["valid"][0])
+
+    # samples or statistics are saved per location in any case (stores are complete), the main process stacking them
+    # from their files rather than receiving them
+    if args.output != "store":
+        for k in range(len(processors)):
+            for b in band_defs:
+                if local_match_count[k][b] == 0:
+                    continue
+
+                for key in local_keys:
+                    if args.output in STATS_SUFFIXES:
+                        v_local[k][b][key].save(outputs[k] + LOCAL_NAMES[key] + band_defs[b][0]
+                                                + STATS_SUFFIXES[args.output])
+                    else:
+                        save_samples(outputs[k] + LOCAL_NAMES[key] + band_defs[b][0], v_local[k][b][key])
+
+    if catalog is not None:
+        logger.info("Catalog for %s: %i hits, %i misses" % (location_name, catalog.hits - catalog_counts[0],
+                                                             catalog.misses - catalog_counts[1]))
+
+    return location_name, local_match_count, len_check, match_count
 
 
 def main():
     # Argument parser
     parser = argparse.ArgumentParser()
     parser.add_argument("list", help="List of paths of collection")
-    parser.add_argument("--band", help="Specific band in acix band definition", type=int, required=True)
+    parser.add_argument("--band", "--bands", help="Band id in acix band definition, a comma separated list of band ids "
+                                                  "or 'all', all bands being extracted in a single pass", type=str,
+                        required=True)
     parser.add_argument("--samples", help="Reflectance sampling, defaults to 100 (ie. 0.01)", type=int, default=100)
     parser.add_argument("-s", "--save", help="Write location results as npy instead of stacking in memory",
                         action="store_true", default=False)
+    parser.add_argument("--blocks", help="Stream R1 bands by blocks of BLOCKS rows, defaults to 0 (read in full)",
+                        type=int, default=0)
+    parser.add_argument("--resample", help="R2 bands: upsample maja to full resolution with nearest neighbor "
+                                           "(default), or downsample reference with 2x2 mean",
+                        choices=["upsample", "downsample"], default="upsample")
+    parser.add_argument("-j", "--jobs", help="Number of sites extracted in parallel, defaults to 1", type=int,
+                        default=1)
+    parser.add_argument("--checkpoint", help="Directory of the site manifests and of the samples of each processed "
+                                             "match", type=str)
+    parser.add_argument("--resume", help="Skip matches and bands already recorded in the --checkpoint manifests",
+                        action="store_true", default=False)
+    parser.add_argument("--catalog", help="Catalog of collections and products (SQLite file, eg. %s), none by "
+                                          "default" % ctl.DEFAULT_NAME, type=str, default=None)
+    parser.add_argument("--rebuild-catalog", help="Drop all entries of the catalog first", action="store_true",
+                        default=False)
+    parser.add_argument("--recursive", help="Search products in sub-directories of collections without a YYYYMMDD "
+                                            "pattern in their name (nested site layouts)", action="store_true",
+                        default=False)
+    parser.add_argument("--tolerance", help="Match products up to TOLERANCE days apart, the nearest in time, defaults "
+                                            "to 0 (same date)", type=int, default=0)
+    parser.add_argument("--processors", help="Comma separated labels of the processor collections following the "
+                                             "reference collection on each line of the list, defaults to p1,p2... "
+                                             "if there are several, the outputs of each processor being written in "
+                                             "a directory of its label", type=str)
     parser.add_argument("-v", "--verbose", help="Set verbosity to DEBUG level", action="store_true", default=False)
     parser.add_argument("--negative", help="Keep only sr lt 0 and flagged cloud-free", action="store_true", default=False)
     parser.add_argument("--keepall", help="Keep cloudfree sr <= 0 in the dataset, while default behavior is only rs > 0", action="store_true", default=False)
-    parser.add_argument("--stack", help="Stack all sites in one file", action="store_true", default=False)
+    parser.add_argument("--stack", help="Stack all sites in one file, from the files of each site", action="store_true",
+                        default=False)
+    parser.add_argument("--output", help="npz: compressed files written once per location (default), store: sample "
+                                         "stores appended at each match, see common/Store.py, apu: APU statistics "
+                                         "per bin of --samples, histogram: joint histogram of ref against maja, see "
+                                         "common/Apu.py", choices=["npz", "store", "apu", "histogram"], default="npz")
+    parser.add_argument("--hist-step", help="--output histogram: bin width, defaults to 0.0005", type=float,
+                        default=0.0005)
+    parser.add_argument("--hist-range", help="--output histogram: range of both axes, defaults to 0 1", type=float,
+                        nargs=2, default=[0.0, 1.0])
 
     args = parser.parse_args()
 
@@ -51,154 +699,128 @@ def main():
         ["band11", "SRE_B11.", "R2", []],
         ["band12", "SRE_B12.", "R2", []])
 
-    band_id = args.band
+    band_ids = parse_bands(args.band, len(bdef_acix))
 
     # Create the logger
-    logger = utl.get_logger('acix_validate_' + bdef_acix[band_id][0], args.verbose)
-
-    if (band_id < 0 or band_id > len(bdef_acix)):
-        logger.error("Band ID out of range with value %i" % band_id)
+    if band_ids is None:
+        logger = utl.get_logger('acix_validate', args.verbose)
+        logger.error("Band ID out of range or not valid with value %s" % args.band)
         sys.exit(3)
-
-    # vector containers for stacked data
-    v_stacked_valid_ref = np.zeros((0))
-    v_stacked_valid_maja = np.zeros((0))
-    v_stacked_lt0_ref = np.zeros((0))
-    v_stacked_lt0_maja = np.zeros((0))
-    v_stacked_keep_all_ref = np.zeros((0))
-    v_stacked_keep_all_maja = np.zeros((0))
-
-    match_count = 0
-    len_check = 0
+    elif args.band == "all":
+        logger = utl.get_logger('acix_validate_all', args.verbose)
+    else:
+        logger = utl.get_logger('acix_validate_' + '_'.join([bdef_acix[b][0] for b in band_ids]), args.verbose)
+
+    # samples kept, see filter_samples
+    keys = ["valid"]
+    if args.negative:
+        keys.append("negative")
+    if args.keepall:
+        keys.append("keepall")
 
     f = open(args.list, 'r')
     paths_list = f.read().splitlines()
+    processors = get_processors(paths_list, args.processors, logger)
+    outputs = [get_output_prefix(processor) for processor in processors]
+    for output in outputs:
+        if output != "":
+            os.makedirs(output, exist_ok=True)
+
+    # vector containers for stacked data, per processor and band
+    if args.output == "store" and args.stack:
+        v_stacked = [{b: {key: stc.Sample_store(output + STACKED_NAMES[key] + bdef_acix[b][0] + ".store", logger,
+                                                mode="w") for key in keys} for b in band_ids} for output in outputs]
+    elif args.output in STATS_SUFFIXES and args.stack:
+        v_stacked = [{b: {key: new_stats(args, logger) for key in keys} for b in band_ids} for output in outputs]
+    else:
+        v_stacked = [{b: {key: (utl.Vector_accumulator(), utl.Vector_accumulator()) for key in keys}
+                      for b in band_ids} for output in outputs]
+    len_check = [{b: 0 for b in band_ids} for output in outputs]
+    match_count = 0
 
-    for p in paths_list:
-        paths = p.split(',')
-        location_name = paths[0].split('/')[-1]
-
-        # vector containers for location specific data
-        v_local_valid_ref = np.zeros((0))
-        v_local_valid_maja = np.zeros((0))
-        v_local_lt0_ref = np.zeros((0))
-        v_local_lt0_maja = np.zeros((0))
-
-        acix_vermote_collection = clc.Collection(paths[0], logger)
-        acix_maja_collection = clc.Collection(paths[1], logger)
-        compare = cmp.Comparison(acix_vermote_collection, acix_maja_collection, logger)
-
-        for match in compare.matching_products:
-            logger.info("One-by-one for %s between %s and %s" % (match[0], match[1], match[2]))
-            p_ref = prd.Product_hdf_acix(match[1], logger)
-            p_maja = prd.Product_dir_maja(match[2], logger)
+    if args.checkpoint is not None:
+        os.makedirs(args.checkpoint, exist_ok=True)
+    elif args.resume:
+        logger.error("--resume requires a --checkpoint directory")
+        sys.exit(3)
 
-            try:
-                b_ref = p_ref.get_band(p_ref.find_band(bdef_acix[band_id][0]), scalef=p_ref.sre_scalef)
-                m_ref_qa = p_ref.get_band(p_ref.find_band("refqa"))
-                b_maja = p_maja.get_band(p_maja.find_band(bdef_acix[band_id][1]), scalef=p_maja.sre_scalef)
-                clm = p_maja.get_band(p_maja.find_band("CLM_" + bdef_acix[band_id][2]))
-                edg = p_maja.get_band(p_maja.find_band("EDG_" + bdef_acix[band_id][2]))
-                m_maja_qa, ratio = p_maja.get_mask(clm, edg, stats=True)
-                del clm
-                del edg
-
-                # Issue 32:
-                if bdef_acix[band_id][2] == "R2":
-                    b_maja = b_maja.repeat(2, axis=0).repeat(2, axis=1)
-                    logger.info("Upscaling %s from %s to full resolution with nearest neighbor" % (bdef_acix[band_id][1], bdef_acix[band_id][2]))
-                    m_maja_qa = m_maja_qa.repeat(2, axis=0).repeat(2, axis=1)
-                    logger.info("Upscaling %s QA from %s to full resolution with nearest neighbor" % (bdef_acix[band_id][1], bdef_acix[band_id][2]))
-
-
-                # default filter : any cloudfree flaged both by ref and maja and sr >= 0
-                is_valid = np.where(
-                    (b_ref > 0)
-                    & (b_maja > 0)
-                    & (m_ref_qa == 1)
-                    & (m_maja_qa == 1)
-                )
-
-                if args.negative:
-                    # keep only sr < 0 (either ref or maja) though flaged cloudfree
-                    is_cloudfree_but_negative = np.where(
-                        (m_maja_qa == 1)
-                        & (m_ref_qa == 1)
-                        & ((b_maja < 0) | (b_ref < 0))
-                    )
-
-                if args.keepall:
-                    # keep all rs values, negative included, by-pass default is_valid
-                    is_cloudfree_keep_all = np.where(
-                        (m_maja_qa == 1)
-                        & (m_ref_qa == 1)
-                    )
-
-                # stack local valid values for all timestamp matches
-                v_local_valid_ref = np.append(v_local_valid_ref, (b_ref[is_valid]))
-                v_local_valid_maja = np.append(v_local_valid_maja, (b_maja[is_valid]))
-
-                if args.negative:
-                    # stack local cloudfree negative sr for all timestamp matches
-                    v_local_lt0_ref = np.append(v_local_lt0_ref, (b_ref[is_cloudfree_but_negative]))
-                    v_local_lt0_maja = np.append(v_local_lt0_maja, (b_maja[is_cloudfree_but_negative]))
-
-                if args.keepall:
-                    v_local_keep_all_ref = np.append(v_local_lt0_ref, (b_ref[is_cloudfree_keep_all]))
-                    v_local_keep_all_maja = np.append(v_local_lt0_maja, (b_maja[is_cloudfree_keep_all]))
-
-
-                match_count += 1
-                len_check += len(b_ref[is_valid])
-
-                if args.stack:
-                    # if all locations have to be stacked in one single vector
-                    v_stacked_valid_ref = np.append(v_stacked_valid_ref, v_local_valid_ref)
-                    v_stacked_valid_maja = np.append(v_stacked_valid_maja, v_local_valid_maja)
-
-                    if args.negative:
-                        v_stacked_lt0_ref = np.append(v_stacked_lt0_ref, v_local_lt0_ref)
-                        v_stacked_lt0_maja = np.append(v_stacked_lt0_maja, v_local_lt0_maja)
-
-                    if args.keepall:
-                        v_stacked_keep_all_ref = np.append(v_stacked_keep_all_ref, v_local_keep_all_ref)
-                        v_stacked_keep_all_maja = np.append(v_stacked_keep_all_maja, v_local_keep_all_maja)
+    band_defs = {b: bdef_acix[b] for b in band_ids}
+    location_names = [p.split(',')[0].split('/')[-1] for p in paths_list]
+
+    manifests = [{} for location_name in location_names]
+    if args.resume:
+        manifests = [read_manifest(os.path.join(args.checkpoint, location_name + MANIFEST_SUFFIX))
+                     for location_name in location_names]
+        logger.info("Resuming from %i completed bands of matches in %s" % (sum([len(m) for m in manifests]),
+                                                                           args.checkpoint))
+    if args.catalog:
+        catalog = ctl.Catalog(args.catalog, logger, rebuild=args.rebuild_catalog)
+    else:
+        catalog = None
+
+    tasks = [(paths_list[i], band_defs, keys, args, logger, manifests[i], catalog, processors)
+             for i in range(len(paths_list))]
+
+    if len(set(location_names)) < len(location_names):
+        logger.warning("Some locations have the same name, their files and shards overwrite each other")
+
+    if args.jobs > 1:
+        # Sites share nothing: each worker extracts and saves a site, stacked vectors being merged in list order
+        logger.info("Extracting %i sites with %i workers" % (len(tasks), args.jobs))
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers=args.jobs)
+        results = executor.map(extract_site, tasks)
+    else:
+        executor = None
+        results = map(extract_site, tasks)
+
+    for location_name, local_match_count, local_len_check, local_matches in results:
+        match_count += local_matches
+
+        for k in range(len(processors)):
+            for b in band_ids:
+                len_check[k][b] += local_len_check[k][b]
+                if not args.stack or local_match_count[k][b] == 0:
+                    continue
+
+                # if all locations have to be stacked in one single vector, from the files of each location
+                for key in keys:
+                    local_name = outputs[k] + location_name + LOCAL_NAMES[key] + bdef_acix[b][0]
+                    if args.output == "store":
+                        v_stacked[k][b][key].extend(stc.Sample_store(local_name + ".store", logger, mode="r"))
+                    elif args.output in STATS_SUFFIXES:
+                        v_stacked[k][b][key].merge(load_stats(args, logger, local_name + STATS_SUFFIXES[args.output]))
+                    else:
+                        samples = load_samples(local_name)
+                        v_stacked[k][b][key][0].append(samples[0])
+                        v_stacked[k][b][key][1].append(samples[1])
+
+    if executor is not None:
+        executor.shutdown()
+
+    logger.info("Processed %i matches for %i band(s)" % (match_count, len(band_ids)))
 
+    if args.stack:
+        # if --stack, save stacked vector in one single compressed file per processor and band
+        for k in range(len(processors)):
+            for b in band_ids:
+                if args.output == "store":
+                    stacked_len = len(v_stacked[k][b]["valid"])
+                elif args.output in STATS_SUFFIXES:
+                    for key in keys:
+                        v_stacked[k][b][key].save(outputs[k] + STACKED_NAMES[key] + bdef_acix[b][0]
+                                                  + STATS_SUFFIXES[args.output])
+                    stacked_len = len(v_stacked[k][b]["valid"])
                 else:
-                    # save local vectors in one compressed file
-                    if not args.keepall:
-                        np.savez_compressed(location_name + "_valid_" + bdef_acix[band_id][0],
-                                            [v_local_valid_ref.astype('float32'), v_local_valid_maja.astype('float32')])
-                    if args.negative:
-                        np.savez_compressed(location_name + "_sr_lt_0_" + bdef_acix[band_id][0],
-                                            [v_local_lt0_ref.astype('float32'), v_local_lt0_maja.astype('float32')])
-
-                    if args.keepall:
-                        np.savez_compressed(location_name + "_keep_all_" + bdef_acix[band_id][0],
-                                            [v_local_keep_all_ref.astype('float32'), v_local_keep_all_maja.astype('float32')])
-
-            except TypeError as err:
-                logger.warning(
-                    "Had to skip comparison for %s because of unexpected product dimension (see previous error)"
-                    % (match[0]))
+                    for key in keys:
+                        save_samples(outputs[k] + STACKED_NAMES[key] + bdef_acix[b][0], v_stacked[k][b][key])
+                    stacked_len = len(v_stacked[k][b]["valid"][0])
 
-    if args.stack:
-        # if --stack, save stacked vector in one single compressed file
-        np.savez_compressed("Stacked_valid_" + bdef_acix[band_id][0],
-                            [v_stacked_valid_ref.astype('float32'), v_stacked_valid_maja.astype('float32')])
-        if args.negative:
-            np.savez_compressed("Stacked_sr_lt_0_" + bdef_acix[band_id][0],
-                                [v_stacked_lt0_ref.astype('float32'), v_stacked_lt0_maja.astype('float32')])
-
-        if args.keepall:
-            np.savez_compressed("Stacked_sr_keep_all_" + bdef_acix[band_id][0],
-                                [v_stacked_keep_all_ref.astype('float32'), v_stacked_keep_all_maja.astype('float32')])
-
-        if len_check == len(v_stacked_valid_ref) and len_check == len(v_stacked_valid_maja):
-            logger.info("Saved %i samples to %s.npy" % (len_check, location_name))
-        else:
-            logger.error("Inconsistent sample len between len_check=%i and len(v_stacked_valid_ref)=%i"
-                         % (len_check, len(v_stacked_valid_ref)))
+                if len_check[k][b] == stacked_len:
+                    logger.info("Saved %i samples to %s%s%s" % (len_check[k][b], outputs[k], STACKED_NAMES["valid"],
+                                                                bdef_acix[b][0]))
+                else:
+                    logger.error("Inconsistent sample len between len_check=%i and len(v_stacked_valid_ref)=%i"
+                                 % (len_check[k][b], stacked_len))
 
     sys.exit(0)
 
@@ -1,70 +1,117 @@
 import matplotlib.pylab as pl
 import numpy as np
 import common.utilities as utl
+import common.Store as stc
+import common.Apu as apu
+import os
 import sys
 import argparse
 
+def compute_binned_apu(stats, verbose=False):
+    """
+    Accuracy, precision and uncertainty of maja against reference, per bin of reference surface reflectance
+    :param stats: Apu_stats of the samples
+    :param verbose: print one line per bin
+    :return: bins_count, accuracy, precision, uncertainty vectors of length stats.samples
+    """
+    bins_count, acix_a, acix_p, acix_u = stats.get_binned_apu()
+
+    if verbose:
+        step = 1 / stats.samples
+        for i in np.arange(0, stats.samples):
+            print("From %4.2f to %4.2f: %i samples, A=%8.6f, P=%8.6f, U=%8.6f" % (i * step, i * step + step, bins_count[i], acix_a[i], acix_p[i], acix_u[i]))
+
+    return bins_count, acix_a, acix_p, acix_u
+
+
+def plot_density(hist, site_name, band_name):
+    """
+    Plot the density of maja against reference surface reflectances from their joint histogram
+    :param hist: Joint_histogram
+    :param site_name: site name, as in the output file name
+    :param band_name: band name, as in the output file name
+    """
+    fig, ax = pl.subplots(figsize=(8, 8), dpi=300)
+    pl.title('%s: samples=%i' % (site_name, len(hist)))
+
+    counts = np.ma.masked_equal(hist.counts, 0)
+    image = ax.imshow(np.ma.log10(counts.T), origin='lower', extent=(hist.lo, hist.hi, hist.lo, hist.hi), cmap='viridis',
+                      interpolation='nearest')
+    ax.plot([hist.lo, hist.hi], [hist.lo, hist.hi], 'r', linewidth=0.5)
+    ax.set_xlim(0, 0.5)
+    ax.set_ylim(0, 0.5)
+    ax.set_xlabel("Reference surface reflectance (-)")
+    ax.set_ylabel("Maja surface reflectance (-)")
+    fig.colorbar(image, ax=ax, label="log10(nb of points)")
+
+    pl.savefig("acix_density_" + site_name + "_" + band_name + ".png")
+
+
 def main():
     # Argument parser
     parser = argparse.ArgumentParser()
-    parser.add_argument("data", help="NPZ data file")
+    parser.add_argument("data", help="NPZ data file, NPY stack, sample store directory, APU statistics file (%s) or "
+                                     "joint histogram (%s)" % (apu.SUFFIX, apu.HIST_SUFFIX))
     parser.add_argument("--band", help="Specific band in acix band definition", type=str, required=False)
     parser.add_argument("--samples", help="Reflectance sampling, defaults to 100 (ie. 0.01)", type=int, default=100)
     parser.add_argument("-v", "--verbose", help="Set verbosity to DEBUG level", action="store_true", default=False)
+    parser.add_argument("--log", help="Log to acix_plot_<date>.log in the current directory instead of stderr",
+                        action="store_true", default=False)
     args = parser.parse_args()
 
-    data = np.load(args.data)['arr_0']
+    logger = utl.get_logger('acix_plot', args.verbose, log_file=args.log)
+    stats = None
+    hist = None
+
+    if args.data.endswith(apu.HIST_SUFFIX):
+        # APU from the bin centres of the histogram, which is also plotted as a density
+        hist = apu.Joint_histogram(logger, fname=args.data)
+        stats = hist.get_apu_stats(args.samples)
+        site_name = args.data[:-len(apu.HIST_SUFFIX)]
+        if hist.outside > 0:
+            logger.info("%i samples out of the histogram range are not in APU" % hist.outside)
+    elif args.data.endswith(apu.SUFFIX):
+        # statistics only, their number of bins overrides --samples
+        stats = apu.Apu_stats(logger, fname=args.data)
+        site_name = args.data[:-len(apu.SUFFIX)]
+    elif os.path.isdir(args.data):
+        # sample store, memory-mapped rather than loaded if it has a single chunk
+        args.data = args.data.rstrip('/')
+        sr_ref, sr_maja = stc.Sample_store(args.data, logger, mode="r").read()
+        site_name = args.data[:-6]
+    elif args.data.endswith(".npy"):
+        # memory-mapped stack written by aggregator.py --npy
+        data = np.load(args.data, mmap_mode='r')
+        sr_ref = data[0]
+        sr_maja = data[1]
+        site_name = args.data[:-4]
+    else:
+        data = np.load(args.data)['arr_0']
+        sr_ref = data[0]
+        sr_maja = data[1]
+        site_name = args.data[:-4]
+
     if args.band is None:
         band_name = args.data.split('_')[1].split('.')[0]
     else:
         band_name = args.band
 
-    site_name = args.data[:-4]
+    if stats is None:
+        stats = apu.Apu_stats(logger, samples=args.samples)
+        stats.add(sr_ref, sr_maja)
 
-    sr_ref = data[0]
-    sr_maja = data[1]
-
-    samples = args.samples # Bins of hist
+    samples = stats.samples # Bins of hist
     step = 1 / samples # or 0.01 steps of reflectance value
 
-    bins_count = np.zeros((samples))
-    acix_a = np.zeros((samples))
-    acix_p = np.zeros((samples))
-    acix_u = np.zeros((samples))
-
-    for i in np.arange(0, samples):
-        bin_min = i * step
-        bin_max = i * step + step
-
-        is_in_range = np.where((sr_ref >= bin_min) & (sr_ref < bin_max))
+    bins_count, acix_a, acix_p, acix_u = compute_binned_apu(stats, verbose=args.verbose)
 
-        bin_sr_ref = sr_ref[is_in_range]
-        bin_sr_maja = sr_maja[is_in_range]
-        bins_count[i] = len(bin_sr_ref)
-
-
-        if bins_count[i] > 1:
-            acix_a[i] = utl.accuracy(bin_sr_maja - bin_sr_ref)
-            acix_p[i] = utl.precision(bin_sr_maja - bin_sr_ref)
-            acix_u[i] = utl.uncertainty(bin_sr_maja - bin_sr_ref)
-        else:
-            acix_a[i] = np.nan
-            acix_p[i] = np.nan
-            acix_u[i] = np.nan
-
-
-        if args.verbose:
-            print("From %4.2f to %4.2f: %i samples, A=%8.6f, P=%8.6f, U=%8.6f" % (bin_min, bin_max, bins_count[i], acix_a[i], acix_p[i], acix_u[i]))
-
-    cumulated_acix_a = utl.accuracy(sr_maja - sr_ref)
-    cumulated_acix_p = utl.precision(sr_maja - sr_ref)
-    cumulated_acix_u = utl.uncertainty(sr_maja - sr_ref)
+    cumulated_acix_a, cumulated_acix_p, cumulated_acix_u = stats.get_apu()
     x_sr = np.arange(0, 1, step) - (step / 2)
     spec = 0.005 + 0.05 * x_sr
 
     fig, ax1 = pl.subplots(figsize=(8, 8), dpi=300)
 
-    pl.title('%s: samples=%i\n A=%8.6f, P=%8.6f, U=%8.6f' % (site_name, len(sr_ref), cumulated_acix_a, cumulated_acix_p, cumulated_acix_u))
+    pl.title('%s: samples=%i\n A=%8.6f, P=%8.6f, U=%8.6f' % (site_name, len(stats), cumulated_acix_a, cumulated_acix_p, cumulated_acix_u))
 
     pl.xlim(0,0.5)
     ax1.set_xlabel("Surface reflectance (-)")
@@ -81,6 +128,9 @@ def main():
     pl.legend(loc=4)
     pl.savefig("acix_" + site_name + "_" + band_name + ".png")
 
+    if hist is not None:
+        plot_density(hist, site_name, band_name)
+
 
     sys.exit(0)
 
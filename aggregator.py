@@ -1,43 +1,185 @@
 import glob
+import os
 import sys
 import argparse
+import collections
+import concurrent.futures
+import itertools
+import zipfile
 import numpy as np
+import common.utilities as utl
+import common.Store as stc
+import common.Apu as apu
+
+
+def aggregate_stores(path, band, logger):
+    """
+    Copy all sample stores of a band into a single chunk store, preallocated from the store indexes and written
+    through a memory map, one input chunk at a time
+    :param path: path of the stores
+    :param band: band name
+    :param logger: logger instance
+    """
+    output = "Stacked_" + band + ".store"
+    stores = [stc.Sample_store(d, logger, mode="r") for d in sorted(glob.glob(path + "*" + band + "*.store"))
+              if os.path.abspath(d) != os.path.abspath(output)]
+
+    sr_ref, sr_maja = stc.Sample_store(output, logger, mode="w").append_memmap(sum([len(s) for s in stores]))
+    offset = 0
+    for store in stores:
+        for ref, maja in store.iter_chunks():
+            sr_ref[offset:offset + len(ref)] = ref
+            sr_maja[offset:offset + len(maja)] = maja
+            offset += len(ref)
+        print("  Adding %s (%i samples)" % (store.path, len(store)))
+
+    sr_ref.flush()
+    sr_maja.flush()
+    print("Final length of sr_ref and sr_maja is %i" % offset)
+    print("Completed with %i stores..." % len(stores))
+
+
+def aggregate_stats(path, band, logger, histogram=False):
+    """
+    Merge all APU statistics files of a band into Stacked_<band>.apu.npz, or all joint histograms into
+    Stacked_<band>.hist.npz
+    :param path: path of the statistics files
+    :param band: band name
+    :param logger: logger instance
+    :param histogram: merge joint histograms
+    """
+    stats_class, suffix = (apu.Joint_histogram, apu.HIST_SUFFIX) if histogram else (apu.Apu_stats, apu.SUFFIX)
+    output = "Stacked_" + band + suffix
+    flist = [f for f in sorted(glob.glob(path + "*" + band + "*" + suffix))
+             if os.path.abspath(f) != os.path.abspath(output)]
+
+    if len(flist) == 0:
+        logger.error("No %s files found for %s in %s" % (suffix, band, path))
+        sys.exit(2)
+
+    stacked = stats_class(logger, fname=flist[0])
+    print("  Adding %s (%i samples)" % (flist[0], len(stacked)))
+    for f in flist[1:]:
+        stats = stats_class(logger, fname=f)
+        stacked.merge(stats)
+        print("  Adding %s (%i samples)" % (f, len(stats)))
+
+    stacked.save(output)
+    print("Final length of sr_ref and sr_maja is %i" % len(stacked))
+    print("Completed with %i files..." % len(flist))
+
+
+def read_npz_shape(fname):
+    """
+    Read the shape and dtype of the samples of a npz file from the npy header of its archive member, without
+    decompressing the samples
+    :param fname: npz file as written by acix_extract.py
+    :return: shape, dtype
+    """
+    with zipfile.ZipFile(fname) as npz, npz.open("arr_0.npy") as f:
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+    return shape, dtype
+
+
+def load_npz(fname):
+    return np.load(fname)['arr_0']
+
+
+def aggregate_npz(path, band, logger, jobs=1, npy=False):
+    """
+    Copy all npz files of a band into a single (2, n) array, preallocated from the npz headers and written through a
+    memory map, one file at a time. Up to jobs files are decompressed ahead of the copy in parallel threads
+    :param path: path of the npz files
+    :param band: band name
+    :param logger: logger instance
+    :param jobs: number of files decompressed in parallel
+    :param npy: keep the memory-mapped Stacked_<band>.npy instead of compressing it to Stacked_<band>.npz
+    """
+    output = "Stacked_" + band + ".npz"
+    # statistics files are npz files too
+    flist = [f for f in sorted(glob.glob(path + "*" + band + "*.npz"))
+             if os.path.abspath(f) != os.path.abspath(output) and not f.endswith((apu.SUFFIX, apu.HIST_SUFFIX))]
+
+    shapes = []
+    dtypes = []
+    for f in flist:
+        shape, dtype = read_npz_shape(f)
+        if len(shape) != 2 or shape[0] != 2:
+            logger.error("Unexpected samples shape %s in %s" % (str(shape), f))
+            sys.exit(2)
+        shapes.append(shape)
+        dtypes.append(dtype)
+    total = sum([shape[1] for shape in shapes])
+
+    mmap_file = "Stacked_" + band + ".npy"
+    stacked = np.lib.format.open_memmap(mmap_file, mode='w+', dtype=np.result_type(np.float32, *dtypes),
+                                        shape=(2, total))
+
+    offset = 0
+    jobs = max(jobs, 1)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        # Only jobs files are held decompressed at a time
+        files = iter(zip(flist, shapes))
+        pending = collections.deque([(f, shape, executor.submit(load_npz, f))
+                                     for f, shape in itertools.islice(files, jobs)])
+        while len(pending) > 0:
+            f, shape, future = pending.popleft()
+            for next_f, next_shape in itertools.islice(files, 1):
+                pending.append((next_f, next_shape, executor.submit(load_npz, next_f)))
+
+            data = future.result()
+            if data.shape != shape:
+                logger.error("Samples shape of %s changed from %s to %s" % (f, str(shape), str(data.shape)))
+                sys.exit(2)
+            stacked[:, offset:offset + shape[1]] = data
+            offset += shape[1]
+            print("  Adding %s (%i samples)" % (f, shape[1]))
+
+    stacked.flush()
+    if not npy:
+        # Compressed from the memory map by buffered chunks
+        np.savez_compressed(output, stacked)
+        del stacked
+        os.remove(mmap_file)
+
+    print("Final length of sr_ref and sr_maja is %i (ctrl is %i)" % (offset, total))
+    print("Completed with %i files..." % len(flist))
+
 
 def main():
     # Argument parser
     parser = argparse.ArgumentParser()
     parser.add_argument("path", help="Path of npz collection")
     parser.add_argument("band", help="Band name")
+    parser.add_argument("--store", help="Aggregate sample stores (see common/Store.py) into Stacked_<band>.store",
+                        action="store_true", default=False)
+    parser.add_argument("--apu", help="Merge APU statistics (see common/Apu.py) into Stacked_<band>%s" % apu.SUFFIX,
+                        action="store_true", default=False)
+    parser.add_argument("--histogram", help="Merge joint histograms (see common/Apu.py) into Stacked_<band>%s"
+                                            % apu.HIST_SUFFIX, action="store_true", default=False)
+    parser.add_argument("--npy", help="Write the memory-mapped Stacked_<band>.npy instead of compressing it to "
+                                      "Stacked_<band>.npz", action="store_true", default=False)
+    parser.add_argument("-j", "--jobs", help="Number of npz files decompressed in parallel, defaults to 1", type=int,
+                        default=1)
+    parser.add_argument("--log", help="Log to aggregator_<date>.log in the current directory instead of stderr",
+                        action="store_true", default=False)
     args = parser.parse_args()
 
-    flist = glob.glob(args.path + "*" + args.band + "*.npz")
+    logger = utl.get_logger('aggregator', False, log_file=args.log)
 
-    init = True
-    count = 0
-    control_ref = 0
-    control_maja = 0
+    if args.store:
+        aggregate_stores(args.path, args.band, logger)
+        sys.exit(0)
 
-    for f in flist:
-        data = np.load(f)['arr_0']
-
-        if init:
-            sr_ref = data[0]
-            sr_maja = data[1]
-            init = False
+    if args.apu or args.histogram:
+        aggregate_stats(args.path, args.band, logger, histogram=args.histogram)
+        sys.exit(0)
 
-        else:
-            sr_ref = np.append(sr_ref, data[0])
-            sr_maja = np.append(sr_maja, data[1])
-
-        print("  Adding %s" % f)
-        count += 1
-        control_ref += len(sr_ref)
-        control_maja += len(sr_maja)
-
-    np.savez_compressed("Stacked_" + args.band + ".npz", [sr_ref, sr_maja])
-    print("Final length of sr_ref is %i (ctrl is %i)" % (len(sr_ref), control_ref))
-    print("Final length of sr_maja is %i (ctrl is %i)" % (len(sr_maja), control_maja))
-    print("Completed with %i files..." % count)
+    aggregate_npz(args.path, args.band, logger, jobs=args.jobs, npy=args.npy)
 
     sys.exit(0)
 
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+Benchmark the read and stats hot paths of mtools on synthetic products
+
+Wall time (best and median of --repeat runs) and peak memory traced by tracemalloc (numpy buffers included) are
+reported for each case, and optionally appended to a csv file to track regressions.
+
+Require: see mtools.yml for conda environment configuration
+
+"""
+
+__author__ = "jerome.colin'at'cesbio.cnes.fr"
+__license__ = "MIT"
+__version__ = "1.0.3"
+
+import sys
+import os
+import argparse
+import shutil
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+import numpy as np
+import common.utilities as utl
+import common.Product as prd
+import common.Collection as clc
+import common.Comparison as cmp
+import common.Roi as roi
+import common.synthetic as syn
+import common.Apu as apu
+import acix_extract
+
+
+def measure(func, repeat):
+    """
+    Run func repeat times
+    :param func: function without argument
+    :param repeat: number of runs
+    :return: best wall time (s), median wall time (s), peak traced memory (MB)
+    """
+    timings = []
+    peak = 0
+    for r in range(repeat):
+        tracemalloc.start()
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+
+    return min(timings), float(np.median(timings)), peak / 1024 ** 2
+
+
+def get_cases(data_dir, args, logger):
+    """
+    Generate synthetic products and define benchmark cases
+    :return: a list of (name, function)
+    """
+    site = syn.make_acix_site(os.path.join(data_dir, "site"), size=args.size, cloud_fraction=args.cloud)
+    venus = syn.make_venus_zip(os.path.join(data_dir, "venus"), size=args.size, cloud_fraction=args.cloud)
+    roi_file = syn.write_roi_file(os.path.join(data_dir, "rois.csv"), args.rois, size=args.size)
+
+    compare = cmp.Comparison(clc.Collection(site.split(',')[0], logger), clc.Collection(site.split(',')[1], logger),
+                             logger)
+    p_maja = prd.Product_dir_maja(compare.matching_products[0][2], logger)
+    p_venus = prd.Product_zip_venus(venus, logger)
+    rois = roi.Roi_collection(roi_file, 100, logger)
+    clm = p_maja.get_band(p_maja.find_band("CLM_R1"))
+    edg = p_maja.get_band(p_maja.find_band("EDG_R1"))
+
+    def get_band_subset():
+        b4 = p_venus.find_band("SRE_B4.")
+        for i in range(len(rois.coord_arr)):
+            p_venus.get_band_subset(b4, roi=roi.Roi(rois.coord_arr[i], 100, logger), scalef=p_venus.sre_scalef)
+
+    def extract(band_def):
+        for match in compare.matching_products:
+            acix_extract.filter_match(prd.Product_hdf_acix(match[1], logger), prd.Product_dir_maja(match[2], logger),
+                                      band_def, False, False, logger)
+
+    rng = np.random.default_rng(0)
+    sr_ref = rng.random(args.pairs).astype(np.float32)
+    sr_maja = sr_ref + rng.normal(0, 0.01, args.pairs).astype(np.float32)
+
+    return [
+        ("get_band", lambda: p_maja.get_band(p_maja.find_band("SRE_B4."), scalef=p_maja.sre_scalef)),
+        ("get_band_float32", lambda: p_maja.get_band(p_maja.find_band("SRE_B4."), scalef=p_maja.sre_scalef,
+                                                     dtype=np.float32)),
+        ("get_band_subset", get_band_subset),
+        ("get_mask", lambda: p_maja.get_mask(clm, edg, stats=True)),
+        ("compute_stats_all_bands", lambda: rois.compute_stats_all_bands(p_venus, logger)),
+        ("compute_stats_all_bands_batch", lambda: rois.compute_stats_all_bands(p_venus, logger, batch=True)),
+        ("compute_stats_all_bands_vectorized", lambda: rois.compute_stats_all_bands(p_venus, logger,
+                                                                                    vectorized=True)),
+        ("acix_extract_match_R1", lambda: extract(["band02", "SRE_B2.", "R1", []])),
+        ("acix_extract_match_R2", lambda: extract(["band05", "SRE_B5.", "R2", []])),
+        ("acix_plot_binning", lambda: apu.Apu_stats(logger, samples=100).add(sr_ref, sr_maja)),
+    ]
+
+
+def main():
+    # Argument parser
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-k", "--keyword", help="Only run cases whose name contains KEYWORD", type=str, default="")
+    parser.add_argument("--size", help="Size of synthetic products in pixels, defaults to 900", type=int,
+                        default=900)
+    parser.add_argument("--cloud", help="Cloud fraction of synthetic products, defaults to 0.2", type=float,
+                        default=0.2)
+    parser.add_argument("--rois", help="Number of ROIs for roistats cases, defaults to 100", type=int, default=100)
+    parser.add_argument("--pairs", help="Number of sample pairs for acix_plot cases, defaults to 10000000",
+                        type=int, default=10000000)
+    parser.add_argument("-r", "--repeat", help="Number of runs per case, defaults to 3", type=int, default=3)
+    parser.add_argument("-o", "--output", help="Append results to this csv file", type=str)
+    parser.add_argument("-v", "--verbose", help="Set verbosity to DEBUG level", action="store_true", default=False)
+    args = parser.parse_args()
+
+    # Create the logger
+    logger = utl.get_logger('benchmark', args.verbose)
+
+    data_dir = tempfile.mkdtemp(prefix="mtools_benchmark_")
+    try:
+        cases = [c for c in get_cases(data_dir, args, logger) if args.keyword in c[0]]
+
+        results = []
+        print("%-36s %10s %10s %10s" % ("case", "best (s)", "median (s)", "peak (MB)"))
+        for name, func in cases:
+            best, median, peak = measure(func, args.repeat)
+            results.append([name, best, median, peak])
+            print("%-36s %10.4f %10.4f %10.1f" % (name, best, median, peak))
+            logger.info("%s: best=%.4fs, median=%.4fs, peak=%.1fMB" % (name, best, median, peak))
+
+    finally:
+        shutil.rmtree(data_dir)
+
+    if args.output is not None:
+        is_new = not os.path.isfile(args.output)
+        now = datetime.now().strftime("%Y-%m-%dT%H:%M:%S")
+        with open(args.output, "a") as csv:
+            if is_new:
+                csv.write("date,case,size,cloud,rois,pairs,best_s,median_s,peak_mb\n")
+            for name, best, median, peak in results:
+                csv.write("%s,%s,%i,%.2f,%i,%i,%.6f,%.6f,%.2f\n" %
+                          (now, name, args.size, args.cloud, args.rois, args.pairs, best, median, peak))
+
+    sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,287 @@
+"""
+Mergeable APU statistics and joint histograms of maja against reference surface reflectances
+
+"""
+
+__author__ = "jerome.colin'at'cesbio.cnes.fr"
+__license__ = "MIT"
+__version__ = "1.0.3"
+
+import os
+import sys
+import numpy as np
+
+try:
+    import utilities
+except ModuleNotFoundError:
+    this_dir = os.path.dirname(os.path.abspath(__file__))
+    sys.path.append(this_dir)
+    import utilities
+
+
+# samples are binned by chunks, to bound the memory of temporaries (inputs may be memory-mapped)
+CHUNK = 2 ** 22
+SUFFIX = ".apu.npz"
+HIST_SUFFIX = ".hist.npz"
+# counts of a joint histogram cell
+HIST_DTYPE = np.uint32
+
+
+class Apu_stats:
+    """
+    Sufficient statistics of delta_sr (maja - ref) per bin of reference surface reflectance: count, sum(delta),
+    sum(delta**2) and sum(ref), from which accuracy, precision and uncertainty are computed. Statistics of any set of
+    samples are merged by adding them, so that matches, sites and runs combine without their samples. Samples out of
+    [0, 1) are counted in an extra bin, which only contributes to the overall APU. See Joint_histogram for the joint
+    distribution of ref against maja.
+    """
+
+    fields = ("count", "sum_delta", "sum_delta2", "sum_ref")
+
+    def __init__(self, logger, samples=100, fname=None):
+        """
+        Create empty statistics, or load them
+        :param logger: logger instance
+        :param samples: number of bins between 0 and 1
+        :param fname: file written by save, samples being read from it
+        """
+        self.logger = logger
+
+        if fname is not None:
+            try:
+                with np.load(fname) as data:
+                    samples = int(data["samples"])
+                    values = {field: data[field] for field in self.fields}
+            except (OSError, KeyError, ValueError) as err:
+                logger.error("Can't read APU statistics from %s: %s" % (fname, err))
+                sys.exit(2)
+
+            self.samples = samples
+            for field in self.fields:
+                setattr(self, field, values[field])
+            return
+
+        self.samples = samples
+
+        # bin samples is the out of range one
+        self.count = np.zeros((samples + 1), dtype=np.int64)
+        self.sum_delta = np.zeros((samples + 1))
+        self.sum_delta2 = np.zeros((samples + 1))
+        self.sum_ref = np.zeros((samples + 1))
+
+    def __len__(self):
+        return int(np.sum(self.count))
+
+    def add(self, sr_ref, sr_maja):
+        """
+        Add samples, in a single pass
+        :param sr_ref: reference surface reflectance vector
+        :param sr_maja: maja surface reflectance vector, same length as sr_ref
+        """
+        edges = np.arange(self.samples + 1) / self.samples
+
+        for start in range(0, len(sr_ref), CHUNK):
+            chunk_ref = np.asarray(sr_ref[start:start + CHUNK]).ravel()
+            chunk_maja = np.asarray(sr_maja[start:start + CHUNK]).ravel()
+            delta = (chunk_maja - chunk_ref).astype(np.float64)
+
+            # Bin i holds edges[i] <= sr_ref < edges[i + 1], out of range samples (and NaN) go to bin samples
+            bins = np.searchsorted(edges, chunk_ref, side='right') - 1
+            bins[(bins < 0) | (bins >= self.samples)] = self.samples
+
+            self.count += np.bincount(bins, minlength=self.samples + 1)
+            self.sum_delta += np.bincount(bins, weights=delta, minlength=self.samples + 1)
+            self.sum_delta2 += np.bincount(bins, weights=delta ** 2, minlength=self.samples + 1)
+            self.sum_ref += np.bincount(bins, weights=chunk_ref, minlength=self.samples + 1)
+
+    def merge(self, other):
+        """
+        Add the statistics of another Apu_stats, of the same samples
+        :param other: Apu_stats
+        """
+        if other.samples != self.samples:
+            self.logger.error("Can't merge APU statistics of %i bins with %i bins" % (other.samples, self.samples))
+            sys.exit(2)
+
+        for field in self.fields:
+            setattr(self, field, getattr(self, field) + getattr(other, field))
+
+    def get_binned_apu(self):
+        """
+        :return: bins_count, accuracy, precision, uncertainty vectors of length samples, NaN for bins of less than 2
+        samples
+        """
+        acc, pre, unc = utilities.apu_from_sums(self.count[:-1], self.sum_delta[:-1], self.sum_delta2[:-1])
+        return self.count[:-1].astype(np.float64), acc, pre, unc
+
+    def get_apu(self):
+        """
+        :return: accuracy, precision, uncertainty of all samples, in range or not
+        """
+        acc, pre, unc = utilities.apu_from_sums(np.sum(self.count), np.sum(self.sum_delta), np.sum(self.sum_delta2))
+        return acc[0], pre[0], unc[0]
+
+    def get_mean_ref(self):
+        """
+        :return: mean reference surface reflectance of each bin, NaN for empty bins
+        """
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(self.count[:-1] > 0, self.sum_ref[:-1] / self.count[:-1], np.nan)
+
+    def save(self, fname):
+        """
+        Write the statistics in a compressed npz file
+        :param fname: file name, see SUFFIX
+        """
+        arrays = {field: getattr(self, field) for field in self.fields}
+        np.savez_compressed(fname, samples=self.samples, **arrays)
+
+
+class Joint_histogram:
+    """
+    Joint histogram of reference (rows) against maja (columns) surface reflectances, in bins of step over [lo, hi) on
+    both axes, merged by adding counts like Apu_stats. Samples out of range are only counted. Binned and overall APU
+    are derived from bin centres, ie. to within step, and counts are kept dense: ((hi - lo) / step)**2 HIST_DTYPE
+    (16 MB at the default step), samples being added in place. Counts are promoted to uint64 before a cell may
+    overflow HIST_DTYPE.
+    """
+
+    def __init__(self, logger, step=0.0005, lo=0.0, hi=1.0, fname=None):
+        """
+        Create an empty histogram, or load it
+        :param logger: logger instance
+        :param step: bin width
+        :param lo: lower bound of both axes
+        :param hi: upper bound of both axes
+        :param fname: file written by save, step, lo and hi being read from it
+        """
+        self.logger = logger
+
+        if fname is not None:
+            try:
+                with np.load(fname) as data:
+                    step, lo, hi = float(data["step"]), float(data["lo"]), float(data["hi"])
+                    counts = data["counts"]
+                    outside = int(data["outside"])
+            except (OSError, KeyError, ValueError) as err:
+                logger.error("Can't read joint histogram from %s: %s" % (fname, err))
+                sys.exit(2)
+
+        self.step = step
+        self.lo = lo
+        self.hi = hi
+        self.bins = int(round((hi - lo) / step))
+
+        if fname is not None:
+            # upper bound of the counts of any cell
+            self._max_count = int(np.max(counts))
+            if self._max_count > np.iinfo(HIST_DTYPE).max:
+                self.counts = counts.astype(np.uint64, copy=False)
+            else:
+                self.counts = counts.astype(HIST_DTYPE, copy=False)
+            self.outside = outside
+        else:
+            self._max_count = 0
+            self.counts = np.zeros((self.bins, self.bins), dtype=HIST_DTYPE)
+            self.outside = 0
+
+    def __len__(self):
+        return int(np.sum(self.counts)) + self.outside
+
+    def add(self, sr_ref, sr_maja):
+        """
+        Add samples
+        :param sr_ref: reference surface reflectance vector
+        :param sr_maja: maja surface reflectance vector, same length as sr_ref
+        """
+        for start in range(0, len(sr_ref), CHUNK):
+            cells = get_cells(np.asarray(sr_ref[start:start + CHUNK]).ravel(),
+                              np.asarray(sr_maja[start:start + CHUNK]).ravel(), self.lo, self.step, self.bins)
+            if len(cells) > 0:
+                # added in place over the range of cells touched, rather than with a temporary of all cells
+                first = np.min(cells)
+                touched = np.bincount(cells - first)
+                self._reserve(int(np.max(touched)))
+                flat = self.counts.reshape(-1)
+                flat[first:first + len(touched)] += touched.astype(self.counts.dtype)
+            self.outside += min(CHUNK, len(sr_ref) - start) - len(cells)
+
+    def merge(self, other):
+        """
+        Add the counts of another Joint_histogram, of the same bins
+        :param other: Joint_histogram
+        """
+        if (other.step, other.lo, other.hi) != (self.step, self.lo, self.hi):
+            self.logger.error("Can't merge joint histograms of step %g over [%g, %g) with step %g over [%g, %g)" %
+                              (other.step, other.lo, other.hi, self.step, self.lo, self.hi))
+            sys.exit(2)
+
+        self._reserve(other._max_count)
+        self.counts += other.counts
+        self.outside += other.outside
+
+    def _reserve(self, increment):
+        """
+        Promote counts to uint64 if adding up to increment to a cell may overflow HIST_DTYPE
+        :param increment: upper bound of the counts added to any cell
+        """
+        if self.counts.dtype == HIST_DTYPE and self._max_count + increment > np.iinfo(HIST_DTYPE).max:
+            # the bound may be loose, the actual maximum is only looked for when it gets near the limit
+            self._max_count = int(np.max(self.counts))
+            if self._max_count + increment > np.iinfo(HIST_DTYPE).max:
+                self.logger.info("Joint histogram counts promoted to uint64")
+                self.counts = self.counts.astype(np.uint64)
+        self._max_count += increment
+
+    def get_centres(self):
+        """
+        :return: bin centres, the same on both axes
+        """
+        return self.lo + (np.arange(self.bins) + 0.5) * self.step
+
+    def get_apu_stats(self, samples=100):
+        """
+        APU statistics of the binned samples, each sample being at the centre of its bin
+        :param samples: number of bins between 0 and 1 of the statistics
+        :return: Apu_stats, without the samples out of the histogram range
+        """
+        centres = self.get_centres()
+        counts = self.counts.astype(np.float64)
+
+        # Per reference bin i: sum_j n_ij (c_j - c_i) and sum_j n_ij (c_j - c_i)**2, without a bins x bins delta array
+        row_count = np.sum(counts, axis=1)
+        row_maja = counts @ centres
+        row_maja2 = counts @ centres ** 2
+        row_delta = row_maja - row_count * centres
+        row_delta2 = row_maja2 - 2 * centres * row_maja + row_count * centres ** 2
+
+        stats = Apu_stats(self.logger, samples=samples)
+        edges = np.arange(samples + 1) / samples
+        coarse = np.searchsorted(edges, centres, side='right') - 1
+        coarse[(coarse < 0) | (coarse >= samples)] = samples
+
+        stats.count = np.bincount(coarse, weights=row_count, minlength=samples + 1).astype(np.int64)
+        stats.sum_delta = np.bincount(coarse, weights=row_delta, minlength=samples + 1)
+        stats.sum_delta2 = np.bincount(coarse, weights=row_delta2, minlength=samples + 1)
+        stats.sum_ref = np.bincount(coarse, weights=row_count * centres, minlength=samples + 1)
+        return stats
+
+    def save(self, fname):
+        """
+        Write the histogram in a compressed npz file
+        :param fname: file name, see HIST_SUFFIX
+        """
+        np.savez_compressed(fname, step=self.step, lo=self.lo, hi=self.hi, counts=self.counts, outside=self.outside)
+
+
+def get_cells(sr_ref, sr_maja, lo, step, bins):
+    """
+    Flat indices of the cells of a bins x bins joint histogram over [lo, lo + bins * step) of samples in range
+    :param sr_ref: reference surface reflectance vector (rows)
+    :param sr_maja: maja surface reflectance vector (columns)
+    :return: int vector, of at most len(sr_ref)
+    """
+    i_ref = np.floor((sr_ref - lo) / step)
+    i_maja = np.floor((sr_maja - lo) / step)
+    in_range = (i_ref >= 0) & (i_ref < bins) & (i_maja >= 0) & (i_maja < bins)
+    return i_ref[in_range].astype(np.intp) * bins + i_maja[in_range].astype(np.intp)
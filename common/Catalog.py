@@ -0,0 +1,158 @@
+"""
+Persistent catalog of collections and products
+
+"""
+
+__author__ = "jerome.colin'at'cesbio.cnes.fr"
+__license__ = "MIT"
+__version__ = "1.0.3"
+
+import json
+import os
+import sqlite3
+import sys
+
+
+DEFAULT_NAME = "mtools_catalog.sqlite"
+
+SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS collections (path TEXT, recursive INTEGER, dirs TEXT, items TEXT, "
+    "PRIMARY KEY (path, recursive))",
+    "CREATE TABLE IF NOT EXISTS products (path TEXT PRIMARY KEY, mtime INTEGER, size INTEGER, ptype TEXT, "
+    "content TEXT)",
+)
+
+
+class Catalog:
+    """
+    SQLite catalog of what Collection and Product find out about the archive: items, types and YYYYMMDD patterns of
+    collections, and type and content list (files or HDF subdatasets) of products. Entries are keyed by path and
+    checked against the mtime (and size) of the path when read, a changed entry being dropped and found out again. A
+    catalog can be sent to other processes, which open their own connection. Once opened, a catalog is only a cache: SQLite errors (eg. a database locked by other processes) are
+    logged as warnings, the entry being missed or not recorded.
+    """
+
+    def __init__(self, path, logger, rebuild=False):
+        """
+        Open a catalog, created if needed
+        :param path: SQLite file
+        :param logger: logger instance
+        :param rebuild: drop all entries
+        """
+        self.path = path
+        self.logger = logger
+        self.hits = 0
+        self.misses = 0
+        self._connection = None
+
+        try:
+            connection = self._get_connection()
+            if rebuild:
+                logger.info("Rebuilding catalog %s" % path)
+                connection.execute("DELETE FROM collections")
+                connection.execute("DELETE FROM products")
+                connection.commit()
+        except sqlite3.Error as err:
+            logger.error("Can't open catalog %s: %s" % (path, err))
+            sys.exit(2)
+
+    def __getstate__(self):
+        # Connections are not sent to other processes
+        state = self.__dict__.copy()
+        state['_connection'] = None
+        return state
+
+    def get_collection(self, path, recursive):
+        """
+        :param path: collection path
+        :param recursive: see Collection
+        :return: list of [item path, type, YYYYMMDD patterns], or None if unknown or if any scanned directory changed
+        """
+        row = self._fetchone("SELECT dirs, items FROM collections WHERE path=? AND recursive=?", (path, int(recursive)))
+        if row is not None:
+            for scanned, mtime in json.loads(row[0]):
+                if get_stat(scanned)[0] != mtime:
+                    self.logger.debug("Catalog entry of %s changed" % path)
+                    row = None
+                    break
+
+        return self._count(None if row is None else json.loads(row[1]))
+
+    def put_collection(self, path, recursive, dirs, items):
+        """
+        :param path: collection path
+        :param recursive: see Collection
+        :param dirs: list of [scanned directory, mtime in ns]
+        :param items: list of [item path, type, YYYYMMDD patterns]
+        """
+        self._execute("INSERT OR REPLACE INTO collections VALUES (?, ?, ?, ?)",
+                      (path, int(recursive), json.dumps(dirs), json.dumps(items)))
+
+    def get_product(self, path):
+        """
+        :param path: product path
+        :return: dict of ptype and content, or None if unknown or changed
+        """
+        row = self._fetchone("SELECT mtime, size, ptype, content FROM products WHERE path=?", (path,))
+        if row is not None and (row[0], row[1]) != get_stat(path):
+            self.logger.debug("Catalog entry of %s changed" % path)
+            row = None
+
+        if row is None:
+            return self._count(None)
+
+        return self._count({"ptype": row[2], "content": json.loads(row[3])})
+
+    def put_product(self, path, ptype, content):
+        """
+        Record a product, replacing any previous entry
+        :param path: product path
+        :param ptype: "ZIP", "DIR" or "HDF"
+        :param content: content list
+        """
+        mtime, size = get_stat(path)
+        self._execute("INSERT OR REPLACE INTO products (path, mtime, size, ptype, content) VALUES (?, ?, ?, ?, ?)",
+                      (path, mtime, size, ptype, json.dumps(content)))
+
+    def _count(self, entry):
+        if entry is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return entry
+
+    def _execute(self, statement, values):
+        try:
+            connection = self._get_connection()
+            with connection:
+                connection.execute(statement, values)
+        except sqlite3.Error as err:
+            self.logger.warning("Can't write to catalog %s: %s" % (self.path, err))
+
+    def _fetchone(self, statement, values):
+        try:
+            return self._get_connection().execute(statement, values).fetchone()
+        except sqlite3.Error as err:
+            self.logger.warning("Can't read catalog %s: %s" % (self.path, err))
+            return None
+
+    def _get_connection(self):
+        if self._connection is None:
+            # Processes sharing a catalog wait for each other's writes
+            self._connection = sqlite3.connect(self.path, timeout=60)
+            with self._connection:
+                for statement in SCHEMA:
+                    self._connection.execute(statement)
+        return self._connection
+
+
+def get_stat(path):
+    """
+    :param path: file or directory
+    :return: mtime in ns and size, None and None if path doesn't exist
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None, None
+    return stat.st_mtime_ns, stat.st_size
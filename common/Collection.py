@@ -11,23 +11,52 @@ import os, sys
 import numpy as np
 import re
 
+# YYYYMMDD pattern of product names
+DATE_PATTERN = re.compile(r'[0-9]{8}')
+ZIP, HDF, DIR, UNKNOWN = range(4)
+
+
 class Collection:
 
-    def __init__(self, path, logger):
+    def __init__(self, path, logger, recursive=False, catalog=None):
+        """
+        Discover the products of a collection
+        :param path: collection directory
+        :param logger: logger instance
+        :param recursive: also search sub-directories without a YYYYMMDD pattern in their name, eg. tiles or years of
+        nested site layouts, instead of counting them as products
+        :param catalog: optional Catalog instance, the collection being scanned only if it changed since recorded
+        """
         self.path = path.strip()
         if self.path[-1] != '/':
             self.path += '/'
 
         self.logger = logger
+        self.recursive = recursive
+        self.catalog = catalog
         self.content_list = self._discover()
         self.products_timestamps = self._get_products_timestamps()
 
     def _discover(self):
         """
-        Create a product content_list
+        Create a product content_list, from a single scan of the collection
         :return: a list
         """
-        items = os.listdir(self.path)
+        items = None
+        if self.catalog is not None:
+            items = self.catalog.get_collection(self.path, self.recursive)
+
+        if items is None:
+            # YYYYMMDD patterns found in path are found again in all items, as in full item paths
+            self._path_numbers = DATE_PATTERN.findall(self.path)
+            self._dirs = []
+            items = list(self._scan(self.path))
+            if self.catalog is not None:
+                self.catalog.put_collection(self.path, self.recursive, self._dirs, items)
+        else:
+            self.logger.debug("Found %s in catalog" % self.path)
+
+        self._numbers = {item: numbers for item, item_type, numbers in items}
 
         self.type_count = self._get_items_count_by_type(items)
         self.logger.debug("Found %i ZIP, %i HDF, %i DIR, %i UNKNOWN" %
@@ -41,57 +70,62 @@ class Collection:
 
         return product_list
 
+    def _scan(self, path):
+        """
+        Classify the entries of a directory from os.scandir, without other stat calls on most file systems, and record
+        the YYYYMMDD patterns of their names
+        :param path: directory, ending with '/'
+        :return: generator of [item path, type, YYYYMMDD patterns], type being one of ZIP, HDF, DIR and UNKNOWN
+        """
+        # mtime before the scan, so that changes during the scan invalidate a catalog entry
+        self._dirs.append([path, os.stat(path).st_mtime_ns])
+        with os.scandir(path) as entries:
+            for entry in entries:
+                self.logger.debug("Checking item %s" % entry.name)
+                numbers = DATE_PATTERN.findall(entry.name)
+
+                if entry.is_file():
+                    extension = entry.name[-3:]
+                    if extension == "zip" or extension == "ZIP":
+                        item_type = ZIP
+                    elif extension == "hdf" or extension == "HDF":
+                        item_type = HDF
+                    else:
+                        item_type = UNKNOWN
+                elif entry.is_dir():
+                    if self.recursive and len(numbers) == 0:
+                        yield from self._scan(entry.path + '/')
+                        continue
+                    item_type = DIR
+                else:
+                    continue
+
+                yield [entry.path, item_type, self._path_numbers + numbers]
+
     def _get_items_count_by_type(self, items):
         """
         Identify the most likely product type in between zip, hdf and dir
-        :param items:
+        :param items: list of [item path, type, YYYYMMDD patterns]
         :return: type_count, 4 elements vector counting occurences of [zip, hdf, dir, unknown]
         """
         type_count = [0, 0, 0, 0] # ZIP, HDF, DIR, UKW
-        for item in items:
-            self.logger.debug("Checking item %s" % item)
-            if os.path.isfile(self.path + item):
-                self.logger.debug("%s is a file with extension %s" % (item, item[-3:]))
-                if item[-3:] == "zip" or item[-3:] == "ZIP":
-                    type_count[0] += 1
-                elif item[-3:] == "hdf" or item[-3:] == "HDF":
-                    type_count[1] += 1
-                else:
-                    type_count[3] += 1
-            elif os.path.isdir(self.path + item):
-                type_count[2] += 1
-                self.logger.debug("%s is a directory" % item)
+        for item, item_type, numbers in items:
+            type_count[item_type] += 1
 
         return type_count
 
     def _get_product_list(self, items, type_max):
         """
         Return a list of products of a given type
-        :param items:
+        :param items: list of [item path, type, YYYYMMDD patterns]
         :param type_max:
         :return: a list
         """
-        product_list = []
-        if type_max == 0:
-            for item in items:
-                if os.path.isfile(self.path + item) and (item[-3:] == "zip" or item[-3:] == "ZIP"):
-                    product_list.append(self.path + item)
-
-        elif type_max == 1:
-            for item in items:
-                if os.path.isfile(self.path + item) and (item[-3:] == "hdf" or item[-3:] == "HDF"):
-                    product_list.append(self.path + item)
-
-        elif type_max == 2:
-            for item in items:
-                if os.path.isdir(self.path + item):
-                    product_list.append(self.path + item)
-
-        else:
+        if type_max == UNKNOWN:
             self.logger.error("No any recognized product in collection path %s" % self.path)
             sys.exit(2)
 
-        return product_list
+        return [item for item, item_type, numbers in items if item_type == type_max]
 
     def _get_products_timestamps(self):
         """
@@ -100,8 +134,7 @@ class Collection:
         """
         products_date = []
         for item in self.content_list:
-            self.logger.debug("Looking for timestamp in %s" % item)
-            numbers = re.findall(r'[0-9]{8}', item)
+            numbers = self._numbers[item]
             if len(numbers) != 1:
                 self.logger.warning("Found many date patterns for item %s: %s" % (item, numbers))
             else:
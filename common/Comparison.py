@@ -7,6 +7,7 @@ __author__ = "jerome.colin'at'cesbio.cnes.fr"
 __license__ = "MIT"
 __version__ = "1.0.3"
 
+import datetime
 import os, sys
 
 try:
@@ -20,39 +21,169 @@ except ModuleNotFoundError:
 
 
 class Comparison:
-    def __init__(self, collection1, collection2, logger):
-        self.collection1 = collection1
-        self.collection2 = collection2
+    def __init__(self, collection1, collection2, logger, tolerance=0):
+        """
+        Match the products of two collections by date
+        :param collection1: Collection
+        :param collection2: Collection
+        :param logger: logger instance
+        :param tolerance: maximum difference in days between matching products, the nearest product of collection2
+        being matched
+        """
+        self._match([collection1, collection2], logger, tolerance)
+
+    def _match(self, collections, logger, tolerance):
+        """
+        Set up the comparison of some collections and match their products, see find_matching
+        :param collections: list of Collection, the first one giving the timestamps of matches
+        """
+        self.collection1 = collections[0]
+        self.collection2 = collections[1]
+        self.collections = list(collections)
         self.logger = logger
+        self.tolerance = tolerance
 
         self._check_products_dims()
         self.matching_products = self.find_matching()
 
+    def __iter__(self):
+        return iter(self.matching_products)
+
     def _check_products_dims(self):
         pass
 
     def find_matching(self):
+        """
+        Join the products of the collections on their date, through a dict of the products of each other collection
+        per date. Each product of the first collection is matched with a product of each other collection of the same
+        date, or within tolerance days, and kept only if all collections match. A product is matched once: candidate
+        pairs are taken nearest in time first (the earlier product of the other collection in case of a tie, then the
+        earlier product of the first collection, then products of the same date by path), so that two dates competing
+        for a product get it in turn. Dates with many products are reported, and so are products that could not be
+        matched
+        :return: a list of [first collection timestamp, first collection product, other collections products...]
+        """
         matching_products = []
         self.logger.debug("Init find_matching...")
-        timestamps1 = [item[1] for item in self.collection1.products_timestamps]
-        timestamps2 = [item[1] for item in self.collection2.products_timestamps]
-        self.logger.debug(timestamps1)
-        self.logger.debug(timestamps2)
-
-        for i in range(len(self.collection1.products_timestamps)):
-            try:
-                pid = timestamps2.index((timestamps1[i]))
-                matching_products.append([timestamps1[i], self.collection1.products_timestamps[i][0],
-                                          self.collection2.products_timestamps[pid][0]])
-                self.logger.info("Found matching for %s between %s and %s" %
-                                 (timestamps1[i], self.collection1.products_timestamps[i][0],
-                                  self.collection2.products_timestamps[pid][0]))
-            except ValueError as err:
-                self.logger.warning("Couldn't find match for %s " % timestamps1[i])
-                self.logger.warning(err)
+
+        products = [self._index_by_date(collection.products_timestamps, c + 1)
+                    for c, collection in enumerate(self.collections)]
+        products_timestamps = self.collections[0].products_timestamps
+        assigned = [self._assign(products_timestamps, products[c], c + 1) for c in range(1, len(self.collections))]
+
+        for i, (product, timestamp) in enumerate(products_timestamps):
+            if any([i not in matches for matches in assigned]):
+                continue
+
+            matches = [matches[i] for matches in assigned]
+            matching_products.append([timestamp, product] + [match[0] for match in matches])
+            self.logger.info("Found matching for %s between %s and %s" %
+                             (timestamp, product, " and ".join([self._format_match(match, timestamp)
+                                                                for match in matches])))
 
         self.logger.info("Collections have %i products matching in dates" % len(matching_products))
 
         return matching_products
 
+    def _assign(self, products_timestamps, products, collection):
+        """
+        Match each product of the first collection with at most one product of another collection, and the other way
+        round, nearest in time first
+        :param products_timestamps: list of [product, YYYYMMDD] of the first collection
+        :param products: the other collection indexed by _index_by_date
+        :param collection: number of the other collection, for reporting
+        :return: a dict of [product, YYYYMMDD] of the other collection by index in products_timestamps
+        """
+        offsets = [0]
+        for days in range(1, self.tolerance + 1):
+            offsets += [-days, days]
+
+        # (distance in days, first collection timestamp, offset, paths of the products, index of the first collection
+        # product, date and index among the products of the date), paths breaking ties of products of the same date
+        # whatever the order they were listed in
+        candidates = []
+        for i, (product, timestamp) in enumerate(products_timestamps):
+            date = self._get_date(timestamp)
+            for days in offsets:
+                if date is None and days != 0:
+                    break
+                key = timestamp if date is None else date + days
+                for k, other in enumerate(products.get(key, [])):
+                    candidates.append((abs(days), timestamp, days, other[0], product, i, key, k))
+        candidates.sort()
+
+        assigned = {}
+        taken = set()
+        for distance, timestamp, days, other, product, i, key, k in candidates:
+            if i in assigned or (key, k) in taken:
+                continue
+            assigned[i] = products[key][k]
+            taken.add((key, k))
+
+        in_collection = " in collection %i" % collection if len(self.collections) > 2 else ""
+        candidates_of = set([candidate[5] for candidate in candidates])
+        for i, (product, timestamp) in enumerate(products_timestamps):
+            if i in assigned:
+                continue
+            if i in candidates_of:
+                self.logger.warning("Couldn't find match for %s%s: products within %i day(s) are matched to nearer "
+                                    "products" % (timestamp, in_collection, self.tolerance))
+            else:
+                self.logger.warning("Couldn't find match for %s%s" % (timestamp, in_collection))
+
+        return assigned
+
+    def _format_match(self, match, timestamp):
+        if match[1] == timestamp:
+            return match[0]
+        return "%s of %s" % (match[0], match[1])
+
+    def _get_date(self, timestamp):
+        """
+        :param timestamp: YYYYMMDD
+        :return: a day number if tolerance is set, None otherwise or if timestamp isn't a valid date
+        """
+        if self.tolerance == 0:
+            return None
+
+        try:
+            return datetime.datetime.strptime(timestamp, "%Y%m%d").toordinal()
+        except ValueError:
+            self.logger.warning("%s is not a valid date, matched only as is" % timestamp)
+            return None
+
+    def _index_by_date(self, products_timestamps, collection):
+        """
+        :param products_timestamps: list of [product, YYYYMMDD] of a collection
+        :param collection: collection number, for reporting
+        :return: a dict of [product, YYYYMMDD] lists per date (day number or timestamp, see _get_date)
+        """
+        products = {}
+        for product, timestamp in products_timestamps:
+            date = self._get_date(timestamp)
+            products.setdefault(timestamp if date is None else date, []).append([product, timestamp])
+
+        for date in products:
+            if len(products[date]) > 1:
+                self.logger.warning("Collection %i has %i products for %s: %s" %
+                                    (collection, len(products[date]), products[date][0][1],
+                                     ", ".join([p[0] for p in products[date]])))
+
+        return products
+
+
+class Comparison_multi(Comparison):
+    def __init__(self, collections, logger, tolerance=0):
+        """
+        Match the products of N collections by date, eg. a reference and several processors, so that each match is
+        read once for all of them
+        :param collections: list of Collection, the first one giving the timestamps of matches
+        :param logger: logger instance
+        :param tolerance: maximum difference in days between matching products, the nearest product of each other
+        collection being matched
+        """
+        if len(collections) < 2:
+            logger.error("Can't compare less than 2 collections")
+            sys.exit(2)
 
+        self._match(collections, logger, tolerance)
@@ -8,10 +8,11 @@ __license__ = "MIT"
 __version__ = "1.0.3"
 
 
+import collections
+import logging
 import zipfile
 import sys
 import os
-import subprocess, shlex
 import osgeo.gdal as gdal
 import glob
 import numpy as np
@@ -23,17 +24,128 @@ except ModuleNotFoundError:
     import utilities
 
 
+def _scale(band_arr, scalef, dtype=None):
+    """
+    Apply an optional scale factor
+    :param band_arr: numpy array
+    :param scalef: scale factor or None
+    :param dtype: if given, band_arr is already of this (float) dtype and is scaled in place
+    :return: numpy array
+    """
+    if scalef is None:
+        return band_arr
+    elif dtype is None:
+        return band_arr / scalef
+    else:
+        return np.divide(band_arr, scalef, out=band_arr)
+
+
+class Band_cache:
+    """
+    Least recently used cache of band arrays, bounded in bytes. A cache can be shared by several products as its keys
+    start with the product path. Cached arrays are returned read-only.
+    """
+
+    def __init__(self, max_bytes=1024 ** 3):
+        """
+        Create a band cache
+        :param max_bytes: memory budget, least recently used arrays are evicted beyond it
+        """
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._arrays = collections.OrderedDict()
+
+    def __getstate__(self):
+        # Cached arrays are not sent to other processes
+        state = self.__dict__.copy()
+        state['nbytes'] = 0
+        state['_arrays'] = collections.OrderedDict()
+        return state
+
+    def __len__(self):
+        return len(self._arrays)
+
+    def get(self, key):
+        """
+        :param key: (product path, band file, scalef, layer, tiny)
+        :return: a read-only array, or None if key is not cached
+        """
+        arr = self._arrays.get(key)
+        if arr is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self._arrays.move_to_end(key)
+        return arr
+
+    def put(self, key, arr):
+        """
+        Cache an array, evicting least recently used arrays if needed
+        :param key: (product path, band file, scalef, layer, tiny)
+        :param arr: numpy array
+        :return: the array, read-only
+        """
+        # Don't keep alive a whole multi-layer array for one of its layers
+        base = arr
+        while isinstance(base.base, np.ndarray):
+            base = base.base
+        if base.nbytes > arr.nbytes:
+            arr = arr.copy()
+        arr.setflags(write=False)
+
+        if arr.nbytes > self.max_bytes:
+            return arr
+
+        if key in self._arrays:
+            self.nbytes -= self._arrays.pop(key).nbytes
+        self._arrays[key] = arr
+        self.nbytes += arr.nbytes
+
+        while self.nbytes > self.max_bytes:
+            evicted_key, evicted = self._arrays.popitem(last=False)
+            self.nbytes -= evicted.nbytes
+
+        return arr
+
+    def clear(self):
+        self._arrays.clear()
+        self.nbytes = 0
+
+
 class Product:
-    def __init__(self, path, logger, sensor="venus"):
+    def __init__(self, path, logger, sensor="venus", cache=None, catalog=None):
         """
         Create a product object
         :param path: product path or product file name if ptype is ZIP
         :param logger: logger instance
         :param ptype: defaults to "ZIP"
+        :param cache: optional Band_cache instance used by get_band
+        :param catalog: optional Catalog instance, recording the product type and content list of ZIP and HDF
+        products, so that they are found out again only if the product changed (unused for directory products)
         """
         self.path = path
         self.logger = logger
         self.sre_scalef = 1.
+        self.cache = cache
+        # Listing a directory costs no more than a catalog lookup, and files changed inside a product directory would
+        # not change its mtime
+        if os.path.isdir(path):
+            catalog = None
+        self.catalog = catalog
+        self._masks = {}
+
+        record = None
+        if catalog is not None:
+            record = catalog.get_product(path)
+
+        if record is not None:
+            self.logger.debug("Found %s in catalog" % path)
+            self.ptype = record["ptype"]
+            # json has no tuples, eg. HDF subdatasets
+            self.content_list = [tuple(c) if isinstance(c, list) else c for c in record["content"]]
+            return
 
         # Consistency check
         # TODO: move this test to Collection and use subclasses
@@ -60,6 +172,8 @@ class Product:
             sys.exit(1)
 
         self.get_content_list()
+        if catalog is not None:
+            catalog.put_product(path, getattr(self, "ptype", None), self.content_list)
 
     def find_band(self, band):
         fband_name = [b for b in self.content_list if band in b]
@@ -70,83 +184,244 @@ class Product:
             self.logger.error("%i match found for band name %s in content list: %s" % (len(fband_name), band, self.content_list))
             sys.exit(2)
 
-    def get_band(self, band, scalef=None, layer=None, tiny=False):
+    def _open(self, band):
         """
-        Return a gdal object from an image in a zip archive
-        :param fband:
-        :return: gdal object
+        Open a band file of content_list as a gdal dataset, without going through a temporary file
+        :param band: product image filename from content_list
+        :return: gdal dataset
         """
-        self.logger.debug('Gdal.Open using %s' % (band))
-        if self.ptype == "DIR":
-            if scalef is not None:
-                band_arr = gdal.Open('%s' % (band)).ReadAsArray() / scalef
-            else:
-                band_arr = gdal.Open('%s' % (band)).ReadAsArray()
         if self.ptype == "ZIP":
-            if scalef is not None:
-                band_arr = gdal.Open('/vsizip/%s/%s' % (self.path, band)).ReadAsArray() / scalef
-            else:
-                band_arr = gdal.Open('/vsizip/%s/%s' % (self.path, band)).ReadAsArray()
+            fname = '/vsizip/%s/%s' % (self.path, band)
+        else:
+            fname = band
+
+        self.logger.debug('Gdal.Open using %s' % fname)
+        ds = gdal.Open(fname, gdal.GA_ReadOnly)
+        if ds is None:
+            self.logger.error('ERROR: Unable to open ' + str(fname))
+            sys.exit(1)
+
+        return ds
+
+    def _read_window(self, ds, window, layer=None, dtype=None):
+        """
+        Windowed read of a gdal dataset. Parts of the window outside the raster are filled with nodata (or 0),
+        as gdal_translate -projwin does
+        :param ds: gdal dataset
+        :param window: (xoff, yoff, xsize, ysize)
+        :param layer: if given, only this layer is read (through a gdal band-level read)
+        :param dtype: if given, gdal reads directly into a preallocated buffer of this dtype
+        :return: numpy array, with a leading layer axis if ds has several bands and no layer is given
+        """
+        xoff, yoff, xsize, ysize = window
+        x0 = max(xoff, 0)
+        y0 = max(yoff, 0)
+        x1 = min(xoff + xsize, ds.RasterXSize)
+        y1 = min(yoff + ysize, ds.RasterYSize)
+
+        buf_obj = None
+        if dtype is not None:
+            shape = (y1 - y0, x1 - x0)
+            if layer is None and ds.RasterCount > 1:
+                shape = (ds.RasterCount,) + shape
+            buf_obj = np.empty(shape, dtype=dtype)
+
+        if layer is not None:
+            arr = ds.GetRasterBand(layer + 1).ReadAsArray(x0, y0, x1 - x0, y1 - y0, buf_obj=buf_obj)
+        else:
+            arr = ds.ReadAsArray(x0, y0, x1 - x0, y1 - y0, buf_obj=buf_obj)
+        if (x0, y0, x1, y1) == (xoff, yoff, xoff + xsize, yoff + ysize):
+            return arr
+
+        self.logger.warning("Window %i %i %i %i falls partially outside raster extent. Going on however." % window)
+        nodata = ds.GetRasterBand(1 if layer is None else layer + 1).GetNoDataValue()
+        padded = np.full(arr.shape[:-2] + (ysize, xsize), nodata if nodata is not None else 0, dtype=arr.dtype)
+        padded[..., y0 - yoff:y1 - yoff, x0 - xoff:x1 - xoff] = arr
+        return padded
+
+    def get_band(self, band, scalef=None, layer=None, tiny=False, dtype=None, defer_scaling=False):
+        """
+        Return a band as numpy array, from the band cache if any
+        :param band: product image filename from content_list
+        :param scalef: optional scale factor
+        :param layer: optional layer of a multi-band image
+        :param tiny: return reflectances *10000 as uint16
+        :param dtype: float dtype (eg. np.float32) to read and scale into, in place. Defaults to float64 when scaled
+        :param defer_scaling: return the raw integers and scalef, to scale only the pixels kept downstream
+        :return: numpy array, read-only if the product has a cache, or (raw array, scalef) if defer_scaling
+        """
+        if defer_scaling:
+            return self._get_cached((band, None, layer, False, None), lambda: self._read_band(band, layer=layer)), scalef
+
+        dtype = np.dtype(dtype) if dtype is not None else None
+        return self._get_cached((band, scalef, layer, tiny, dtype),
+                                lambda: self._read_band(band, scalef, layer, tiny, dtype))
+
+    def _get_cached(self, key, reader):
+        """
+        Look for an array in the band cache, or read it and cache it
+        :param key: band part of the cache key, the product path being prepended
+        :param reader: function reading the array on cache miss
+        :return: numpy array
+        """
+        if self.cache is None:
+            return reader()
+
+        key = (self.path,) + key
+        arr = self.cache.get(key)
+        if arr is None:
+            arr = self.cache.put(key, reader())
+        else:
+            self.logger.debug("Band cache hit for %s" % str(key))
+        return arr
+
+    def _read_band(self, band, scalef=None, layer=None, tiny=False, dtype=None):
+        """
+        Read a band as numpy array, only the requested layer being read from a multi-band image
+        :param band: product image filename from content_list
+        :return: numpy array
+        """
+        ds = self._open(band)
+        band_arr = _scale(self._read_window(ds, (0, 0, ds.RasterXSize, ds.RasterYSize), layer=layer, dtype=dtype),
+                          scalef, dtype)
 
         if tiny:
             band_arr = (band_arr*10000).astype(np.uint16)
 
-        if layer is not None:
-            return band_arr[layer,:,:]
+        return band_arr
+
+    def get_layers(self, band, layers, scalefs=None, roi=None, dtype=None):
+        """
+        Read several layers of a multi-band image (eg. VAP and AOT in ATB) in a single open, each layer through a gdal
+        band-level read so that only the requested layers are read
+        :param band: product image filename from content_list
+        :param layers: list of layers
+        :param scalefs: optional list of scale factors, one per layer
+        :param roi: optional Roi object to read a subset
+        :param dtype: optional float dtype to read and scale into, see get_band
+        :return: a list of numpy arrays, one per layer
+        """
+        if scalefs is None:
+            scalefs = [None] * len(layers)
+        dtype = np.dtype(dtype) if dtype is not None else None
+
+        ds = self._open(band)
+        if roi is not None:
+            window = self.get_pixel_window(ds, roi.ulx, roi.uly, roi.lrx, roi.lry)
         else:
-            return band_arr
+            window = (0, 0, ds.RasterXSize, ds.RasterYSize)
+
+        arrs = []
+        for layer, scalef in zip(layers, scalefs):
+            if roi is None:
+                arr = self._get_cached((band, scalef, layer, False, dtype),
+                                       lambda: _scale(self._read_window(ds, window, layer=layer, dtype=dtype),
+                                                      scalef, dtype))
+            else:
+                arr = _scale(self._read_window(ds, window, layer=layer, dtype=dtype), scalef, dtype)
+            arrs.append(arr)
 
-    def get_band_subset(self, band, roi=None, ulx=None, uly=None, lrx=None, lry=None, scalef=None, layer=None):
+        return arrs
+
+    def get_band_subset(self, band, roi=None, ulx=None, uly=None, lrx=None, lry=None, scalef=None, layer=None,
+                        dtype=None):
         """Extract a subset from an image file
         :param band: product image filename from content_list
         :param ulx: upper left x
         :param uly: upper left y
         :param lrx: lower right x
         :param lry: lower right y
-        :return: a Gdal object
+        :param dtype: optional float dtype to read and scale into, see get_band
+        :return: a numpy array
         """
         if roi is not None:
             ulx = roi.ulx
             uly = roi.uly
             lrx = roi.lrx
             lry = roi.lry
-        else:
-            ulx = ulx
-            uly = uly
-            lrx = lrx
-            lry = lry
 
-        try:
-            if self.ptype == "ZIP":
-                translate = 'gdal_translate -projwin %s %s %s %s /vsizip/%s/%s %s' % (
-                    ulx, uly, lrx, lry, self.path, band, ".tmp.tif")
-            else:
-                translate = 'gdal_translate -projwin %s %s %s %s %s %s' % (
-                    ulx, uly, lrx, lry, band, ".tmp.tif")
-
-            self.logger.debug(translate)
-            args = shlex.split(translate)
-            prog = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            out, err = prog.communicate()
-            self.logger.debug('Gdal_translate stdout: %s' % out)
-            self.logger.debug('Gdal_translate stderr: %s' % err)
-            img = gdal.Open(".tmp.tif")
-            os.remove(".tmp.tif")
-
-        except RuntimeError as err:
-            self.logger.error('ERROR: Unable to open ' + band)
-            self.logger.error(err)
-            sys.exit(1)
+        ds = self._open(band)
+        window = self.get_pixel_window(ds, ulx, uly, lrx, lry)
 
-        if scalef is not None:
-            band_arr = img.ReadAsArray() / scalef
-        else:
-            band_arr = img.ReadAsArray()
+        return _scale(self._read_window(ds, window, layer=layer, dtype=dtype), scalef, dtype)
 
-        if layer is not None:
-            return band_arr[layer,:,:]
+    def get_band_window(self, band, window, scalef=None, layer=None, dtype=None):
+        """
+        Read a pixel window of a band, eg. the bounding box of several ROIs
+        :param band: product image filename from content_list
+        :param window: (xoff, yoff, xsize, ysize) in pixels, see get_pixel_window
+        :param scalef: optional scale factor
+        :param layer: optional layer of a multi-band image
+        :param dtype: optional float dtype to read and scale into, see get_band
+        :return: a numpy array
+        """
+        return _scale(self._read_window(self._open(band), window, layer=layer, dtype=dtype), scalef, dtype)
+
+    def iter_blocks(self, bands, block_shape=None, scalefs=None, dtype=None):
+        """
+        Generator reading aligned windows of several bands (and masks) of same dimensions together, so that a raster
+        can be processed with bounded memory
+        :param bands: list of product image filenames from content_list (or subdataset ids for HDF)
+        :param block_shape: (rows, cols) of a block, None for either of them meaning the full raster extent. Defaults
+        to the gdal natural block size of the first band, strips being grouped to at least 256 rows
+        :param scalefs: optional list of scale factors, one per band
+        :param dtype: optional float dtype to read and scale bands with a scale factor into, see get_band
+        :return: yields (xoff, yoff, xsize, ysize) and a list of numpy arrays, one per band
+        """
+        if scalefs is None:
+            scalefs = [None] * len(bands)
+
+        datasets = [self._open(band) for band in bands]
+        xsize = datasets[0].RasterXSize
+        ysize = datasets[0].RasterYSize
+        for b in range(len(datasets)):
+            if (datasets[b].RasterXSize, datasets[b].RasterYSize) != (xsize, ysize):
+                self.logger.error("Band %s has dimensions %ix%i while %s has %ix%i" %
+                                  (bands[b], datasets[b].RasterXSize, datasets[b].RasterYSize, bands[0], xsize, ysize))
+                sys.exit(2)
+
+        if block_shape is None:
+            block_cols, block_rows = datasets[0].GetRasterBand(1).GetBlockSize()
+            if block_cols >= xsize:
+                block_rows = int(np.ceil(256 / block_rows)) * block_rows
         else:
-            return band_arr
+            block_rows, block_cols = block_shape
+        # at least 1, range() failing on a step of 0 for empty rasters
+        block_rows = max(min(block_rows or ysize, ysize), 1)
+        block_cols = max(min(block_cols or xsize, xsize), 1)
+        self.logger.debug("Iterating over %s by blocks of %ix%i" % (str(bands), block_rows, block_cols))
+
+        for yoff in range(0, ysize, block_rows):
+            for xoff in range(0, xsize, block_cols):
+                window = (xoff, yoff, min(block_cols, xsize - xoff), min(block_rows, ysize - yoff))
+                yield window, [_scale(self._read_window(ds, window, dtype=dtype if scalef is not None else None),
+                                      scalef, dtype if scalef is not None else None)
+                               for ds, scalef in zip(datasets, scalefs)]
+
+    def get_pixel_window(self, ds, ulx, uly, lrx, lry):
+        """
+        Convert a projwin into a pixel window, rounded the same way gdal_translate -projwin does
+        :param ds: gdal dataset
+        :param ulx: upper left x
+        :param uly: upper left y
+        :param lrx: lower right x
+        :param lry: lower right y
+        :return: (xoff, yoff, xsize, ysize) in pixels
+        """
+        gt = ds.GetGeoTransform()
+        xoff = int(np.floor((ulx - gt[0]) / gt[1] + 0.001))
+        yoff = int(np.floor((uly - gt[3]) / gt[5] + 0.001))
+        xsize = int(np.floor((lrx - ulx) / gt[1] + 0.5))
+        ysize = int(np.floor((lry - uly) / gt[5] + 0.5))
+        self.logger.debug("Projwin %s %s %s %s converted to window %i %i %i %i" %
+                          (ulx, uly, lrx, lry, xoff, yoff, xsize, ysize))
+
+        if xoff >= ds.RasterXSize or yoff >= ds.RasterYSize or xoff + xsize <= 0 or yoff + ysize <= 0 \
+                or xsize <= 0 or ysize <= 0:
+            self.logger.error("Window %i %i %i %i falls outside raster extent" % (xoff, yoff, xsize, ysize))
+            sys.exit(2)
+
+        return xoff, yoff, xsize, ysize
 
     def get_content_list(self):
         self.content_list = glob.glob(self.path + '/*')
@@ -160,42 +435,97 @@ class Product:
         :param use_nodata: if True, NaN in masks are used instead of 0
         :return: an array with 'valid' = 1, 'non-valid' = 0
         """
+        valid, validity_ratio = self.get_mask_bool(clm, edg, stats=True, use_nodata=use_nodata)
+        dummy = valid.astype(clm.dtype)
 
-        # TODO: consider revising (numpy.ma ?)
-        clm = clm
-        edg = edg
-
-        dummy = np.zeros_like(clm) + 1
-        self.logger.debug("Dummy size=%i, sum=%i" % (np.size(dummy), np.sum(dummy)))
+        if stats:
+            return dummy, validity_ratio
+        else:
+            return dummy
 
+    def get_mask_bool(self, clm, edg, stats=False, use_nodata=False):
+        """
+        Return a boolean validity mask (valid pixel is True) computed in a single pass over clm and edg
+        :param clm: cloud mask numpy array
+        :param edg: edge mask numpy array
+        :param stats: return a fraction of valid pixels in percent
+        :param use_nodata: if True, NaN in masks are used instead of 0
+        :return: a boolean array
+        """
+        valid = np.empty(np.shape(clm), dtype=bool)
         if use_nodata:
-            dummy[~np.isnan(clm)] = 0
-            dummy[~np.isnan(edg)] = 0
+            np.isnan(clm, out=valid)
+            valid &= np.isnan(edg)
         else:
-            dummy[np.nonzero(clm)] = 0
-            dummy[np.nonzero(edg)] = 0
+            np.logical_or(clm, edg, out=valid)
+            np.logical_not(valid, out=valid)
 
-        validity_ratio = np.nansum(dummy) / np.size(clm) * 100
+        n_valid = np.count_nonzero(valid)
+        validity_ratio = n_valid / np.size(clm) * 100
 
-        self.logger.debug("Product.get_mask: NaN in clm=%i, NaN in edg=%i, Non-zero in mask=%i, result=%i, ratio=%4.2f%%" %
-                          (utilities.count_nan(clm), utilities.count_nan(edg), np.count_nonzero(dummy), np.nansum(dummy),
-                           validity_ratio))
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug("Product.get_mask: NaN in clm=%i, NaN in edg=%i, valid=%i, ratio=%4.2f%%" %
+                              (utilities.count_nan(clm), utilities.count_nan(edg), n_valid, validity_ratio))
 
         if stats:
-            return dummy, validity_ratio
+            return valid, validity_ratio
         else:
-            return dummy
+            return valid
+
+    def get_validity_mask(self, resolution=None, stats=False):
+        """
+        Return the boolean validity mask of a resolution, combining its CLM and EDG bands. The mask is computed once
+        per product and resolution, so that all bands of a resolution share it
+        :param resolution: "R1", "R2", "XS"... Defaults to the resolution of clm_name and edg_name
+        :param stats: return a fraction of valid pixels in percent
+        :return: a read-only boolean array (valid pixel is True)
+        """
+        valid, validity_ratio = self._get_masks(resolution)
+
+        if stats:
+            return valid, validity_ratio
+        else:
+            return valid
+
+    def _get_mask_resolution(self, resolution):
+        if resolution is None:
+            return self.clm_name[4:]
+        return resolution
+
+    def _get_masks(self, resolution=None):
+        """
+        Compute once per resolution the validity mask and its ratio
+        :param resolution: see get_validity_mask
+        :return: (valid, validity ratio), the mask being read-only
+        """
+        resolution = self._get_mask_resolution(resolution)
+
+        if resolution not in self._masks:
+            valid, validity_ratio = self._read_validity_mask(resolution)
+            valid.setflags(write=False)
+            self._masks[resolution] = (valid, validity_ratio)
+            self.logger.info("Validity mask %s: %4.2f%% valid" % (resolution, validity_ratio))
+
+        return self._masks[resolution]
+
+    def _read_validity_mask(self, resolution):
+        """
+        Read the CLM and EDG bands of a resolution and combine them
+        :param resolution: "R1", "R2", "XS"...
+        :return: boolean validity mask, validity ratio
+        """
+        return self.get_mask_bool(self._read_band(self.find_band("CLM_" + resolution)),
+                                  self._read_band(self.find_band("EDG_" + resolution)), stats=True)
 
 
 class Product_dir_maja(Product):
     """
     Sub-class of Product for Maja specific methods
     TODO: Add R1 & R2 to band_names
-    TODO: Preload CLM_R1, CLM_R2, EDG_R1 and EDG_R2 to create a boolean MASK_R1 and MASK_R2 to use in get_band to return a numpy.ma
     """
 
-    def __init__(self, path, logger):
-        super().__init__(path, logger)
+    def __init__(self, path, logger, cache=None, catalog=None):
+        super().__init__(path, logger, cache=cache, catalog=catalog)
         self.band_names = ["SRE_B1.",
                            "SRE_B2.",
                            "SRE_B3.",
@@ -213,6 +543,10 @@ class Product_dir_maja(Product):
         self.sre_scalef = 10000
         self.aot_scalef = 200
         self.vap_scalef = 20
+        self.aot_name = "ATB_R1"
+        self.vap_name = "ATB_R1"
+        self.aot_layer = 1
+        self.vap_layer = 0
         self.clm_name = "CLM_R1"
         self.edg_name = "EDG_R1"
 
@@ -222,8 +556,8 @@ class Product_hdf(Product):
     Sub-class of Product for HDF specific methods
     """
 
-    def __init__(self, path, logger):
-        super().__init__(path, logger)
+    def __init__(self, path, logger, cache=None, catalog=None):
+        super().__init__(path, logger, cache=cache, catalog=catalog)
 
     def find_band(self, band):
         """
@@ -249,22 +583,50 @@ class Product_hdf(Product):
         if is_unique == 1:
             return subds_id
 
-    def get_band(self, fband, scalef=None, tiny=False):
+    def get_band(self, fband, scalef=None, tiny=False, dtype=None, defer_scaling=False):
         """
         Overriding mother class method
         :param fband:
+        :param dtype: see Product.get_band
+        :param defer_scaling: see Product.get_band
         :return:
         """
-        if scalef is not None:
-            if tiny:
-                return (gdal.Open(self.content_list[fband][0], gdal.GA_ReadOnly).ReadAsArray() / scalef * 10000).astype(np.uint16)
-            else:
-                return gdal.Open(self.content_list[fband][0], gdal.GA_ReadOnly).ReadAsArray() / scalef
-        else:
-            return gdal.Open(self.content_list[fband][0], gdal.GA_ReadOnly).ReadAsArray().astype(np.int16)
+        if defer_scaling:
+            return self._get_cached((fband, None, None, False, "raw"), lambda: self._open(fband).ReadAsArray()), scalef
 
-    def get_band_subset(self):
-        self.logger.warning("Product_hdf.get_band_subset not yet implemented !")
+        dtype = np.dtype(dtype) if dtype is not None else None
+        return self._get_cached((fband, scalef, None, tiny, dtype),
+                                lambda: self._read_band(fband, scalef=scalef, tiny=tiny, dtype=dtype))
+
+    def _read_band(self, fband, scalef=None, layer=None, tiny=False, dtype=None):
+        """
+        Read a subdataset as numpy array, int16 if neither a scale factor nor a dtype is given
+        :param fband: subdataset id as returned by find_band
+        :return: numpy array
+        """
+        ds = self._open(fband)
+        if scalef is None:
+            return ds.ReadAsArray().astype(np.int16 if dtype is None else dtype)
+
+        band_arr = _scale(self._read_window(ds, (0, 0, ds.RasterXSize, ds.RasterYSize), dtype=dtype), scalef, dtype)
+        if tiny:
+            band_arr = (band_arr * 10000).astype(np.uint16)
+
+        return band_arr
+
+    def _open(self, fband):
+        """
+        Overriding mother class method
+        :param fband: subdataset id as returned by find_band
+        :return: gdal dataset
+        """
+        self.logger.debug('Gdal.Open using %s' % self.content_list[fband][0])
+        ds = gdal.Open(self.content_list[fband][0], gdal.GA_ReadOnly)
+        if ds is None:
+            self.logger.error('ERROR: Unable to open ' + self.content_list[fband][0])
+            sys.exit(1)
+
+        return ds
 
     def get_content_list(self):
         hdf_ds = gdal.Open(self.path, gdal.GA_ReadOnly)
@@ -276,25 +638,39 @@ class Product_hdf_acix(Product_hdf):
     Subclass of Product_hdf for ACIX reference products
     """
 
-    def __init__(self, path, logger):
-        super().__init__(path, logger)
+    def __init__(self, path, logger, cache=None, catalog=None):
+        super().__init__(path, logger, cache=cache, catalog=catalog)
         self.sre_scalef = 10000
 
+    def _get_mask_resolution(self, resolution):
+        """
+        Overriding mother class method, ACIX reference products having a single validity mask
+        """
+        return "refqa"
+
+    def _read_validity_mask(self, resolution):
+        """
+        Overriding mother class method, valid pixels being flagged 1 in refqa
+        :return: boolean validity mask, validity ratio
+        """
+        valid = self._read_band(self.find_band("refqa")) == 1
+        return valid, np.count_nonzero(valid) / np.size(valid) * 100
+
 
 class Product_zip(Product):
     """
     Product subclass for zip
     """
 
-    def __init__(self, path, logger):
-        super().__init__(path, logger)
+    def __init__(self, path, logger, cache=None, catalog=None):
+        super().__init__(path, logger, cache=cache, catalog=catalog)
+        self.name = self.path.split('/')[-1]
 
     def get_content_list(self):
         """
 
         :return: a list of files within a zip
         """
-        self.name = self.path.split('/')[-1]
         with zipfile.ZipFile(self.path, 'r') as zip:
             self.content_list = zip.namelist()
             self.logger.info("Looking into ZIP file content")
@@ -307,8 +683,8 @@ class Product_zip_venus(Product_zip):
     Sub-class of Product_zip for Venus specific methods
     """
 
-    def __init__(self, path, logger):
-        super().__init__(path, logger)
+    def __init__(self, path, logger, cache=None, catalog=None):
+        super().__init__(path, logger, cache=cache, catalog=catalog)
         self.band_names = ["SRE_B1.",
                            "SRE_B2.",
                            "SRE_B3.",
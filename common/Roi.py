@@ -7,9 +7,20 @@ __author__ = "jerome.colin'at'cesbio.cnes.fr"
 __license__ = "MIT"
 __version__ = "1.0.3"
 
+import concurrent.futures
 import numpy as np
 from scipy import stats
 import sys
+import os
+try:
+    import utilities
+except ModuleNotFoundError:
+    this_dir = os.path.dirname(os.path.abspath(__file__))
+    sys.path.append(this_dir)
+    import utilities
+
+# scipy does not export the result type of stats.describe
+DescribeResult = type(stats.describe([0., 1.]))
 
 
 class Roi_collection:
@@ -57,67 +68,130 @@ class Roi_collection:
             self.logger.error("Wrong extent given : %i" % self.extent)
             sys.exit(2)
 
-    def compute_stats_all_bands(self, product, logger, stdout=False, withAOT=False, withVAP=False):
+    def compute_stats_all_bands(self, product, logger, stdout=False, withAOT=False, withVAP=False, batch=False,
+                                max_pixels=4000000, vectorized=False, workers=1):
         """
         Print statistiques for all bands of a product for all ROIs in collectoin
         :param product: a Product instance
         :param logger:
-        :param quicklook: not yet implemented
-        :return:
+        :param stdout: print one line of statistics per ROI and band
+        :param withAOT: add AOT to the list of bands
+        :param withVAP: add VAP to the list of bands
+        :param batch: read each band once over the bounding box of all ROIs (or of a cluster of ROIs) instead of once
+        per ROI
+        :param max_pixels: in batch mode, maximum size of a bounding box before ROIs are split into spatial clusters
+        :param vectorized: batch mode where statistics of all ROIs are computed at once by labelled reductions
+        :param workers: number of processes, bands being spread over a process pool when greater than 1
+        :return: a list of statistics, ROI by ROI and band by band
         """
         # Get the list of bands to compute stats for
-        bands = product.band_names
+        bands = list(product.band_names)
 
         if withAOT:
             bands.append("AOT.")
         if withVAP:
             bands.append("VAP.")
 
-        list_stats = []
+        rois = [Roi(self.coord_arr[i], self.extent, logger) for i in range(len(self.coord_arr))]
+
+        if workers > 1:
+            mask_sizes, roi_stats = self._compute_stats_parallel(rois, product, bands, batch, max_pixels, vectorized,
+                                                                 workers)
+        else:
+            mask_sizes, roi_stats = self._compute_stats(rois, product, bands, batch, max_pixels, vectorized)
 
-        # For each Roi in Roi_collection:
-        for i in range(len(self.coord_arr)):
-            # Get an ROI object
-            roi_n = Roi(self.coord_arr[i], self.extent, logger)
-            # Get the corresponding mask
-            clm = product.get_band_subset(product.find_band(product.clm_name), roi=roi_n)
-            edg = product.get_band_subset(product.find_band(product.edg_name), roi=roi_n)
-            mask = product.get_mask(clm, edg)
-
-            # For each SRE band in product, extract a subset according to ROI and return stats
-            for band in bands:
+        list_stats = []
+        for i in range(len(rois)):
+            for b in range(len(bands)):
                 # samples, minmax, avg, variance, skewness, kurtosis
-                band_size = mask.size
-                stats = self.compute_stats_oneband(roi_n, product, band, mask=mask)
+                stats = roi_stats[i][b]
                 list_stats.append(stats)
                 if stdout:
-                    if stats is not None:
-                        print("%s, %s, %s, %i, %i, %6.1f%%, %10.8f, %10.8f, %10.8f, %10.8f" %
-                              (product.name, roi_n.id, band[:-1], band_size, stats[0], stats[0]/band_size*100, stats[1][0], stats[1][1], stats[2], stats[3]))
-                    else:
-                        print("%s, %s, %s, no valid pixel in ROI (fully cloudy or out of edge)" % (product.name, roi_n.id, band[:-1]))
+                    self._print_stats(product, rois[i], bands[b], mask_sizes[i], stats)
 
         return list_stats
 
-    def compute_stats_oneband(self, roi, product, band, mask=None):
+    def _compute_stats(self, rois, product, bands, batch, max_pixels, vectorized):
+        """
+        Compute statistics of some bands for all ROIs in the current process
+        :return: a list of mask sizes and a list (one item per ROI) of lists of stats (one item per band)
+        """
+        if batch or vectorized:
+            masks, roi_stats = self._compute_stats_batch(rois, product, bands, max_pixels, vectorized=vectorized)
+        else:
+            masks = []
+            roi_stats = []
+            # For each Roi in Roi_collection:
+            for roi_n in rois:
+                # Get the corresponding mask
+                clm = product.get_band_subset(product.find_band(product.clm_name), roi=roi_n)
+                edg = product.get_band_subset(product.find_band(product.edg_name), roi=roi_n)
+                mask = product.get_mask(clm, edg)
+                masks.append(mask)
+
+                # AOT and VAP layers of a same file are read in a single open
+                subsets = {}
+                if "AOT." in bands and "VAP." in bands and product.aot_name == product.vap_name:
+                    subsets["AOT."], subsets["VAP."] = product.get_layers(product.find_band(product.aot_name),
+                                                                          [product.aot_layer, product.vap_layer],
+                                                                          scalefs=[product.aot_scalef,
+                                                                                   product.vap_scalef],
+                                                                          roi=roi_n)
+
+                # For each SRE band in product, extract a subset according to ROI and return stats
+                roi_stats.append([self.compute_stats_oneband(roi_n, product, band, mask=mask, subset=subsets.get(band))
+                                  for band in bands])
+
+        return [mask.size for mask in masks], roi_stats
+
+    def _compute_stats_parallel(self, rois, product, bands, batch, max_pixels, vectorized, workers):
+        """
+        Spread ROIs over a pool of processes, in groups of neighbouring ROIs (ordered by cluster in batch mode). Each
+        process computes the statistics of all bands for its group as _compute_stats does, so that masks are read once
+        per ROI or cluster as in a single process
+        :return: a list of mask sizes and a list (one item per ROI) of lists of stats (one item per band)
+        """
+        if batch or vectorized:
+            order = [i for cluster in self._cluster_rois(rois, product._open(product.find_band(product.clm_name)),
+                                                         product, max_pixels) for i in cluster]
+        else:
+            order = list(range(len(rois)))
+        groups = [list(group) for group in np.array_split(order, min(workers, len(rois)))]
+
+        self.logger.info("Computing statistics of %i ROIs with %i workers" % (len(rois), len(groups)))
+        tasks = [(self, [rois[i] for i in group], product, bands, batch, max_pixels, vectorized) for group in groups]
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(_compute_stats_group, tasks))
+
+        mask_sizes = [None] * len(rois)
+        roi_stats = [None] * len(rois)
+        for group, (group_mask_sizes, group_stats) in zip(groups, results):
+            for k in range(len(group)):
+                mask_sizes[group[k]] = group_mask_sizes[k]
+                roi_stats[group[k]] = group_stats[k]
+        return mask_sizes, roi_stats
+
+    def compute_stats_oneband(self, roi, product, band, mask=None, subset=None):
         """
 
         :param roi: Roi object
         :param product: Product object
         :param band: a string that helps identify a file
+        :param mask: optional validity mask (valid=1)
+        :param subset: optional band subset already read for this roi
         :return:
         """
 
-        if band == "AOT.":
-            subset = product.get_band_subset(product.find_band(product.aot_name), roi=roi, scalef=product.aot_scalef, layer=product.aot_layer)
-        elif band == "VAP.":
-            subset = product.get_band_subset(product.find_band(product.vap_name), roi=roi, scalef=product.vap_scalef, layer=product.vap_layer)
-        else:
-            subset = product.get_band_subset(product.find_band(band), roi=roi, scalef=product.sre_scalef)
+        if subset is None:
+            if band == "AOT.":
+                subset = product.get_band_subset(product.find_band(product.aot_name), roi=roi, scalef=product.aot_scalef, layer=product.aot_layer)
+            elif band == "VAP.":
+                subset = product.get_band_subset(product.find_band(product.vap_name), roi=roi, scalef=product.vap_scalef, layer=product.vap_layer)
+            else:
+                subset = product.get_band_subset(product.find_band(band), roi=roi, scalef=product.sre_scalef)
 
         if mask is not None:
-            search = np.where(mask == 1)
-            valid_pixels = subset[search]
+            valid_pixels = subset[mask == 1]
         else:
             valid_pixels = subset
 
@@ -126,6 +200,161 @@ class Roi_collection:
         except ValueError:
             return None
 
+    def _compute_stats_batch(self, rois, product, bands, max_pixels, vectorized=False):
+        """
+        Read each band (and each mask) once per cluster of ROIs, and slice every ROI out of it
+        :param rois: list of Roi objects
+        :param product: Product object
+        :param bands: list of band names as in compute_stats_all_bands
+        :param max_pixels: maximum size of a cluster bounding box
+        :param vectorized: compute the statistics of all ROIs of a cluster at once with utilities.describe_labelled
+        :return: a list of masks and a list (one item per ROI) of lists of stats (one item per band)
+        """
+        masks = [None] * len(rois)
+        roi_stats = [[None] * len(bands) for i in range(len(rois))]
+
+        clm_name = product.find_band(product.clm_name)
+        edg_name = product.find_band(product.edg_name)
+        clusters = self._cluster_rois(rois, product._open(clm_name), product, max_pixels)
+        self.logger.info("Batch mode: %i ROIs grouped in %i cluster(s)" % (len(rois), len(clusters)))
+
+        for cluster in clusters:
+            clm = self._get_roi_subsets(cluster, *self._read_cluster(cluster, rois, product, clm_name))
+            edg = self._get_roi_subsets(cluster, *self._read_cluster(cluster, rois, product, edg_name))
+            for i in cluster:
+                masks[i] = product.get_mask(clm[i], edg[i])
+
+            if vectorized:
+                # Valid pixels of all ROIs, as (row, col) within each ROI and ROI label within cluster
+                valid = [np.nonzero(masks[i] == 1) for i in cluster]
+                rows = np.concatenate([v[0] for v in valid])
+                cols = np.concatenate([v[1] for v in valid])
+                labels = np.repeat(np.arange(len(cluster)), [len(v[0]) for v in valid])
+
+            for b in range(len(bands)):
+                if bands[b] == "AOT.":
+                    cluster_arr, bbox, windows = self._read_cluster(cluster, rois, product,
+                                                                    product.find_band(product.aot_name),
+                                                                    scalef=product.aot_scalef, layer=product.aot_layer)
+                elif bands[b] == "VAP.":
+                    cluster_arr, bbox, windows = self._read_cluster(cluster, rois, product,
+                                                                    product.find_band(product.vap_name),
+                                                                    scalef=product.vap_scalef, layer=product.vap_layer)
+                else:
+                    cluster_arr, bbox, windows = self._read_cluster(cluster, rois, product,
+                                                                    product.find_band(bands[b]),
+                                                                    scalef=product.sre_scalef)
+
+                for i in cluster:
+                    if masks[i].shape != (windows[i][3], windows[i][2]):
+                        self.logger.error("Band %s and the validity mask %s have different resolutions"
+                                          % (bands[b], clm_name))
+                        sys.exit(2)
+
+                if vectorized:
+                    yoff = np.array([windows[i][1] - bbox[1] for i in cluster])
+                    xoff = np.array([windows[i][0] - bbox[0] for i in cluster])
+                    flat = (rows + yoff[labels]) * bbox[2] + (cols + xoff[labels])
+                    described = utilities.describe_labelled(cluster_arr.ravel()[flat], labels, len(cluster))
+                    for k in range(len(cluster)):
+                        roi_stats[cluster[k]][b] = _describe_tuple(described[k])
+                else:
+                    subsets = self._get_roi_subsets(cluster, cluster_arr, bbox, windows)
+                    for i in cluster:
+                        roi_stats[i][b] = self.compute_stats_oneband(rois[i], product, bands[b], mask=masks[i],
+                                                                     subset=subsets[i])
+
+        return masks, roi_stats
+
+    def _cluster_rois(self, rois, ds, product, max_pixels):
+        """
+        Group ROIs so that the pixel bounding box of each group stays below max_pixels
+        :param rois: list of Roi objects
+        :param ds: gdal dataset used to convert ROI coordinates to pixels
+        :param product: Product object
+        :param max_pixels: maximum size of a cluster bounding box
+        :return: a list of clusters, each one a list of ROI indices
+        """
+        windows = [product.get_pixel_window(ds, r.ulx, r.uly, r.lrx, r.lry) for r in rois]
+        bbox = _get_bbox(windows)
+        if bbox[2] * bbox[3] <= max_pixels:
+            return [list(range(len(rois)))]
+
+        # Bucket ROIs on a regular grid whose cell, plus one ROI, fits in max_pixels
+        cell = max(int(np.sqrt(max_pixels)) - max(max(w[2], w[3]) for w in windows), 1)
+        buckets = {}
+        for i in range(len(windows)):
+            buckets.setdefault((windows[i][1] // cell, windows[i][0] // cell), []).append(i)
+
+        return [buckets[k] for k in sorted(buckets)]
+
+    def _read_cluster(self, cluster, rois, product, band, scalef=None, layer=None):
+        """
+        Read a band once over the bounding box of a cluster of ROIs
+        :return: the bounding box array, the bounding box and a dict of ROI windows by ROI index
+        """
+        ds = product._open(band)
+        windows = {i: product.get_pixel_window(ds, rois[i].ulx, rois[i].uly, rois[i].lrx, rois[i].lry)
+                   for i in cluster}
+        bbox = _get_bbox(list(windows.values()))
+
+        return product.get_band_window(band, bbox, scalef=scalef, layer=layer), bbox, windows
+
+    def _get_roi_subsets(self, cluster, cluster_arr, bbox, windows):
+        """
+        Slice every ROI of a cluster out of its bounding box array
+        :return: a dict of subsets, by ROI index
+        """
+        subsets = {}
+        for i in cluster:
+            xoff, yoff, xsize, ysize = windows[i]
+            subsets[i] = cluster_arr[..., yoff - bbox[1]:yoff - bbox[1] + ysize, xoff - bbox[0]:xoff - bbox[0] + xsize]
+
+        return subsets
+
+    def _print_stats(self, product, roi, band, band_size, stats):
+        if stats is not None:
+            print("%s, %s, %s, %i, %i, %6.1f%%, %10.8f, %10.8f, %10.8f, %10.8f" %
+                  (product.name, roi.id, band[:-1], band_size, stats[0], stats[0]/band_size*100, stats[1][0], stats[1][1], stats[2], stats[3]))
+        else:
+            print("%s, %s, %s, no valid pixel in ROI (fully cloudy or out of edge)" % (product.name, roi.id, band[:-1]))
+
+
+def _compute_stats_group(task):
+    """
+    Process pool worker of Roi_collection._compute_stats_parallel
+    :param task: (roi_collection, rois of the group, product, bands, batch, max_pixels, vectorized)
+    :return: see Roi_collection._compute_stats
+    """
+    roi_collection, rois, product, bands, batch, max_pixels, vectorized = task
+    return roi_collection._compute_stats(rois, product, bands, batch, max_pixels, vectorized)
+
+
+def _describe_tuple(described):
+    """
+    Convert a record of utilities.describe_labelled to the layout of scipy.stats.describe
+    :param described: one record of utilities.describe_labelled
+    :return: DescribeResult(nobs, (min, max), mean, variance, skewness, kurtosis), or None if nobs is 0
+    """
+    if described['nobs'] == 0:
+        return None
+
+    return DescribeResult(int(described['nobs']), (described['min'], described['max']), described['mean'],
+                          described['variance'], described['skewness'], described['kurtosis'])
+
+
+def _get_bbox(windows):
+    """
+    Bounding box of a list of pixel windows
+    :param windows: list of (xoff, yoff, xsize, ysize)
+    :return: (xoff, yoff, xsize, ysize)
+    """
+    xoff = min(w[0] for w in windows)
+    yoff = min(w[1] for w in windows)
+    xend = max(w[0] + w[2] for w in windows)
+    yend = max(w[1] + w[3] for w in windows)
+    return xoff, yoff, xend - xoff, yend - yoff
+
 
 class Roi:
     def __init__(self, id_utmx_utmy, extent, logger):
@@ -0,0 +1,152 @@
+"""
+Appendable on-disk store of reference and maja sample pairs
+
+"""
+
+__author__ = "jerome.colin'at'cesbio.cnes.fr"
+__license__ = "MIT"
+__version__ = "1.0.3"
+
+import json
+import os
+import shutil
+import sys
+import numpy as np
+
+
+class Sample_store:
+    """
+    Directory of (ref, maja) sample pairs. Each append writes a chunk as one float32 .npy file per column, listed in
+    index.json, so that samples are written as they come and readers can memory-map chunks instead of loading the
+    whole store.
+    """
+
+    columns = ("ref", "maja")
+    dtype = np.float32
+
+    def __init__(self, path, logger, mode="a"):
+        """
+        Open a sample store
+        :param path: store directory
+        :param logger: logger instance
+        :param mode: "r" to read an existing store, "a" to append to a store, created if needed, "w" to create an
+        empty store, overwriting any existing one
+        """
+        self.path = path
+        self.logger = logger
+        self.mode = mode
+        self.index_file = os.path.join(path, "index.json")
+
+        if mode == "r" and not os.path.isfile(self.index_file):
+            logger.error("No sample store found in %s" % path)
+            sys.exit(2)
+
+        if mode == "w" and os.path.isdir(path):
+            shutil.rmtree(path)
+
+        if os.path.isfile(self.index_file):
+            with open(self.index_file, 'r') as f:
+                self.chunks = json.load(f)["chunks"]
+        else:
+            os.makedirs(path, exist_ok=True)
+            self.chunks = []
+            self._write_index()
+
+    def __len__(self):
+        return sum([chunk["samples"] for chunk in self.chunks])
+
+    def append(self, ref, maja, **metadata):
+        """
+        Write a chunk of samples
+        :param ref: reference samples vector
+        :param maja: maja samples vector, same length as ref
+        :param metadata: optional json serializable items recorded in the index with the chunk, eg. site and timestamp
+        """
+        if len(ref) != len(maja):
+            self.logger.error("Can't append %i ref samples with %i maja samples to %s" % (len(ref), len(maja),
+                                                                                          self.path))
+            sys.exit(2)
+
+        if len(ref) == 0:
+            return
+
+        chunk = self._new_chunk(len(ref), metadata)
+        for column, values in zip(self.columns, (ref, maja)):
+            np.save(self._get_file(chunk, column), np.asarray(values, dtype=self.dtype))
+        self._add_chunk(chunk)
+
+    def append_memmap(self, samples, **metadata):
+        """
+        Preallocate a chunk and return it memory-mapped for writing, eg. to copy samples in without holding them all.
+        The chunk is listed in the index once allocated
+        :param samples: number of samples of the chunk
+        :param metadata: see append
+        :return: (ref, maja) writable memory-mapped vectors
+        """
+        chunk = self._new_chunk(samples, metadata)
+        arrays = tuple([np.lib.format.open_memmap(self._get_file(chunk, column), mode='w+', dtype=self.dtype,
+                                                  shape=(samples,)) for column in self.columns])
+        self._add_chunk(chunk)
+        return arrays
+
+    def extend(self, other):
+        """
+        Append copies of all chunks of another store
+        :param other: Sample_store
+        """
+        for chunk in other.chunks:
+            metadata = {key: chunk[key] for key in chunk if key not in ("file", "samples")}
+            new_chunk = self._new_chunk(chunk["samples"], metadata)
+            for column in self.columns:
+                shutil.copyfile(other._get_file(chunk, column), self._get_file(new_chunk, column))
+            self._add_chunk(new_chunk)
+
+    def get_chunk(self, i, mmap=True):
+        """
+        Read a chunk
+        :param i: chunk number
+        :param mmap: memory-map the chunk instead of reading it
+        :return: (ref, maja) vectors
+        """
+        return tuple([np.load(self._get_file(self.chunks[i], column), mmap_mode='r' if mmap else None)
+                      for column in self.columns])
+
+    def iter_chunks(self, mmap=True):
+        """
+        Generator of chunks, see get_chunk
+        """
+        for i in range(len(self.chunks)):
+            yield self.get_chunk(i, mmap=mmap)
+
+    def read(self):
+        """
+        Read all samples. A store of a single chunk (eg. as written by aggregator.py) is memory-mapped, chunks being
+        concatenated otherwise
+        :return: (ref, maja) vectors
+        """
+        if len(self.chunks) == 0:
+            return np.zeros((0), dtype=self.dtype), np.zeros((0), dtype=self.dtype)
+
+        if len(self.chunks) == 1:
+            return self.get_chunk(0)
+
+        chunks = list(self.iter_chunks())
+        return tuple([np.concatenate([chunk[c] for chunk in chunks]) for c in range(len(self.columns))])
+
+    def _new_chunk(self, samples, metadata):
+        chunk = {"file": "%05i" % len(self.chunks), "samples": int(samples)}
+        chunk.update(metadata)
+        return chunk
+
+    def _add_chunk(self, chunk):
+        self.chunks.append(chunk)
+        self._write_index()
+
+    def _get_file(self, chunk, column):
+        return os.path.join(self.path, "%s_%s.npy" % (chunk["file"], column))
+
+    def _write_index(self):
+        # The index is replaced once complete, so that it is never read half written
+        with open(self.index_file + ".tmp", 'w') as f:
+            json.dump({"columns": self.columns, "dtype": np.dtype(self.dtype).name, "chunks": self.chunks}, f)
+        os.replace(self.index_file + ".tmp", self.index_file)
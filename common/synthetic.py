@@ -0,0 +1,211 @@
+"""
+Synthetic products generator, to test and benchmark mtools without the ACIX, MAJA and Venus archives
+
+"""
+
+__author__ = "jerome.colin'at'cesbio.cnes.fr"
+__license__ = "MIT"
+__version__ = "1.0.3"
+
+import os
+import shutil
+import tempfile
+import zipfile
+import numpy as np
+import osgeo.gdal as gdal
+import osgeo.osr as osr
+
+
+# <maja_band>, <acix_band>, <resolution>
+S2_BANDS = (
+    ["SRE_B2.", "band02", "R1"],
+    ["SRE_B3.", "band03", "R1"],
+    ["SRE_B4.", "band04", "R1"],
+    ["SRE_B5.", "band05", "R2"],
+    ["SRE_B6.", "band06", "R2"],
+    ["SRE_B7.", "band07", "R2"],
+    ["SRE_B8.", "band08", "R1"],
+    ["SRE_B8A.", "band8a", "R2"],
+    ["SRE_B11.", "band11", "R2"],
+    ["SRE_B12.", "band12", "R2"])
+
+VENUS_BANDS = ["SRE_B%i." % b for b in range(1, 13)]
+
+UTM_EPSG = 32631
+ULX = 649000
+ULY = 4239000
+
+
+def make_maja_dir(path, timestamp="20171005", size=900, cloud_fraction=0.2, seed=0):
+    """
+    Write a synthetic Maja S2 directory product (SRE_B*, CLM_R1/R2, EDG_R1/R2, ATB_R1)
+    :param path: collection directory to write the product in
+    :param timestamp: YYYYMMDD date of the product
+    :param size: number of rows and columns at R1 (10m), R2 being size // 2
+    :param cloud_fraction: approximate fraction of cloudy pixels
+    :param seed: random seed, products with the same seed and timestamp are identical
+    :return: product path
+    """
+    rng = np.random.default_rng([seed, int(timestamp)])
+    name = "SENTINEL2A_%s-103241-161_L2A_T31TFJ_C_V1-0" % timestamp
+    product = os.path.join(path, name)
+    os.makedirs(product, exist_ok=True)
+
+    sizes = {"R1": size, "R2": size // 2}
+    res = {"R1": 10, "R2": 20}
+    clouds = {r: _get_clouds(rng, sizes[r], cloud_fraction) for r in sizes}
+    for r in sizes:
+        _write_tif(os.path.join(product, "%s_CLM_%s.tif" % (name, r)), clouds[r].astype(np.uint8) * 2, res[r],
+                   gdal.GDT_Byte)
+        _write_tif(os.path.join(product, "%s_EDG_%s.tif" % (name, r)), _get_edges(sizes[r]), res[r], gdal.GDT_Byte)
+
+    for maja_band, acix_band, r in S2_BANDS:
+        _write_tif(os.path.join(product, "%s_%stif" % (name, maja_band)), _get_sr(rng, sizes[r]), res[r])
+
+    atb = np.stack([np.full((size, size), 30, dtype=np.uint8), rng.integers(20, 60, (size, size), dtype=np.uint8)])
+    _write_tif(os.path.join(product, "%s_ATB_R1.tif" % name), atb, 10, gdal.GDT_Byte)
+
+    return product
+
+
+def make_acix_hdf(path, timestamp="20171005", size=900, cloud_fraction=0.2, seed=0, maja=None):
+    """
+    Write a synthetic ACIX reference product (band02...band12 and refqa subdatasets). The file is written as
+    netCDF-4, which gdal lists as subdatasets the same way as the HDF4 ACIX products
+    :param path: collection directory to write the product in
+    :param timestamp: YYYYMMDD date of the product
+    :param size: number of rows and columns
+    :param cloud_fraction: approximate fraction of cloudy pixels
+    :param seed: random seed
+    :param maja: optional Maja product path written with make_maja_dir, reference reflectances are then close to it
+    :return: product path
+    """
+    rng = np.random.default_rng([seed, int(timestamp), 1])
+    fname = os.path.join(path, "refsrs2-L1C_T31TFJ_A003037_%sT104550-Synthetic.hdf" % timestamp)
+    os.makedirs(path, exist_ok=True)
+
+    subdatasets = []
+    for maja_band, acix_band, r in S2_BANDS:
+        if maja is not None:
+            sr = gdal.Open([os.path.join(maja, f) for f in os.listdir(maja) if maja_band in f][0]).ReadAsArray()
+            if r == "R2":
+                sr = sr.repeat(2, axis=0).repeat(2, axis=1)
+            sr = np.clip(sr + rng.normal(0, 50, sr.shape), -1000, 15000).astype(np.int16)
+        else:
+            sr = _get_sr(rng, size)
+        subdatasets.append((acix_band, sr))
+    subdatasets.append(("refqa", (~_get_clouds(rng, size, cloud_fraction)).astype(np.int16)))
+
+    for i in range(len(subdatasets)):
+        mem = gdal.GetDriverByName("MEM").Create("", size, size, 1, gdal.GDT_Int16)
+        _set_georef(mem, 10)
+        mem.GetRasterBand(1).WriteArray(subdatasets[i][1])
+        options = ["FORMAT=NC4", "COMPRESS=DEFLATE", "VARIABLE_NAME=" + subdatasets[i][0]]
+        if i > 0:
+            options.append("APPEND_SUBDATASET=YES")
+        gdal.GetDriverByName("netCDF").CreateCopy(fname, mem, options=options)
+
+    return fname
+
+
+def make_acix_site(path, timestamps=("20171005", "20171007"), size=900, cloud_fraction=0.2, seed=0):
+    """
+    Write a synthetic ACIX site, ie. a collection of reference products and a collection of matching Maja products
+    :param path: site directory
+    :return: a "<ref_collection>,<maja_collection>" line, as expected in acix_extract.py list files
+    """
+    ref_collection = os.path.join(path, "ref")
+    maja_collection = os.path.join(path, "maja")
+    for timestamp in timestamps:
+        maja = make_maja_dir(maja_collection, timestamp, size, cloud_fraction, seed)
+        make_acix_hdf(ref_collection, timestamp, size, cloud_fraction, seed, maja=maja)
+
+    return ref_collection + "," + maja_collection
+
+
+def make_venus_zip(path, timestamp="20200402", size=2000, cloud_fraction=0.2, seed=0):
+    """
+    Write a synthetic zipped Venus product (SRE_B1...SRE_B12, CLM_XS, EDG_XS, ATB_XS)
+    :param path: collection directory to write the product in
+    :param timestamp: YYYYMMDD date of the product
+    :param size: number of rows and columns
+    :param cloud_fraction: approximate fraction of cloudy pixels
+    :param seed: random seed
+    :return: product path
+    """
+    rng = np.random.default_rng([seed, int(timestamp), 2])
+    name = "VENUS-XS_%s-191352-000_L2A_SYNTHETIC_C_V2-2" % timestamp
+    os.makedirs(path, exist_ok=True)
+    fname = os.path.join(path, "VENUS-XS_%s-191352-000_L2A_SYNTHETIC_D.zip" % timestamp)
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        files = {}
+        for band in VENUS_BANDS:
+            files[band + "tif"] = _get_sr(rng, size) // 10
+        files["CLM_XS.tif"] = _get_clouds(rng, size, cloud_fraction).astype(np.uint8) * 2
+        files["EDG_XS.tif"] = _get_edges(size)
+        files["ATB_XS.tif"] = np.stack([np.full((size, size), 11, dtype=np.uint8),
+                                        rng.integers(20, 60, (size, size), dtype=np.uint8)])
+
+        with zipfile.ZipFile(fname, "w", zipfile.ZIP_STORED) as zip:
+            for suffix in files:
+                tif = os.path.join(tmp_dir, "%s_%s" % (name, suffix))
+                dtype = gdal.GDT_Int16 if files[suffix].dtype == np.int16 else gdal.GDT_Byte
+                _write_tif(tif, files[suffix], 5, dtype)
+                zip.write(tif, "%s/%s_%s" % (name, name, suffix))
+    finally:
+        shutil.rmtree(tmp_dir)
+
+    return fname
+
+
+def write_roi_file(fname, n, extent=100, size=2000, res=5, seed=0):
+    """
+    Write a roistats coordinate file of n ROIs randomly located within a product written by make_venus_zip
+    :return: fname
+    """
+    rng = np.random.default_rng(seed)
+    margin = extent / 2 + res
+    utmx = rng.uniform(ULX + margin, ULX + size * res - margin, n)
+    utmy = rng.uniform(ULY - size * res + margin, ULY - margin, n)
+    np.savetxt(fname, np.column_stack((np.arange(n), utmx, utmy)), delimiter=",", fmt=["%i", "%.1f", "%.1f"])
+    return fname
+
+
+def _get_clouds(rng, size, cloud_fraction, cell=16):
+    # Blocky cloud cover, rather than salt and pepper
+    coarse = rng.random((size // cell + 1, size // cell + 1)) < cloud_fraction
+    return coarse.repeat(cell, axis=0).repeat(cell, axis=1)[:size, :size]
+
+
+def _get_edges(size, width=None):
+    edg = np.zeros((size, size), dtype=np.uint8)
+    width = width or max(size // 50, 1)
+    edg[:, :width] = 1
+    edg[:width, :] = 1
+    return edg
+
+
+def _get_sr(rng, size):
+    # Surface reflectances as int16 (*10000) with a few negative values
+    return np.clip(rng.normal(1500, 800, (size, size)), -200, 10000).astype(np.int16)
+
+
+def _set_georef(ds, res):
+    ds.SetGeoTransform((ULX, res, 0, ULY, 0, -res))
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(UTM_EPSG)
+    ds.SetProjection(srs.ExportToWkt())
+
+
+def _write_tif(fname, arr, res, dtype=gdal.GDT_Int16):
+    if arr.ndim == 2:
+        arr = arr[np.newaxis]
+    ds = gdal.GetDriverByName("GTiff").Create(fname, arr.shape[2], arr.shape[1], arr.shape[0], dtype,
+                                              options=["COMPRESS=DEFLATE", "TILED=YES"])
+    _set_georef(ds, res)
+    for layer in range(arr.shape[0]):
+        ds.GetRasterBand(layer + 1).WriteArray(arr[layer])
+    ds.FlushCache()
+    ds = None
@@ -0,0 +1,133 @@
+"""
+Pytest for Apu
+
+"""
+
+__author__ = "jerome.colin'at'cesbio.cnes.fr"
+__license__ = "MIT"
+__version__ = "1.0.3"
+
+import Apu
+import utilities
+import numpy
+import pytest
+
+logger = utilities.get_logger('test_Apu', verbose=True)
+
+
+def test_apu_stats(tmp_path):
+    logger.info("TESTING APU_STATS")
+    ref = numpy.random.uniform(-0.05, 1.05, 10000).astype(numpy.float32)
+    maja = ref + numpy.random.normal(0, 0.01, 10000).astype(numpy.float32)
+
+    stats = Apu.Apu_stats(logger, samples=20)
+    stats.add(ref, maja)
+    assert len(stats) == 10000
+
+    acc, pre, unc = stats.get_apu()
+    assert acc == pytest.approx(utilities.accuracy(maja - ref), abs=1e-6)
+    assert pre == pytest.approx(utilities.precision(maja - ref), rel=1e-4)
+    assert unc == pytest.approx(utilities.uncertainty(maja - ref), rel=1e-4)
+
+    bins_count, bins_acc, bins_pre, bins_unc = stats.get_binned_apu()
+    in_bin = (ref >= 0.25) & (ref < 0.3)
+    assert bins_count[5] == numpy.count_nonzero(in_bin)
+    assert bins_acc[5] == pytest.approx(utilities.accuracy(maja[in_bin] - ref[in_bin]), abs=1e-6)
+    assert bins_unc[5] == pytest.approx(utilities.uncertainty(maja[in_bin] - ref[in_bin]), rel=1e-4)
+    assert 0.25 <= stats.get_mean_ref()[5] < 0.3
+
+    # statistics of any split of the samples merge to the same statistics
+    merged = Apu.Apu_stats(logger, samples=20)
+    for part in numpy.array_split(numpy.arange(10000), 3):
+        part_stats = Apu.Apu_stats(logger, samples=20)
+        part_stats.add(ref[part], maja[part])
+        merged.merge(part_stats)
+    assert numpy.array_equal(merged.count, stats.count)
+    assert numpy.allclose(merged.sum_delta2, stats.sum_delta2)
+
+    fname = str(tmp_path / ("site_valid_band02" + Apu.SUFFIX))
+    merged.save(fname)
+    loaded = Apu.Apu_stats(logger, fname=fname)
+    assert loaded.samples == 20
+    assert numpy.array_equal(loaded.sum_ref, merged.sum_ref)
+
+    with pytest.raises(SystemExit):
+        loaded.merge(Apu.Apu_stats(logger, samples=10))
+
+
+def test_joint_histogram(tmp_path):
+    logger.info("TESTING JOINT_HISTOGRAM")
+    ref = numpy.random.uniform(-0.05, 1.05, 10000)
+    maja = ref + numpy.random.normal(0, 0.01, 10000)
+    in_range = (ref >= 0) & (ref < 1) & (maja >= 0) & (maja < 1)
+
+    hist = Apu.Joint_histogram(logger, step=0.001)
+    hist.add(ref, maja)
+    assert hist.counts.shape == (1000, 1000)
+    assert len(hist) == 10000
+    assert hist.outside == numpy.count_nonzero(~in_range)
+    assert hist.counts[int(ref[in_range][0] * 1000), int(maja[in_range][0] * 1000)] >= 1
+
+    # APU from bin centres, to within the bin width
+    stats = hist.get_apu_stats(samples=20)
+    reference = Apu.Apu_stats(logger, samples=20)
+    reference.add(ref[in_range], maja[in_range])
+    assert numpy.array_equal(stats.count, reference.count)
+    acc, pre, unc = stats.get_binned_apu()[1:]
+    ref_acc, ref_pre, ref_unc = reference.get_binned_apu()[1:]
+    assert numpy.allclose(acc, ref_acc, atol=0.001)
+    assert numpy.allclose(unc, ref_unc, atol=0.001)
+    assert numpy.allclose(stats.get_mean_ref(), reference.get_mean_ref(), atol=0.001)
+
+    merged = Apu.Joint_histogram(logger, step=0.001)
+    for part in numpy.array_split(numpy.arange(10000), 4):
+        part_hist = Apu.Joint_histogram(logger, step=0.001)
+        part_hist.add(ref[part], maja[part])
+        merged.merge(part_hist)
+    assert numpy.array_equal(merged.counts, hist.counts)
+    assert merged.outside == hist.outside
+
+    fname = str(tmp_path / ("site_valid_band02" + Apu.HIST_SUFFIX))
+    merged.save(fname)
+    loaded = Apu.Joint_histogram(logger, fname=fname)
+    assert loaded.step == 0.001
+    assert len(loaded) == 10000
+    assert numpy.array_equal(loaded.counts, hist.counts)
+
+    with pytest.raises(SystemExit):
+        loaded.merge(Apu.Joint_histogram(logger))
+
+
+def test_joint_histogram_overflow(tmp_path):
+    logger.info("TESTING JOINT_HISTOGRAM overflow")
+    limit = numpy.iinfo(Apu.HIST_DTYPE).max
+    hist = Apu.Joint_histogram(logger, step=0.1)
+    hist.add(numpy.array([0.05, 0.55]), numpy.array([0.05, 0.55]))
+    assert hist.counts.dtype == Apu.HIST_DTYPE
+    hist.counts[0, 0] = limit - 1
+    fname = str(tmp_path / ("site_valid_band02" + Apu.HIST_SUFFIX))
+    hist.save(fname)
+
+    # promoted while adding samples
+    loaded = Apu.Joint_histogram(logger, fname=fname)
+    assert loaded.counts.dtype == Apu.HIST_DTYPE
+    loaded.add(numpy.array([0.05, 0.05, 0.55]), numpy.array([0.05, 0.05, 0.55]))
+    assert loaded.counts.dtype == numpy.uint64
+    assert loaded.counts[0, 0] == limit + 1
+    assert loaded.counts[5, 5] == 2
+
+    # promoted while merging, and kept as uint64 when loaded
+    merged = Apu.Joint_histogram(logger, fname=fname)
+    merged.merge(Apu.Joint_histogram(logger, fname=fname))
+    assert merged.counts.dtype == numpy.uint64
+    assert merged.counts[0, 0] == 2 * (limit - 1)
+    merged.save(fname)
+    assert Apu.Joint_histogram(logger, fname=fname).counts[0, 0] == 2 * (limit - 1)
+
+    # no promotion far from the limit
+    small = Apu.Joint_histogram(logger, step=0.1)
+    for i in range(3):
+        small.merge(Apu.Joint_histogram(logger, step=0.1))
+        small.add(numpy.array([0.05]), numpy.array([0.05]))
+    assert small.counts.dtype == Apu.HIST_DTYPE
+    assert small.counts[0, 0] == 3
@@ -0,0 +1,84 @@
+"""
+Pytest for Catalog
+
+"""
+
+__author__ = "jerome.colin'at'cesbio.cnes.fr"
+__license__ = "MIT"
+__version__ = "1.0.3"
+
+import os
+import pickle
+import sqlite3
+import Catalog
+import Collection
+import utilities
+
+logger = utilities.get_logger('test_Catalog', verbose=True)
+
+
+def test_catalog_collection(tmp_path):
+    logger.info("TESTING CATALOG_COLLECTION")
+    collection_path = tmp_path / "ref"
+    collection_path.mkdir()
+    for timestamp in ["20171005", "20171007"]:
+        (collection_path / ("refsrs2-L1C_%s.hdf" % timestamp)).touch()
+
+    catalog = Catalog.Catalog(str(tmp_path / "catalog.sqlite"), logger)
+    scanned = Collection.Collection(str(collection_path), logger, catalog=catalog)
+    assert (catalog.hits, catalog.misses) == (0, 1)
+
+    catalog = Catalog.Catalog(str(tmp_path / "catalog.sqlite"), logger)
+    recorded = Collection.Collection(str(collection_path), logger, catalog=catalog)
+    assert (catalog.hits, catalog.misses) == (1, 0)
+    assert recorded.type_count == scanned.type_count
+    assert recorded.content_list == scanned.content_list
+    assert recorded.products_timestamps == scanned.products_timestamps
+
+    # A new product changes the mtime of the collection directory
+    (collection_path / "refsrs2-L1C_20171010.hdf").touch()
+    os.utime(str(collection_path), ns=(0, 0))
+    changed = Collection.Collection(str(collection_path), logger, catalog=catalog)
+    assert catalog.misses == 1
+    assert changed.type_count == [0, 3, 0, 0]
+
+    catalog = Catalog.Catalog(str(tmp_path / "catalog.sqlite"), logger, rebuild=True)
+    Collection.Collection(str(collection_path), logger, catalog=catalog)
+    assert catalog.misses == 1
+
+
+def test_catalog_product(tmp_path):
+    logger.info("TESTING CATALOG_PRODUCT")
+    product = tmp_path / "refsrs2-L1C_20171005.hdf"
+    product.write_bytes(b"hdf")
+    catalog = Catalog.Catalog(str(tmp_path / "catalog.sqlite"), logger)
+    assert catalog.get_product(str(product)) is None
+
+    content = [["HDF4_SDS:UNKNOWN:\"%s\":0" % product, "[900x900] band02 (16-bit integer)"]]
+    catalog.put_product(str(product), "HDF", content)
+
+    # Processes open their own connection
+    catalog = pickle.loads(pickle.dumps(catalog))
+    record = catalog.get_product(str(product))
+    assert record["ptype"] == "HDF"
+    assert record["content"] == content
+
+    product.write_bytes(b"hdf, rewritten")
+    assert catalog.get_product(str(product)) is None
+
+
+def test_catalog_errors(tmp_path):
+    logger.info("TESTING CATALOG_ERRORS")
+    product = tmp_path / "refsrs2-L1C_20171005.hdf"
+    product.write_bytes(b"hdf")
+    catalog = Catalog.Catalog(str(tmp_path / "catalog.sqlite"), logger)
+    catalog.put_product(str(product), "HDF", [])
+
+    # eg. another process holding the database, SQLite errors are not raised to the catalog users
+    connection = sqlite3.connect(str(tmp_path / "catalog.sqlite"))
+    with connection:
+        connection.execute("DROP TABLE products")
+    connection.close()
+
+    catalog.put_product(str(product), "HDF", [])
+    assert catalog.get_product(str(product)) is None
@@ -10,25 +10,48 @@ __version__ = "1.0.3"
 import Collection
 import utilities
 import os
+import pytest
 
-TEST_DATA_PATH = os.environ['TEST_DATA_PATH']
+# tests on tmp_path collections run without the test data
+TEST_DATA_PATH = os.environ.get('TEST_DATA_PATH')
+requires_data = pytest.mark.skipif(TEST_DATA_PATH is None, reason="TEST_DATA_PATH not set")
 
 
 logger = utilities.get_logger('test_Collection', verbose=True)
 
-venus_collection = Collection.Collection(TEST_DATA_PATH + "venus_collection/", logger)
-acix_maja_collection = Collection.Collection(TEST_DATA_PATH + "acix_carpentras/", logger)
-acix_vermote_collection = Collection.Collection(TEST_DATA_PATH + "vermote_carpentras/", logger)
+if TEST_DATA_PATH is not None:
+    venus_collection = Collection.Collection(TEST_DATA_PATH + "venus_collection/", logger)
+    acix_maja_collection = Collection.Collection(TEST_DATA_PATH + "acix_carpentras/", logger)
+    acix_vermote_collection = Collection.Collection(TEST_DATA_PATH + "vermote_carpentras/", logger)
 
 
+@requires_data
 def test_discover():
     assert venus_collection.type_count == [2,0,0,0]
     assert acix_vermote_collection.type_count == [0, 6, 0, 0]
     assert acix_maja_collection.type_count == [0, 0, 6, 0]
 
+@requires_data
 def test_products_timestamps():
     assert sorted(venus_collection.products_timestamps, key = lambda x: x[1])[0][1] == "20200402"
     assert sorted(acix_maja_collection.products_timestamps, key = lambda x: x[1])[0][1] == "20171005"
     assert sorted(acix_maja_collection.products_timestamps, key=lambda x: x[1])[-1][1] == "20171030"
     assert sorted(acix_vermote_collection.products_timestamps, key = lambda x: x[1])[0][1] == "20171005"
-    assert sorted(acix_vermote_collection.products_timestamps, key=lambda x: x[1])[-1][1] == "20171030"
\ No newline at end of file
+    assert sorted(acix_vermote_collection.products_timestamps, key=lambda x: x[1])[-1][1] == "20171030"
+
+def test_discover_recursive(tmp_path):
+    for tile in ["T31TFJ/2017", "T31TFK"]:
+        (tmp_path / tile).mkdir(parents=True)
+        for timestamp in ["20171005", "20171007"]:
+            (tmp_path / tile / ("refsrs2-L1C_%s.hdf" % timestamp)).touch()
+    (tmp_path / "readme.txt").touch()
+
+    flat_collection = Collection.Collection(str(tmp_path), logger)
+    assert flat_collection.type_count == [0, 0, 2, 1]
+    assert flat_collection.products_timestamps == []
+
+    nested_collection = Collection.Collection(str(tmp_path), logger, recursive=True)
+    assert nested_collection.type_count == [0, 4, 0, 1]
+    assert sorted([t[1] for t in nested_collection.products_timestamps]) == ["20171005", "20171005", "20171007",
+                                                                              "20171007"]
+    assert str(tmp_path / "T31TFJ/2017/refsrs2-L1C_20171005.hdf") in nested_collection.content_list
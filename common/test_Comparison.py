@@ -11,13 +11,17 @@ import Collection
 import Comparison
 import utilities
 import os
+import pytest
 
-TEST_DATA_PATH = os.environ['TEST_DATA_PATH']
+# tests on tmp_path collections run without the test data
+TEST_DATA_PATH = os.environ.get('TEST_DATA_PATH')
+requires_data = pytest.mark.skipif(TEST_DATA_PATH is None, reason="TEST_DATA_PATH not set")
 
 
 logger = utilities.get_logger('test_Comparison', verbose=True)
 
 
+@requires_data
 def test_Comparison_basic():
     logger.info("test_Comparison")
     acix_maja_collection = Collection.Collection(TEST_DATA_PATH + "acix_carpentras/", logger)
@@ -27,3 +31,100 @@ def test_Comparison_basic():
     assert sorted(compare.matching_products, key = lambda x: x[1])[0][0] == "20171005"
     assert sorted(compare.matching_products, key = lambda x: x[1])[0][1] == TEST_DATA_PATH + "vermote_carpentras/refsrs2-L1C_T31TFJ_A003037_20171005T104550-Carpentras.hdf"
     assert sorted(compare.matching_products, key = lambda x: x[1])[0][2] == TEST_DATA_PATH + "acix_carpentras/SENTINEL2B_20171005-104550-197_L2A_T31TFJ_C_V1-0"
+
+
+def test_Comparison_tolerance(tmp_path):
+    ref_path = tmp_path / "ref"
+    maja_path = tmp_path / "maja"
+    ref_path.mkdir()
+    maja_path.mkdir()
+    for timestamp in ("20171005", "20171010", "20171020"):
+        (ref_path / ("refsrs2-L1C_T31TFJ_%sT104550-Carpentras.hdf" % timestamp)).touch()
+    for timestamp in ("20171004", "20171006", "20171011", "20171011"):
+        (maja_path / ("SENTINEL2B_%s-104550-%i_L2A_T31TFJ_C_V1-0" % (timestamp, len(os.listdir(maja_path))))).mkdir()
+
+    ref_collection = Collection.Collection(str(ref_path), logger)
+    maja_collection = Collection.Collection(str(maja_path), logger)
+
+    compare = Comparison.Comparison(ref_collection, maja_collection, logger)
+    assert len(compare.matching_products) == 0
+
+    compare = Comparison.Comparison(ref_collection, maja_collection, logger, tolerance=1)
+    matches = sorted(compare.matching_products)
+    assert [m[0] for m in matches] == ["20171005", "20171010"]
+    # nearest in time, the earlier one on ties
+    assert "20171004" in matches[0][2]
+    assert "20171011" in matches[1][2]
+    assert matches[1][1] == str(ref_path / "refsrs2-L1C_T31TFJ_20171010T104550-Carpentras.hdf")
+
+
+
+def test_Comparison_tolerance_one_to_one(tmp_path):
+    ref_path = tmp_path / "ref"
+    maja_path = tmp_path / "maja"
+    ref_path.mkdir()
+    maja_path.mkdir()
+    for timestamp in ("20171005", "20171006"):
+        (ref_path / ("refsrs2-L1C_T31TFJ_%sT104550-Carpentras.hdf" % timestamp)).touch()
+    (maja_path / "SENTINEL2B_20171005-104550-197_L2A_T31TFJ_C_V1-0").mkdir()
+
+    ref_collection = Collection.Collection(str(ref_path), logger)
+    maja_collection = Collection.Collection(str(maja_path), logger)
+
+    # both reference dates compete for the same maja product, which goes to the nearest one only
+    compare = Comparison.Comparison(ref_collection, maja_collection, logger, tolerance=1)
+    assert [m[0] for m in compare.matching_products] == ["20171005"]
+
+    (maja_path / "SENTINEL2B_20171007-104550-197_L2A_T31TFJ_C_V1-0").mkdir()
+    maja_collection = Collection.Collection(str(maja_path), logger)
+    compare = Comparison.Comparison(ref_collection, maja_collection, logger, tolerance=1)
+    matches = sorted(compare.matching_products)
+    assert [m[0] for m in matches] == ["20171005", "20171006"]
+    assert "20171005" in matches[0][2]
+    assert "20171007" in matches[1][2]
+
+
+def test_Comparison_tolerance_ties(tmp_path):
+    ref_path = tmp_path / "ref"
+    maja_path = tmp_path / "maja"
+    ref_path.mkdir()
+    maja_path.mkdir()
+    for name in ("A", "B"):
+        (ref_path / ("refsrs2-L1C_T31TFJ_20171006T104550-Carpentras-%s.hdf" % name)).touch()
+    for name in ("197", "198"):
+        (maja_path / ("SENTINEL2B_20171005-104550-%s_L2A_T31TFJ_C_V1-0" % name)).mkdir()
+        (maja_path / ("SENTINEL2B_20171007-104550-%s_L2A_T31TFJ_C_V1-0" % name)).mkdir()
+
+    ref_collection = Collection.Collection(str(ref_path), logger)
+    maja_collection = Collection.Collection(str(maja_path), logger)
+
+    # products at equal distance are matched by path, whatever the order they were listed in
+    expected = None
+    for listed in range(2):
+        compare = Comparison.Comparison(ref_collection, maja_collection, logger, tolerance=1)
+        matches = sorted(compare.matching_products, key=lambda m: m[1])
+        assert [os.path.basename(m[2]) for m in matches] == ["SENTINEL2B_20171005-104550-197_L2A_T31TFJ_C_V1-0",
+                                                              "SENTINEL2B_20171005-104550-198_L2A_T31TFJ_C_V1-0"]
+        assert expected is None or matches == expected
+        expected = matches
+        maja_collection.products_timestamps.reverse()
+
+
+def test_Comparison_multi(tmp_path):
+    paths = []
+    for name, timestamps in (("ref", ("20171005", "20171010", "20171020")), ("maja", ("20171005", "20171010")),
+                             ("other", ("20171010", "20171020"))):
+        path = tmp_path / name
+        path.mkdir()
+        for timestamp in timestamps:
+            (path / ("SENTINEL2B_%s-104550-197_L2A_T31TFJ_C_V1-0" % timestamp)).mkdir()
+        paths.append(str(path))
+
+    collections = [Collection.Collection(path, logger) for path in paths]
+    compare = Comparison.Comparison_multi(collections, logger)
+    assert list(compare) == [["20171010"] + [os.path.join(path, "SENTINEL2B_20171010-104550-197_L2A_T31TFJ_C_V1-0")
+                                             for path in paths]]
+
+    compare = Comparison.Comparison_multi(collections[:2], logger)
+    assert sorted(compare.matching_products) == \
+        sorted(Comparison.Comparison(collections[0], collections[1], logger).matching_products)
@@ -10,6 +10,7 @@ __version__ = "1.0.3"
 import os
 import pytest
 import Product
+import Catalog
 import Roi
 import utilities
 import numpy
@@ -76,6 +77,36 @@ def test_product_mask_use_zeros():
     assert mask[2,1] == 1
     logger.debug("test_product_mask ratio=%6.4f" % ratio)
 
+def test_product_mask_bool():
+    logger.info("TESTING PRODUCT GET_MASK_BOOL")
+    p_dir = Product.Product(TEST_DATA_PATH + "acix_carpentras/SENTINEL2A_20171007-103241-161_L2A_T31TFJ_C_V1-0",
+                                  logger)
+    clm = numpy.zeros((3,3), dtype=numpy.uint8) + 2
+    edg = numpy.zeros_like(clm) + 1
+    clm[1:, :] = 0
+    edg[:, 1] = 0
+    valid, ratio = p_dir.get_mask_bool(clm, edg, stats=True)
+    assert valid.dtype == bool
+    assert numpy.count_nonzero(valid) == 2
+    assert ratio == pytest.approx(2/9*100)
+    assert numpy.array_equal(valid, p_dir.get_mask(clm, edg) == 1)
+
+def test_product_dir_maja_validity_mask():
+    logger.info("TESTING PRODUCT_DIR_MAJA GET_VALIDITY_MASK")
+    p_dir_maja = Product.Product_dir_maja(TEST_DATA_PATH + "acix_carpentras/SENTINEL2A_20171007-103241-161_L2A_T31TFJ_C_V1-0",
+                                  logger)
+    for res in ["R1", "R2"]:
+        clm = p_dir_maja.get_band(p_dir_maja.find_band("CLM_" + res))
+        edg = p_dir_maja.get_band(p_dir_maja.find_band("EDG_" + res))
+        mask, ratio = p_dir_maja.get_mask(clm, edg, stats=True)
+        valid, valid_ratio = p_dir_maja.get_validity_mask(res, stats=True)
+        assert numpy.array_equal(valid, mask == 1)
+        assert valid_ratio == pytest.approx(ratio)
+        assert p_dir_maja.get_validity_mask(res) is valid
+        assert valid.flags.writeable == False
+
+    assert p_dir_maja.get_validity_mask() is p_dir_maja.get_validity_mask("R1")
+
 ## TEST PRODUCT_ZIP_VENUS
 def test_product_zip_venus():
     logger.info("TEST PRODUCT_ZIP_VENUS")
@@ -214,4 +245,119 @@ def test_product_dir_maja():
     assert b4_subset[0, 0] == 0.1362
     assert b4_subset[1, 0] == 0.1451
     assert b4_subset[0, 1] == 0.1173
-    assert b4_subset[1, 1] == 0.1306
\ No newline at end of file
+    assert b4_subset[1, 1] == 0.1306
+    logger.info("test_product_dir_maja_get_band_subset_matches_full_band")
+    b4_full = p_dir_maja.get_band(p_dir_maja.find_band("SRE_B4."), scalef=p_dir_maja.sre_scalef)
+    ds = p_dir_maja._open(p_dir_maja.find_band("SRE_B4."))
+    xoff, yoff, xsize, ysize = p_dir_maja.get_pixel_window(ds, roi.ulx, roi.uly, roi.lrx, roi.lry)
+    assert numpy.array_equal(b4_subset, b4_full[yoff:yoff + ysize, xoff:xoff + xsize])
+
+
+def test_band_cache():
+    logger.info("TESTING BAND_CACHE")
+    cache = Product.Band_cache(max_bytes=200)
+    a = numpy.zeros(10)
+    b = numpy.ones(10)
+    cache.put(("p", "a", None, None, False), a)
+    cache.put(("p", "b", None, None, False), b)
+    assert cache.nbytes == 160
+    assert cache.get(("p", "a", None, None, False)) is a
+    assert cache.hits == 1
+    assert cache.get(("p", "c", None, None, False)) is None
+    assert cache.misses == 1
+
+    # least recently used is evicted
+    cache.put(("p", "c", None, None, False), numpy.zeros(10))
+    assert len(cache) == 2
+    assert cache.get(("p", "b", None, None, False)) is None
+    assert cache.get(("p", "a", None, None, False)) is a
+
+    with pytest.raises(ValueError):
+        a[0] = 1
+
+    p_dir_maja = Product.Product_dir_maja(TEST_DATA_PATH + "acix_carpentras/SENTINEL2A_20171007-103241-161_L2A_T31TFJ_C_V1-0",
+                                          logger, cache=Product.Band_cache())
+    b4 = p_dir_maja.get_band(p_dir_maja.find_band("SRE_B4."), scalef=p_dir_maja.sre_scalef)
+    b4_again = p_dir_maja.get_band(p_dir_maja.find_band("SRE_B4."), scalef=p_dir_maja.sre_scalef)
+    assert b4_again is b4
+    assert p_dir_maja.cache.hits == 1
+    assert p_dir_maja.cache.misses == 1
+
+
+def test_product_zip_venus_get_layers():
+    logger.info("TEST PRODUCT_ZIP_VENUS GET_LAYERS")
+    p_zip_venus = Product.Product_zip_venus(TEST_DATA_PATH + "VENUS-XS_20200402-191352-000_L2A_GALLOP30_D.zip", logger)
+    atb_filename = p_zip_venus.find_band(p_zip_venus.aot_name)
+    roi = Roi.Roi([99, 649460, 4238440], 10, logger)
+    aot, vap = p_zip_venus.get_layers(atb_filename, [p_zip_venus.aot_layer, p_zip_venus.vap_layer],
+                                      scalefs=[p_zip_venus.aot_scalef, p_zip_venus.vap_scalef], roi=roi)
+    assert aot[0, 0] == 0.195
+    assert aot[1, 1] == 0.195
+    assert vap[0, 0] == 0.55
+    assert vap[1, 1] == 0.55
+
+    aot, vap = p_zip_venus.get_layers(atb_filename, [p_zip_venus.aot_layer, p_zip_venus.vap_layer],
+                                      scalefs=[p_zip_venus.aot_scalef, p_zip_venus.vap_scalef])
+    assert numpy.shape(aot)[0] == 11686
+    assert numpy.shape(vap)[1] == 11711
+
+
+def test_product_dir_maja_iter_blocks():
+    logger.info("TESTING PRODUCT_DIR_MAJA ITER_BLOCKS")
+    p_dir_maja = Product.Product_dir_maja(TEST_DATA_PATH + "acix_carpentras/SENTINEL2A_20171007-103241-161_L2A_T31TFJ_C_V1-0",
+                                          logger)
+    bands = [p_dir_maja.find_band("SRE_B4."), p_dir_maja.find_band("CLM_R1"), p_dir_maja.find_band("EDG_R1")]
+    full = [p_dir_maja.get_band(b) for b in bands]
+    rebuilt = [numpy.zeros_like(a) for a in full]
+    for (xoff, yoff, xsize, ysize), blocks in p_dir_maja.iter_blocks(bands, block_shape=(100, 128)):
+        assert ysize <= 100
+        assert xsize <= 128
+        for b in range(len(bands)):
+            rebuilt[b][yoff:yoff + ysize, xoff:xoff + xsize] = blocks[b]
+
+    for b in range(len(bands)):
+        assert numpy.array_equal(rebuilt[b], full[b])
+
+
+def test_product_hdf_acix_dtype():
+    p_hdf_acix = Product.Product_hdf_acix(TEST_DATA_PATH + "vermote_carpentras/refsrs2-L1C_T31TFJ_A012260_20171027T103128-Carpentras.hdf", logger)
+    b7 = p_hdf_acix.get_band(p_hdf_acix.find_band("band07"), scalef=p_hdf_acix.sre_scalef)
+    b7_f32 = p_hdf_acix.get_band(p_hdf_acix.find_band("band07"), scalef=p_hdf_acix.sre_scalef, dtype=numpy.float32)
+    assert b7_f32.dtype == numpy.float32
+    assert numpy.array_equal(b7_f32, b7.astype(numpy.float32))
+
+    b7_raw, scalef = p_hdf_acix.get_band(p_hdf_acix.find_band("band07"), scalef=p_hdf_acix.sre_scalef,
+                                         defer_scaling=True)
+    assert scalef == 10000
+    assert b7_raw[12, 5] == 1829
+    assert numpy.array_equal(b7_raw / scalef, b7)
+
+
+def test_product_catalog(tmp_path):
+    path = TEST_DATA_PATH + "vermote_carpentras/refsrs2-L1C_T31TFJ_A012260_20171027T103128-Carpentras.hdf"
+    catalog = Catalog.Catalog(str(tmp_path / "catalog.sqlite"), logger)
+    p_hdf = Product.Product_hdf_acix(path, logger, catalog=catalog)
+    band = p_hdf.find_band("band04")
+    b4 = p_hdf.get_band(band, scalef=p_hdf.sre_scalef)
+    valid, ratio = p_hdf.get_validity_mask(stats=True)
+
+    p_recorded = Product.Product_hdf_acix(path, logger, catalog=catalog)
+    assert (catalog.hits, catalog.misses) == (1, 1)
+    assert p_recorded.content_list == p_hdf.content_list
+    assert p_recorded.get_validity_mask(stats=True)[1] == ratio
+    assert numpy.array_equal(p_recorded.get_band(band, scalef=p_recorded.sre_scalef), b4)
+
+
+def test_product_dir_catalog(tmp_path):
+    product = tmp_path / "SENTINEL2A_20171007-103241-161_L2A_T31TFJ_C_V1-0"
+    product.mkdir()
+    (product / "X_SRE_B2.tif").write_bytes(b"tif")
+    catalog = Catalog.Catalog(str(tmp_path / "catalog.sqlite"), logger)
+    p_dir = Product.Product_dir_maja(str(product), logger, catalog=catalog)
+    assert p_dir.catalog is None
+    assert catalog.get_product(str(product)) is None
+
+    # listed again, eg. once a band is written
+    (product / "X_SRE_B3.tif").write_bytes(b"tif")
+    p_dir = Product.Product_dir_maja(str(product), logger, catalog=catalog)
+    assert sorted(os.path.basename(f) for f in p_dir.content_list) == ["X_SRE_B2.tif", "X_SRE_B3.tif"]
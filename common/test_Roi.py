@@ -12,6 +12,7 @@ import Product
 import utilities
 import numpy
 import os
+import pytest
 
 TEST_DATA_PATH = os.environ['TEST_DATA_PATH']
 
@@ -145,3 +146,52 @@ def test_Roi_collection_compute_stats_all_bands():
     assert list_stats[15][1][0] == 0.086
     assert list_stats[15][1][1] == 0.113
     assert list_stats[15][2] == 0.0965
+
+
+def test_Roi_collection_compute_stats_all_bands_batch():
+    logger.info("TESTING Statistics for Roi_collection.compute_stats_all_bands in batch mode")
+    collection_10m = Roi.Roi_collection(TEST_DATA_PATH + "demo.csv", 10, logger)
+    list_stats = collection_10m.compute_stats_all_bands(p_venus, logger)
+    list_stats_batch = collection_10m.compute_stats_all_bands(p_venus, logger, batch=True)
+    list_stats_clusters = collection_10m.compute_stats_all_bands(p_venus, logger, batch=True, max_pixels=16)
+    assert len(list_stats_batch) == len(list_stats)
+    for s in range(len(list_stats)):
+        if list_stats[s] is None:
+            assert list_stats_batch[s] is None
+            assert list_stats_clusters[s] is None
+        else:
+            assert list_stats_batch[s][0] == list_stats[s][0]
+            assert list_stats_batch[s][2] == list_stats[s][2]
+            assert list_stats_clusters[s][1] == list_stats[s][1]
+
+
+def test_Roi_collection_compute_stats_all_bands_vectorized():
+    logger.info("TESTING Statistics for Roi_collection.compute_stats_all_bands with labelled reductions")
+    collection_10m = Roi.Roi_collection(TEST_DATA_PATH + "demo.csv", 10, logger)
+    list_stats = collection_10m.compute_stats_all_bands(p_venus, logger, vectorized=True)
+    assert list_stats[15][0] == 4
+    assert list_stats[15][1][0] == 0.086
+    assert list_stats[15][1][1] == 0.113
+    assert list_stats[15][2] == pytest.approx(0.0965)
+
+
+def test_Roi_collection_compute_stats_all_bands_workers():
+    logger.info("TESTING Statistics for Roi_collection.compute_stats_all_bands with a process pool")
+    collection_10m = Roi.Roi_collection(TEST_DATA_PATH + "demo.csv", 10, logger)
+    list_stats = collection_10m.compute_stats_all_bands(p_venus, logger)
+    list_stats_workers = collection_10m.compute_stats_all_bands(p_venus, logger, workers=4)
+    assert len(list_stats_workers) == len(list_stats)
+    for s in range(len(list_stats)):
+        if list_stats[s] is None:
+            assert list_stats_workers[s] is None
+        else:
+            assert type(list_stats_workers[s]) == type(list_stats[s])
+            assert tuple(list_stats_workers[s]) == tuple(list_stats[s])
+
+    list_stats = collection_10m.compute_stats_all_bands(p_venus, logger, batch=True, max_pixels=100)
+    list_stats_workers = collection_10m.compute_stats_all_bands(p_venus, logger, batch=True, max_pixels=100,
+                                                                workers=4)
+    assert len(list_stats_workers) == len(list_stats)
+    for s in range(len(list_stats)):
+        if list_stats[s] is not None:
+            assert tuple(list_stats_workers[s]) == tuple(list_stats[s])
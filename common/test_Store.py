@@ -0,0 +1,52 @@
+"""
+Pytest for Store
+
+"""
+
+__author__ = "jerome.colin'at'cesbio.cnes.fr"
+__license__ = "MIT"
+__version__ = "1.0.3"
+
+import Store
+import utilities
+import numpy
+
+logger = utilities.get_logger('test_Store', verbose=True)
+
+
+def test_sample_store(tmp_path):
+    logger.info("TESTING SAMPLE_STORE")
+    path = str(tmp_path / "site_valid_band02.store")
+    store = Store.Sample_store(path, logger, mode="w")
+    assert len(store) == 0
+
+    ref = numpy.random.rand(100)
+    maja = ref + 0.01
+    store.append(ref[:60], maja[:60], site="site", timestamp="20171005")
+    store.append(ref[:0], maja[:0], site="site", timestamp="20171007")
+    store.append(ref[60:], maja[60:], site="site", timestamp="20171010")
+    assert len(store) == 100
+    assert len(store.chunks) == 2
+
+    store = Store.Sample_store(path, logger, mode="r")
+    assert store.chunks[1]["timestamp"] == "20171010"
+    sr_ref, sr_maja = store.read()
+    assert numpy.array_equal(sr_ref, ref.astype(numpy.float32))
+    assert numpy.array_equal(sr_maja, maja.astype(numpy.float32))
+    assert type(store.get_chunk(0)[0]) is numpy.memmap
+
+    stacked = Store.Sample_store(str(tmp_path / "Stacked_valid_band02.store"), logger)
+    stacked.extend(store)
+    stacked.extend(store)
+    assert len(stacked) == 200
+    assert numpy.array_equal(stacked.read()[0][100:], ref.astype(numpy.float32))
+
+    aggregated = Store.Sample_store(str(tmp_path / "Stacked_band02.store"), logger, mode="w")
+    sr_ref, sr_maja = aggregated.append_memmap(len(store))
+    sr_ref[:] = store.read()[0]
+    sr_maja[:] = store.read()[1]
+    sr_ref.flush()
+    sr_maja.flush()
+    sr_ref, sr_maja = Store.Sample_store(str(tmp_path / "Stacked_band02.store"), logger, mode="r").read()
+    assert type(sr_ref) is numpy.memmap
+    assert numpy.array_equal(sr_maja, maja.astype(numpy.float32))
@@ -0,0 +1,256 @@
+"""
+Pytest for acix_extract sample selection
+
+"""
+
+__author__ = "jerome.colin'at'cesbio.cnes.fr"
+__license__ = "MIT"
+__version__ = "1.0.3"
+
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import acix_extract
+import synthetic
+import utilities
+import numpy
+import pytest
+
+logger = utilities.get_logger('test_acix_extract', verbose=True)
+
+R1_BAND = ["band02", "SRE_B2.", "R1", []]
+
+
+def get_arrays(size, seed=0):
+    """
+    Synthetic reference and maja bands, reference QA (valid=1) and maja validity mask (valid=True)
+    """
+    rng = numpy.random.default_rng(seed)
+    return (synthetic._get_sr(rng, size), (~synthetic._get_clouds(rng, size, 0.3, cell=4)).astype(numpy.int16),
+            synthetic._get_sr(rng, size), ~synthetic._get_clouds(rng, size, 0.3, cell=4))
+
+
+def test_parse_bands():
+    assert acix_extract.parse_bands("all", 10) == list(range(10))
+    assert acix_extract.parse_bands("4", 10) == [4]
+    assert acix_extract.parse_bands("0,4,9", 10) == [0, 4, 9]
+    assert acix_extract.parse_bands("10", 10) is None
+    assert acix_extract.parse_bands("-1", 10) is None
+    assert acix_extract.parse_bands("0,x", 10) is None
+    assert acix_extract.parse_bands("", 10) is None
+
+
+def test_filter_samples():
+    b_ref, m_ref_qa, b_maja, m_maja_qa = get_arrays(40)
+    samples = acix_extract.filter_samples(b_ref, m_ref_qa, b_maja, m_maja_qa)
+    assert list(samples) == ["valid"]
+
+    samples = acix_extract.filter_samples(b_ref, m_ref_qa, b_maja, m_maja_qa, negative=True, keepall=True)
+    cloudfree = (m_ref_qa == 1) & m_maja_qa
+    expected = {"valid": cloudfree & (b_ref > 0) & (b_maja > 0),
+                "negative": cloudfree & ((b_ref < 0) | (b_maja < 0)),
+                "keepall": cloudfree}
+    assert sorted(samples) == sorted(expected)
+    for key in expected:
+        assert numpy.array_equal(samples[key][0], b_ref[expected[key]])
+        assert numpy.array_equal(samples[key][1], b_maja[expected[key]])
+    assert len(samples["negative"][0]) > 0
+    assert len(samples["valid"][0]) + len(samples["negative"][0]) <= len(samples["keepall"][0])
+
+    # maja validity mask given as 1 (valid) and 0 instead of booleans
+    samples_int = acix_extract.filter_samples(b_ref, m_ref_qa, b_maja, m_maja_qa.astype(numpy.uint8), negative=True,
+                                              keepall=True)
+    for key in expected:
+        assert numpy.array_equal(samples_int[key][0], samples[key][0])
+        assert numpy.array_equal(samples_int[key][1], samples[key][1])
+
+
+def test_resample_r2_upsample():
+    b_ref, m_ref_qa, b_maja, m_maja_qa = get_arrays(40)
+    b_maja = b_maja[:20, :20]
+    m_maja_qa = m_maja_qa[:20, :20]
+    samples = acix_extract.filter_samples(*acix_extract.resample_r2(b_ref, m_ref_qa, b_maja, m_maja_qa, "upsample"),
+                                          negative=True)
+
+    # same samples, in the same order, as a nearest neighbor upsampling of maja
+    expected = acix_extract.filter_samples(b_ref, m_ref_qa, b_maja.repeat(2, axis=0).repeat(2, axis=1),
+                                           m_maja_qa.repeat(2, axis=0).repeat(2, axis=1), negative=True)
+    for key in expected:
+        assert numpy.array_equal(samples[key][0], expected[key][0])
+        assert numpy.array_equal(samples[key][1], expected[key][1])
+
+
+def test_resample_r2_downsample():
+    b_ref, m_ref_qa, b_maja, m_maja_qa = get_arrays(40)
+    b_maja = b_maja[:20, :20]
+    m_maja_qa = m_maja_qa[:20, :20]
+    m_ref_qa[0, 1] = 0
+    m_ref_qa[2:4, 2:4] = 1
+    b_ref_r2, m_ref_qa_r2, b_maja_r2, m_maja_qa_r2 = acix_extract.resample_r2(b_ref, m_ref_qa, b_maja, m_maja_qa,
+                                                                              "downsample")
+    assert numpy.shape(b_ref_r2) == (20, 20)
+    assert b_maja_r2 is b_maja
+    assert m_maja_qa_r2 is m_maja_qa
+
+    # 2x2 mean of the reference, valid only if all 4 pixels are valid
+    assert b_ref_r2[3, 7] == pytest.approx((int(b_ref[6, 14]) + b_ref[6, 15] + b_ref[7, 14] + b_ref[7, 15]) / 4)
+    assert not m_ref_qa_r2[0, 0]
+    assert m_ref_qa_r2[1, 1]
+    for row in range(20):
+        for col in range(20):
+            assert m_ref_qa_r2[row, col] == (m_ref_qa[2 * row:2 * row + 2, 2 * col:2 * col + 2] == 1).all()
+
+
+def test_resample_r2_odd_size():
+    b_ref, m_ref_qa, b_maja, m_maja_qa = get_arrays(41)
+    for resample in ["upsample", "downsample"]:
+        # an odd reference edge has no R2 pixel to fall in
+        with pytest.raises(TypeError):
+            acix_extract.resample_r2(b_ref, m_ref_qa, b_maja[:20, :20], m_maja_qa[:20, :20], resample)
+        with pytest.raises(TypeError):
+            acix_extract.resample_r2(b_ref, m_ref_qa, b_maja[:21, :21], m_maja_qa[:21, :21], resample)
+        with pytest.raises(TypeError):
+            acix_extract.resample_r2(b_ref[:40, :41], m_ref_qa[:40, :41], b_maja[:20, :20], m_maja_qa[:20, :20],
+                                     resample)
+
+
+class Blocks_product:
+    """
+    Stand-in for the products of filter_match_blockwise, streaming in-memory bands by full-width blocks of rows
+    """
+
+    def __init__(self, bands, sre_scalef):
+        self.bands = bands
+        self.sre_scalef = sre_scalef
+
+    def find_band(self, band):
+        return band
+
+    def iter_blocks(self, bands, block_shape=None):
+        rows, cols = numpy.shape(self.bands[bands[0]])
+        for yoff in range(0, rows, block_shape[0]):
+            yield (0, yoff, cols, min(block_shape[0], rows - yoff)), [self.bands[b][yoff:yoff + block_shape[0]]
+                                                                       for b in bands]
+
+    def get_mask_bool(self, clm, edg):
+        return (clm == 0) & (edg == 0)
+
+
+def get_blocks_products(rows, maja_rows=None, cols=10, seed=0):
+    rng = numpy.random.default_rng(seed)
+    maja_rows = rows if maja_rows is None else maja_rows
+    p_ref = Blocks_product({"band02": rng.integers(-100, 3000, (rows, cols)),
+                            "refqa": (rng.random((rows, cols)) < 0.8).astype(numpy.int16)}, 10000)
+    p_maja = Blocks_product({"SRE_B2.": rng.integers(-100, 3000, (maja_rows, cols)),
+                             "CLM_R1": (rng.random((maja_rows, cols)) < 0.2).astype(numpy.uint8),
+                             "EDG_R1": numpy.zeros((maja_rows, cols), dtype=numpy.uint8)}, 1000)
+    return p_ref, p_maja
+
+
+def test_filter_match_blockwise():
+    p_ref, p_maja = get_blocks_products(25)
+    samples, errors = acix_extract.filter_match_blockwise(p_ref, [p_maja], R1_BAND, 7, True, True)
+    assert errors == [None]
+
+    expected = acix_extract.filter_samples(p_ref.bands["band02"], p_ref.bands["refqa"], p_maja.bands["SRE_B2."],
+                                           p_maja.get_mask_bool(p_maja.bands["CLM_R1"], p_maja.bands["EDG_R1"]),
+                                           negative=True, keepall=True)
+    assert sorted(samples[0]) == ["keepall", "negative", "valid"]
+    for key in expected:
+        assert numpy.array_equal(samples[0][key][0], expected[key][0] / 10000)
+        assert numpy.array_equal(samples[0][key][1], expected[key][1] / 1000)
+
+
+def test_filter_match_blockwise_empty():
+    p_ref, p_maja = get_blocks_products(0)
+    samples, errors = acix_extract.filter_match_blockwise(p_ref, [p_maja], R1_BAND, 7, True, False)
+    assert errors == [None]
+    assert sorted(samples[0]) == ["negative", "valid"]
+    for key in samples[0]:
+        assert len(samples[0][key][0]) == 0
+        assert len(samples[0][key][1]) == 0
+
+
+def test_filter_match_blockwise_block_count():
+    p_ref, p_maja = get_blocks_products(21)
+    p_maja_long = get_blocks_products(21, maja_rows=28)[1]
+    samples, errors = acix_extract.filter_match_blockwise(p_ref, [p_maja_long, p_maja], R1_BAND, 7, False, False)
+    assert samples[0] is None
+    assert isinstance(errors[0], TypeError)
+    assert errors[1] is None
+    assert len(samples[1]["valid"][0]) > 0
+
+    p_ref_long, p_maja_short = get_blocks_products(28, maja_rows=21)
+    samples, errors = acix_extract.filter_match_blockwise(p_ref_long, [p_maja_short], R1_BAND, 7, False, False)
+    assert samples[0] is None
+    assert isinstance(errors[0], TypeError)
+
+
+def get_band_samples(seed=0):
+    b_ref, m_ref_qa, b_maja, m_maja_qa = get_arrays(20, seed)
+    return acix_extract.scale_samples(acix_extract.filter_samples(b_ref, m_ref_qa, b_maja, m_maja_qa, negative=True),
+                                      10000, 10000)
+
+
+def test_checkpoint_resume(tmp_path):
+    checkpoint = str(tmp_path)
+    match = ["20171005", "ref/refsrs2-L1C_T31TFJ_A003037_20171005T104550.hdf",
+             "maja/SENTINEL2A_20171005-103241-161_L2A_T31TFJ_C_V1-0"]
+    band_samples = {"band02": get_band_samples(0), "band05": get_band_samples(1)}
+    keys = ["valid", "negative"]
+    acix_extract.write_shard(checkpoint, "site", match, band_samples, keys, resample="upsample")
+    assert sorted(os.listdir(checkpoint)) == ["site_20171005_band02_band05.npz", "site" + acix_extract.MANIFEST_SUFFIX]
+
+    manifest = acix_extract.read_manifest(os.path.join(checkpoint, "site" + acix_extract.MANIFEST_SUFFIX))
+    record = manifest[("site", "20171005", "band02", None)]
+    assert acix_extract.is_completed(checkpoint, record, match, keys, R1_BAND, "upsample")
+    samples = acix_extract.read_shard(checkpoint, record, keys)
+    for key in keys:
+        assert numpy.array_equal(samples[key][0], band_samples["band02"][key][0].astype('float32'))
+        assert numpy.array_equal(samples[key][1], band_samples["band02"][key][1].astype('float32'))
+
+    # changed products, keys or R2 resample mode
+    assert not acix_extract.is_completed(checkpoint, record, [match[0], "ref/other.hdf", match[2]], keys, R1_BAND,
+                                         "upsample")
+    assert not acix_extract.is_completed(checkpoint, record, [match[0], match[1], "maja/other"], keys, R1_BAND,
+                                         "upsample")
+    assert not acix_extract.is_completed(checkpoint, record, match, keys + ["keepall"], R1_BAND, "upsample")
+    assert acix_extract.is_completed(checkpoint, record, match, ["valid"], R1_BAND, "upsample")
+    assert acix_extract.is_completed(checkpoint, record, match, keys, R1_BAND, "downsample")
+    r2_band = ["band05", "SRE_B5.", "R2", []]
+    r2_record = manifest[("site", "20171005", "band05", None)]
+    assert acix_extract.is_completed(checkpoint, r2_record, match, keys, r2_band, "upsample")
+    assert not acix_extract.is_completed(checkpoint, r2_record, match, keys, r2_band, "downsample")
+
+    # missing band
+    assert ("site", "20171005", "band03", None) not in manifest
+    assert not acix_extract.is_completed(checkpoint, None, match, keys, R1_BAND, "upsample")
+
+
+def test_checkpoint_partial(tmp_path):
+    checkpoint = str(tmp_path)
+    keys = ["valid", "negative"]
+    matches = [[timestamp, "ref/%s.hdf" % timestamp, "maja/%s" % timestamp] for timestamp in ["20171005", "20171007"]]
+    acix_extract.write_shard(checkpoint, "site", matches[0], {"band02": get_band_samples(0)}, keys)
+    acix_extract.write_shard(checkpoint, "site", matches[1], {"band02": get_band_samples(1)}, keys, processor="p2")
+    acix_extract.write_shard(checkpoint, "other", matches[1], {"band02": get_band_samples(2)}, keys)
+
+    # run interrupted while writing the manifest, and while writing a shard
+    fname = os.path.join(checkpoint, "site" + acix_extract.MANIFEST_SUFFIX)
+    with open(fname, 'a') as f:
+        f.write('{"site": "site", "timestamp": "2017')
+    with open(os.path.join(checkpoint, "site_20171010_band02.npz.tmp"), 'wb') as f:
+        f.write(b"PK")
+
+    manifest = acix_extract.read_manifest(fname)
+    assert sorted(manifest) == [("site", "20171005", "band02", None), ("site", "20171007", "band02", "p2")]
+    assert acix_extract.is_completed(checkpoint, manifest[("site", "20171005", "band02", None)], matches[0], keys,
+                                     R1_BAND, "upsample")
+
+    # a shard lost, or left as .tmp, is extracted again
+    os.replace(os.path.join(checkpoint, "site_20171005_band02.npz"),
+               os.path.join(checkpoint, "site_20171005_band02.npz.tmp"))
+    assert not acix_extract.is_completed(checkpoint, manifest[("site", "20171005", "band02", None)], matches[0], keys,
+                                         R1_BAND, "upsample")
+
+    assert acix_extract.read_manifest(os.path.join(checkpoint, "none" + acix_extract.MANIFEST_SUFFIX)) == {}
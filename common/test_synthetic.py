@@ -0,0 +1,89 @@
+"""
+Pytest for synthetic products
+
+"""
+
+__author__ = "jerome.colin'at'cesbio.cnes.fr"
+__license__ = "MIT"
+__version__ = "1.0.3"
+
+import Collection
+import Comparison
+import Product
+import Roi
+import synthetic
+import utilities
+import numpy
+import pytest
+
+logger = utilities.get_logger('test_synthetic', verbose=True)
+
+
+def test_make_maja_dir(tmp_path):
+    path = synthetic.make_maja_dir(str(tmp_path), size=60, cloud_fraction=0.5)
+    p_maja = Product.Product_dir_maja(path, logger)
+    b4 = p_maja.get_band(p_maja.find_band("SRE_B4."), scalef=p_maja.sre_scalef)
+    b5 = p_maja.get_band(p_maja.find_band("SRE_B5."), scalef=p_maja.sre_scalef)
+    assert numpy.shape(b4) == (60, 60)
+    assert numpy.shape(b5) == (30, 30)
+    assert numpy.shape(p_maja.get_band(p_maja.find_band("ATB_R1"))) == (2, 60, 60)
+
+    mask, ratio = p_maja.get_mask(p_maja.get_band(p_maja.find_band("CLM_R1")),
+                                  p_maja.get_band(p_maja.find_band("EDG_R1")), stats=True)
+    assert 0 < ratio < 100
+
+
+def test_compute_stats_mixed_resolutions(tmp_path):
+    path = synthetic.make_maja_dir(str(tmp_path), size=60)
+    p_maja = Product.Product_dir_maja(path, logger)
+    roi_file = synthetic.write_roi_file(str(tmp_path / "rois.csv"), 5, extent=100, size=60, res=10)
+    roi_collection = Roi.Roi_collection(roi_file, 100, logger)
+
+    p_maja.band_names = ["SRE_B4.", "SRE_B8."]
+    list_stats = roi_collection.compute_stats_all_bands(p_maja, logger, batch=True)
+    list_stats_vectorized = roi_collection.compute_stats_all_bands(p_maja, logger, vectorized=True)
+    for s in range(len(list_stats)):
+        if list_stats[s] is None:
+            assert list_stats_vectorized[s] is None
+        else:
+            assert type(list_stats_vectorized[s]) == type(list_stats[s])
+            assert list_stats_vectorized[s].nobs == list_stats[s].nobs
+            assert list_stats_vectorized[s].mean == pytest.approx(list_stats[s].mean)
+
+    # R2 bands against the R1 validity mask
+    p_maja.band_names = ["SRE_B4.", "SRE_B5."]
+    with pytest.raises(SystemExit):
+        roi_collection.compute_stats_all_bands(p_maja, logger, vectorized=True)
+    with pytest.raises(SystemExit):
+        roi_collection.compute_stats_all_bands(p_maja, logger, batch=True)
+
+
+def test_make_venus_zip(tmp_path):
+    path = synthetic.make_venus_zip(str(tmp_path), size=100)
+    p_venus = Product.Product_zip_venus(path, logger)
+    assert len([b for b in p_venus.content_list if "SRE_B" in b]) == 12
+    roi_file = synthetic.write_roi_file(str(tmp_path / "rois.csv"), 5, extent=50, size=100)
+    roi_collection = Roi.Roi_collection(roi_file, 50, logger)
+    list_stats = roi_collection.compute_stats_all_bands(p_venus, logger)
+    assert len(list_stats) == 5 * 12
+
+
+def test_make_acix_site(tmp_path):
+    line = synthetic.make_acix_site(str(tmp_path), timestamps=("20171005", "20171007", "20171010"), size=40)
+    ref_collection = Collection.Collection(line.split(',')[0], logger)
+    maja_collection = Collection.Collection(line.split(',')[1], logger)
+    assert ref_collection.type_count == [0, 3, 0, 0]
+    assert maja_collection.type_count == [0, 0, 3, 0]
+
+    compare = Comparison.Comparison(ref_collection, maja_collection, logger)
+    assert len(compare.matching_products) == 3
+
+    p_ref = Product.Product_hdf_acix(compare.matching_products[0][1], logger)
+    b7 = p_ref.get_band(p_ref.find_band("band07"), scalef=p_ref.sre_scalef)
+    assert numpy.shape(b7) == (40, 40)
+    qa = p_ref.get_band(p_ref.find_band("refqa"))
+    assert numpy.max(qa) <= 1
+    assert qa.dtype == numpy.int16
+    qa_float32 = p_ref.get_band(p_ref.find_band("refqa"), dtype=numpy.float32)
+    assert qa_float32.dtype == numpy.float32
+    assert numpy.array_equal(qa_float32, qa)
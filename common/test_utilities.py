@@ -155,4 +155,69 @@ def test_APU():
     delta = utilities.delta_sr(v1, v2)
     assert utilities.accuracy(delta)    == pytest.approx(0.00415158)
     assert utilities.precision(delta)   == pytest.approx(0.02098248)
-    assert utilities.uncertainty(delta) == pytest.approx(0.02095605)
\ No newline at end of file
+    assert utilities.uncertainty(delta) == pytest.approx(0.02095605)
+
+def test_describe_labelled():
+    from scipy import stats
+    values = numpy.random.rand(1000)
+    labels = numpy.random.randint(0, 10, 1000)
+    labels[labels == 3] = 4
+    described = utilities.describe_labelled(values, labels, 11)
+    assert described['nobs'][3] == 0
+    assert described['nobs'][10] == 0
+    for l in [0, 1, 2, 4, 5, 6, 7, 8, 9]:
+        reference = stats.describe(values[labels == l])
+        assert described['nobs'][l] == reference[0]
+        assert described['min'][l] == reference[1][0]
+        assert described['max'][l] == reference[1][1]
+        assert described['mean'][l] == pytest.approx(reference[2])
+        assert described['variance'][l] == pytest.approx(reference[3])
+        assert described['skewness'][l] == pytest.approx(reference[4])
+        assert described['kurtosis'][l] == pytest.approx(reference[5])
+
+
+def test_describe_labelled_constant():
+    from scipy import stats
+    values = numpy.array([0.2, 0.2, 0.2, 0.5, 0.1, 0.3])
+    labels = numpy.array([0, 0, 0, 1, 2, 2])
+    described = utilities.describe_labelled(values, labels, 3)
+    for l in range(3):
+        reference = stats.describe(values[labels == l])
+        assert numpy.array_equal(described[['variance', 'skewness', 'kurtosis']][l].tolist(), reference[3:],
+                                 equal_nan=True)
+
+
+def test_vector_accumulator():
+    logger.debug("test_vector_accumulator")
+    acc = utilities.Vector_accumulator()
+    assert len(acc) == 0
+    assert numpy.array_equal(acc.to_array(), numpy.zeros((0)))
+
+    expected = numpy.zeros((0))
+    for n in [10, 0, 5, 20]:
+        values = numpy.random.rand(n)
+        acc.append(values)
+        expected = numpy.append(expected, values)
+    acc.append(numpy.ones((2, 3)))
+    expected = numpy.append(expected, numpy.ones((2, 3)))
+    assert len(acc) == 41
+    assert numpy.array_equal(acc.to_array(), expected)
+    assert acc.to_array() is acc.to_array()
+
+    stacked = utilities.Vector_accumulator()
+    stacked.extend(acc)
+    stacked.extend(acc)
+    assert numpy.array_equal(stacked.to_array(), numpy.append(expected, expected))
+
+
+def test_apu_from_sums():
+    logger.debug("test_apu_from_sums")
+    deltas = [numpy.random.normal(0, 0.02, 50), numpy.random.normal(0.01, 0.001, 3), numpy.zeros((4)),
+              numpy.array([0.1]), numpy.zeros((0))]
+    acc, pre, unc = utilities.apu_from_sums([len(d) for d in deltas], [numpy.sum(d) for d in deltas],
+                                            [numpy.sum(d ** 2) for d in deltas])
+    for i in range(3):
+        assert acc[i] == pytest.approx(utilities.accuracy(deltas[i]))
+        assert pre[i] == pytest.approx(utilities.precision(deltas[i]), abs=1e-9)
+        assert unc[i] == pytest.approx(utilities.uncertainty(deltas[i]))
+    assert numpy.all(numpy.isnan([acc[3], pre[3], unc[3], acc[4], pre[4], unc[4]]))
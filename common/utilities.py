@@ -16,6 +16,66 @@ import numpy as np
 from PIL import Image as pillow
 
 
+# Record layout of describe_labelled, same fields as scipy.stats.describe
+DESCRIBE_DTYPE = np.dtype([('nobs', np.int64),
+                           ('min', np.float64),
+                           ('max', np.float64),
+                           ('mean', np.float64),
+                           ('variance', np.float64),
+                           ('skewness', np.float64),
+                           ('kurtosis', np.float64)])
+
+
+class Vector_accumulator:
+    """
+    Growable 1D vector, chunks being kept in a list and concatenated once when the vector is needed. To be used
+    instead of repeated np.append, which copies the whole vector at each call
+    """
+
+    def __init__(self, dtype=None):
+        """
+        Create an empty accumulator
+        :param dtype: dtype of the empty vector, defaults to float64 as np.zeros
+        """
+        self.dtype = dtype
+        self._chunks = []
+        self._len = 0
+
+    def __len__(self):
+        return self._len
+
+    def append(self, values):
+        """
+        Append values, flattened as np.append does. Values are not copied until to_array is called
+        :param values: numpy array
+        """
+        values = np.ravel(values)
+        if len(values) > 0:
+            self._chunks.append(values)
+            self._len += len(values)
+
+    def extend(self, other):
+        """
+        Append all values of another accumulator, without copying them
+        :param other: Vector_accumulator
+        """
+        self._chunks.extend(other._chunks)
+        self._len += len(other)
+
+    def to_array(self):
+        """
+        Concatenate chunks, the result replacing them so that it is computed once
+        :return: numpy vector
+        """
+        if len(self._chunks) == 0:
+            return np.zeros((0), dtype=self.dtype)
+
+        if len(self._chunks) > 1:
+            self._chunks = [np.concatenate(self._chunks)]
+
+        return self._chunks[0]
+
+
 def accuracy(delta_sr):
     """
     Accuracy as defined in ACIX I APU criterion paper
@@ -25,6 +85,35 @@ def accuracy(delta_sr):
     return np.sum(delta_sr) / len(delta_sr)
 
 
+def apu_from_sums(count, sum_delta, sum_delta2):
+    """
+    Accuracy, precision and uncertainty as computed by accuracy, precision and uncertainty, from the count, sum and
+    sum of squares of delta_sr of one or many groups (eg. reflectance bins). Groups of less than 2 samples get NaN
+    :param count: number of samples (scalar or vector)
+    :param sum_delta: sum of delta_sr
+    :param sum_delta2: sum of delta_sr**2
+    :return: accuracy, precision, uncertainty as float64 vectors
+    """
+    count = np.atleast_1d(np.asarray(count, dtype=np.float64))
+    sum_delta = np.atleast_1d(np.asarray(sum_delta, dtype=np.float64))
+    sum_delta2 = np.atleast_1d(np.asarray(sum_delta2, dtype=np.float64))
+
+    acc = np.full(count.shape, np.nan)
+    pre = np.full(count.shape, np.nan)
+    unc = np.full(count.shape, np.nan)
+
+    enough = count > 1
+    n = count[enough]
+    acc[enough] = sum_delta[enough] / n
+    unc[enough] = np.sqrt(sum_delta2[enough] / n)
+
+    # Mimics Vermote 'newcompapu', see precision
+    var = (n / (n - 1)) * (unc[enough] ** 2 - acc[enough] ** 2)
+    pre[enough] = np.sqrt(np.maximum(var, 0))
+
+    return acc, pre, unc
+
+
 def count_nan(arr):
     """
     Count the number of NaN in arr
@@ -43,6 +132,49 @@ def count_not_nan(arr):
     return np.count_nonzero(~np.isnan(arr))
 
 
+def describe_labelled(values, labels, n_labels):
+    """
+    Vectorized equivalent of scipy.stats.describe for many groups of values at once, using labelled reductions
+    (np.bincount) instead of one call per group. Moments are computed in two passes around the group means.
+    Constant groups get a NaN skewness and kurtosis, as scipy.stats.describe does.
+    :param values: numpy vector of values
+    :param labels: numpy vector of int labels in [0, n_labels), same length as values
+    :param n_labels: number of groups
+    :return: a structured array of n_labels records with fields nobs, min, max, mean, variance, skewness, kurtosis
+    """
+    values = np.asarray(values, dtype=np.float64).ravel()
+    labels = np.asarray(labels, dtype=np.intp).ravel()
+
+    described = np.zeros(n_labels, dtype=DESCRIBE_DTYPE)
+    nobs = np.bincount(labels, minlength=n_labels)
+    described['nobs'] = nobs
+    described['min'] = np.nan
+    described['max'] = np.nan
+
+    # min and max from the first and last value of each group once sorted by label then by value
+    has_obs = nobs > 0
+    ends = np.cumsum(nobs)
+    sorted_values = values[np.lexsort((values, labels))]
+    described['min'][has_obs] = sorted_values[(ends - nobs)[has_obs]]
+    described['max'][has_obs] = sorted_values[ends[has_obs] - 1]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = np.bincount(labels, weights=values, minlength=n_labels) / nobs
+        dev = values - mean[labels]
+        m2 = np.bincount(labels, weights=dev ** 2, minlength=n_labels) / nobs
+        m3 = np.bincount(labels, weights=dev ** 3, minlength=n_labels) / nobs
+        m4 = np.bincount(labels, weights=dev ** 4, minlength=n_labels) / nobs
+        # same threshold as scipy.stats.skew and scipy.stats.kurtosis
+        is_constant = m2 <= (np.finfo(np.float64).eps * mean) ** 2
+
+        described['mean'] = mean
+        described['variance'] = m2 * nobs / (nobs - 1)
+        described['skewness'] = np.where(is_constant, np.nan, m3 / m2 ** 1.5)
+        described['kurtosis'] = np.where(is_constant, np.nan, m4 / m2 ** 2 - 3)
+
+    return described
+
+
 def delta_sr(processor_sr, aeronet_sr):
     """
     Convention in ACIX I paper
@@ -53,22 +185,26 @@ def delta_sr(processor_sr, aeronet_sr):
     return processor_sr - aeronet_sr
 
 
-def get_logger(name, verbose=False):
+def get_logger(name, verbose=False, log_file=True):
     """
     Simple logger
     :param name: eg. the app name
     :param verbose: sets DEBUG level if True
+    :param log_file: log to a <name>_<date>.log file in the current directory if True, to stderr otherwise
     :return: logger object
     """
     logger = logging.getLogger(name)
-    #logging_file = name + '_' + str(uuid.uuid4())[0:8] + '.log'
-    logging_file = name + '_' + datetime.now().strftime("%y%m%d%H%M") + '.log'
-    try:
-        os.remove(logging_file)
-    except FileNotFoundError:
-        pass
-
-    logging_handler = logging.FileHandler(logging_file)
+    if log_file:
+        #logging_file = name + '_' + str(uuid.uuid4())[0:8] + '.log'
+        logging_file = name + '_' + datetime.now().strftime("%y%m%d%H%M") + '.log'
+        try:
+            os.remove(logging_file)
+        except FileNotFoundError:
+            pass
+
+        logging_handler = logging.FileHandler(logging_file)
+    else:
+        logging_handler = logging.StreamHandler()
     logging_formatter = logging.Formatter('%(asctime)s %(levelname)s %(message)s')
     logging_handler.setFormatter(logging_formatter)
     logger.addHandler(logging_handler)
@@ -4,6 +4,7 @@ import common.utilities as utl
 import common.Product as prd
 import common.Collection as clc
 import common.Comparison as cmp
+import common.Catalog as ctl
 import sys
 import argparse
 from mpl_toolkits.axes_grid1 import make_axes_locatable
@@ -17,6 +18,15 @@ def main():
     parser.add_argument("--hist", help="Display quicklooks with histograms", action="store_true", default=False)
     parser.add_argument("--keepall", help="Display quicklooks with histograms with keep_all", action="store_true",
                         default=False)
+    parser.add_argument("--catalog", help="Catalog of collections and products (SQLite file, eg. %s), none by "
+                                          "default" % ctl.DEFAULT_NAME, type=str, default=None)
+    parser.add_argument("--rebuild-catalog", help="Drop all entries of the catalog first", action="store_true",
+                        default=False)
+    parser.add_argument("--recursive", help="Search products in sub-directories of collections without a YYYYMMDD "
+                                            "pattern in their name (nested site layouts)", action="store_true",
+                        default=False)
+    parser.add_argument("--tolerance", help="Match products up to TOLERANCE days apart, the nearest in time, defaults "
+                                            "to 0 (same date)", type=int, default=0)
     parser.add_argument("-v", "--verbose", help="Set verbosity to DEBUG level", action="store_true", default=False)
 
     args = parser.parse_args()
@@ -41,6 +51,11 @@ def main():
         ["band11", "SRE_B11.", "R2", []],
         ["band12", "SRE_B12.", "R2", []])
 
+    if args.catalog:
+        catalog = ctl.Catalog(args.catalog, logger, rebuild=args.rebuild_catalog)
+    else:
+        catalog = None
+
     f = open(args.list, 'r')
     paths_list = f.read().splitlines()
 
@@ -48,14 +63,14 @@ def main():
         paths = p.split(',')
         location_name = paths[0].split('/')[-1]
 
-        acix_vermote_collection = clc.Collection(paths[0], logger)
-        acix_maja_collection = clc.Collection(paths[1], logger)
-        compare = cmp.Comparison(acix_vermote_collection, acix_maja_collection, logger)
+        acix_vermote_collection = clc.Collection(paths[0], logger, recursive=args.recursive, catalog=catalog)
+        acix_maja_collection = clc.Collection(paths[1], logger, recursive=args.recursive, catalog=catalog)
+        compare = cmp.Comparison(acix_vermote_collection, acix_maja_collection, logger, tolerance=args.tolerance)
 
         for match in compare.matching_products:
             logger.info("One-by-one for %s between %s and %s" % (match[0], match[1], match[2]))
-            p_ref = prd.Product_hdf_acix(match[1], logger)
-            p_maja = prd.Product_dir_maja(match[2], logger)
+            p_ref = prd.Product_hdf_acix(match[1], logger, catalog=catalog)
+            p_maja = prd.Product_dir_maja(match[2], logger, catalog=catalog)
             timestamp = match[0]
 
             try:
@@ -63,16 +78,16 @@ def main():
                 b_ref_b3 = p_ref.get_band(p_ref.find_band(bdef_acix[1][0]), scalef=p_ref.sre_scalef)
                 b_ref_b4 = p_ref.get_band(p_ref.find_band(bdef_acix[2][0]), scalef=p_ref.sre_scalef)
                 b_ref_b8 = p_ref.get_band(p_ref.find_band(bdef_acix[6][0]), scalef=p_ref.sre_scalef)
-                m_ref_qa = p_ref.get_band(p_ref.find_band("refqa"))
                 b_maja_b2 = p_maja.get_band(p_maja.find_band(bdef_acix[0][1]), scalef=p_maja.sre_scalef)
                 b_maja_b3 = p_maja.get_band(p_maja.find_band(bdef_acix[1][1]), scalef=p_maja.sre_scalef)
                 b_maja_b4 = p_maja.get_band(p_maja.find_band(bdef_acix[2][1]), scalef=p_maja.sre_scalef)
                 b_maja_b8 = p_maja.get_band(p_maja.find_band(bdef_acix[6][1]), scalef=p_maja.sre_scalef)
-                b_maja_aot = p_maja.get_band(p_maja.find_band("ATB_R1"), layer=1, scalef=p_maja.aot_scalef)
-                b_maja_vap = p_maja.get_band(p_maja.find_band("ATB_R1"), layer=0, scalef=p_maja.vap_scalef)
-                clm = p_maja.get_band(p_maja.find_band("CLM_" + bdef_acix[0][2]))
-                edg = p_maja.get_band(p_maja.find_band("EDG_" + bdef_acix[0][2]))
-                m_maja_qa, ratio = p_maja.get_mask(clm, edg, stats=True)
+                b_maja_aot, b_maja_vap = p_maja.get_layers(p_maja.find_band(p_maja.aot_name),
+                                                           [p_maja.aot_layer, p_maja.vap_layer],
+                                                           scalefs=[p_maja.aot_scalef, p_maja.vap_scalef])
+                m_maja_qa, ratio = p_maja.get_validity_mask(bdef_acix[0][2], stats=True)
+                m_ref_qa = p_ref.get_validity_mask()
+                m_qa = m_ref_qa & m_maja_qa
 
                 if args.hist:
                     fig, axs = pl.subplots(nrows=3, ncols=3, figsize=[12, 12])
@@ -134,10 +149,7 @@ def main():
 
                     # B2
                     if args.keepall:
-                        is_valid = np.where(
-                            (m_ref_qa == 1)
-                            & (m_maja_qa == 1)
-                        )
+                        is_valid = np.where(m_qa)
                         min_sr = -0.1
                         max_sr = 0.7
                         is_log = False
@@ -152,8 +164,7 @@ def main():
                         is_valid = np.where(
                             (b_ref_b2 > 0)
                             & (b_maja_b2 > 0)
-                            & (m_ref_qa == 1)
-                            & (m_maja_qa == 1)
+                            & m_qa
                         )
                         min_sr = 0
                         max_sr = 1
@@ -182,10 +193,7 @@ def main():
 
                     # B3
                     if args.keepall:
-                        is_valid = np.where(
-                            (m_ref_qa == 1)
-                            & (m_maja_qa == 1)
-                        )
+                        is_valid = np.where(m_qa)
                         min_sr = -0.1
                         max_sr = 0.7
                         is_log = False
@@ -200,8 +208,7 @@ def main():
                         is_valid = np.where(
                             (b_ref_b3 > 0)
                             & (b_maja_b3 > 0)
-                            & (m_ref_qa == 1)
-                            & (m_maja_qa == 1)
+                            & m_qa
                         )
                         min_sr = 0
                         max_sr = 1
@@ -228,10 +235,7 @@ def main():
 
                     # B4
                     if args.keepall:
-                        is_valid = np.where(
-                            (m_ref_qa == 1)
-                            & (m_maja_qa == 1)
-                        )
+                        is_valid = np.where(m_qa)
                         min_sr = -0.1
                         max_sr = 0.7
                         is_log = False
@@ -246,8 +250,7 @@ def main():
                         is_valid = np.where(
                             (b_ref_b4 > 0)
                             & (b_maja_b4 > 0)
-                            & (m_ref_qa == 1)
-                            & (m_maja_qa == 1)
+                            & m_qa
                         )
                         min_sr = 0
                         max_sr = 1
@@ -274,10 +277,7 @@ def main():
 
                     # B8
                     if args.keepall:
-                        is_valid = np.where(
-                            (m_ref_qa == 1)
-                            & (m_maja_qa == 1)
-                        )
+                        is_valid = np.where(m_qa)
                         min_sr = -0.1
                         max_sr = 0.7
                         is_log = False
@@ -293,8 +293,7 @@ def main():
                         is_valid = np.where(
                             (b_ref_b8 > 0)
                             & (b_maja_b8 > 0)
-                            & (m_ref_qa == 1)
-                            & (m_maja_qa == 1)
+                            & m_qa
                         )
                         min_sr = 0
                         max_sr = 1
@@ -15,6 +15,7 @@ import argparse
 import common.utilities as utl
 import common.Product
 import common.Roi
+import common.Catalog
 
 
 def main():
@@ -24,20 +25,37 @@ def main():
     parser.add_argument("coordinates", help="coordinate file")
     parser.add_argument("-e", "--extent", type=int, \
                         help="extent of the square ROI (meters), defaults to 100", default=100)
+    parser.add_argument("-b", "--batch", help="Read each band once for all ROIs instead of once per ROI",
+                        action="store_true", default=False)
+    parser.add_argument("--vectorized", help="Batch mode computing statistics of all ROIs at once",
+                        action="store_true", default=False)
+    parser.add_argument("-w", "--workers", type=int, help="number of processes to spread ROIs over, defaults to 1",
+                        default=1)
+    parser.add_argument("--catalog", help="Catalog of collections and products (SQLite file, eg. %s), none by "
+                                          "default" % common.Catalog.DEFAULT_NAME, type=str, default=None)
+    parser.add_argument("--rebuild-catalog", help="Drop all entries of the catalog first", action="store_true",
+                        default=False)
     parser.add_argument("-v", "--verbose", help="Set verbosity to DEBUG level", action="store_true", default=False)
     args = parser.parse_args()
 
     # Create the logger
     logger = utl.get_logger('roistats', args.verbose)
 
+    if args.catalog:
+        catalog = common.Catalog.Catalog(args.catalog, logger, rebuild=args.rebuild_catalog)
+    else:
+        catalog = None
+
     # Create a Venus product object
-    vns_product = common.Product.Product_zip_venus(args.product, logger)
+    vns_product = common.Product.Product_zip_venus(args.product, logger, catalog=catalog)
 
     # Create an roi collection
     roi_collection = common.Roi.Roi_collection(args.coordinates, args.extent, logger)
 
     # Compute statistics for a given product
-    list_stats = roi_collection.compute_stats_all_bands(vns_product, logger, stdout=True, withAOT=True, withVAP=True)
+    list_stats = roi_collection.compute_stats_all_bands(vns_product, logger, stdout=True, withAOT=True, withVAP=True,
+                                                         batch=args.batch, vectorized=args.vectorized,
+                                                         workers=args.workers)
 
     sys.exit(0)
 